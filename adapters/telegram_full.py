@@ -24,9 +24,11 @@ from aiogram.enums import ParseMode
 # Import core modules
 from core.converter import convert_cny_to_kgs, convert_kgs_to_cny, format_conversion_result, get_currency
 from database import Database
-from news_scheduler import NewsScheduler, run_scheduler_once
-from news_aggregator import NewsAggregator
+from news_scheduler import NewsScheduler
+from news_aggregator import NewsAggregator, format_news_search
 from image_generator import ImageGenerator, DeepSeekChat
+from llm import get_client, OpenRouterError, ChatSummarizer, InflightRequests
+from telegram_streaming import StreamingReply
 from crypto_tracker import crypto
 
 # Optional imports
@@ -55,7 +57,9 @@ def clean_text_for_tts(text):
 class FullTelegramBot:
     """Full-featured Telegram bot with all capabilities."""
     
-    def __init__(self):
+    CONTACTS_PAGE_SIZE = 10
+    
+    def __init__(self, services=None):
         self.api_token = os.environ.get("TELEGRAM_API_TOKEN")
         if not self.api_token:
             logger.error("TELEGRAM_API_TOKEN not set!")
@@ -69,16 +73,25 @@ class FullTelegramBot:
         # Load config
         self.config = self._load_config()
         
-        # Initialize services
-        self.db = Database()
+        # Initialize services (shared ones from main.py when provided)
+        self.services = services
+        self.db = services.db if services else Database()
         self.image_gen = ImageGenerator()
         self.deepseek_chat = DeepSeekChat()
-        self.news_agg = NewsAggregator(self.db)
+        self.news_agg = services.news_aggregator if services else NewsAggregator(self.db)
+        self.news_scheduler = NewsScheduler(self.bot, self.db, self.news_agg)
+        self._background_tasks = []
         
         # API keys
         self.OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY") or self.config.get("openrouter_api_key", "")
         self.WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", self.config.get("weather_api_key", ""))
-        self.OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+        # Shared OpenRouter client (config.json key applies when the env var is unset)
+        self.llm = get_client(self.OPENROUTER_API_KEY)
+        if not services:
+            self.llm.usage.attach(self.db)
+        self.summarizer = ChatSummarizer(self.db, self.llm)
+        # One generation per chat; newer messages supersede or join the running one
+        self.inflight = InflightRequests()
         
         # Admin config
         self.ADMIN_ID = int(os.environ.get("ADMIN_ID", "0"))
@@ -118,7 +131,7 @@ class FullTelegramBot:
     
     async def check_banned(self, message: Message) -> bool:
         """Check and notify if user is banned."""
-        ban_info = self.db.is_banned(message.from_user.id)
+        ban_info = self.db.is_banned(message.from_user.id)  # in-memory ACL, no I/O
         if ban_info:
             await message.reply(
                 f"⛔ <b>Вы заблокированы</b>\n\n"
@@ -224,7 +237,7 @@ class FullTelegramBot:
             await message.reply(welcome_text, parse_mode=ParseMode.HTML, reply_markup=get_main_keyboard(user.id))
 
             # Register user in DB
-            self.db.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
+            await self.db.aio.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
 
         @self.dp.message(Command("help"))
         async def cmd_help(message: Message):
@@ -246,7 +259,8 @@ class FullTelegramBot:
                 "   • <code>/image описание</code> — картинка\n\n"
                 "<b>📰 НОВОСТИ:</b>\n"
                 "   • <code>📰 Новости</code> — лента\n"
-                "   • <code>📰 AI Дайджест</code> — анализ\n\n"
+                "   • <code>📰 AI Дайджест</code> — анализ\n"
+                "   • <code>/find запрос</code> — поиск по новостям\n\n"
                 "<b>💰 КРИПТО:</b>\n"
                 "   • <code>💰 Криптовалюты</code> — курсы\n"
                 "   • <code>📈 Мой Портфель</code> — трекинг\n\n"
@@ -415,42 +429,44 @@ class FullTelegramBot:
                 )
                 return
 
-            # Check if user has chat history
-            history = self.db.get_chat_history(user_id, limit=10)
+            # Saved first, so a generation that starts later for this chat answers it too
+            await self.db.aio.add_message(user_id, "user", prompt)
 
             # Show typing
             await self.bot.send_chat_action(message.chat.id, "typing")
+            status_msg = await message.reply("🤖 Думаю над ответом...")
 
-            try:
-                # Use DeepSeek R1
-                response = await self.deepseek_chat.chat(prompt, history)
+            # Stream DeepSeek R1 into the status message, with the recent conversation as context
+            reply = StreamingReply(status_msg, header="🤖 AI Ответ\n\n")
 
-                if response:
-                    # Save to history
-                    self.db.add_chat_message(user_id, "user", prompt)
-                    self.db.add_chat_message(user_id, "assistant", response)
+            async def generate():
+                history = await self.db.aio.get_chat_context(user_id)
+                return await reply.consume(self.deepseek_chat.stream(history, user_id=user_id))
 
-                    # Send response with formatting
-                    if len(response) > 4000:
-                        parts = [response[i:i+4000] for i in range(0, len(response), 4000)]
-                        for i, part in enumerate(parts):
-                            header = f"🤖 <b>AI Ответ (часть {i+1}/{len(parts)})</b>\n\n" if len(parts) > 1 else "🤖 <b>AI Ответ</b>\n\n"
-                            await message.reply(header + part, parse_mode=ParseMode.HTML)
-                    else:
-                        await message.reply(
-                            f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
-                            f"       🤖 <b>AI Ответ</b>\n"
-                            f"┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛\n\n"
-                            f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                            f"{response}",
-                            parse_mode=ParseMode.HTML
-                        )
+            try:
+                response = await self.inflight.run(user_id, generate)
+            except OpenRouterError as e:
+                logger.error(f"DeepSeek error: {e}")
+                if e.status == 429:
+                    error_text = "❌ Превышен лимит запросов. Попробуйте позже."
+                elif reply.text:
+                    error_text = "⚠️ Ответ прерван. Попробуйте ещё раз."
                 else:
-                    await message.reply("❌ Не удалось получить ответ от AI. Попробуйте позже.")
-
+                    error_text = "❌ Не удалось получить ответ от AI. Попробуйте позже."
+                await reply.fail(error_text)
+                return
             except Exception as e:
                 logger.error(f"DeepSeek error: {e}")
-                await message.reply("❌ Ошибка при обработке запроса. Попробуйте позже.")
+                await reply.fail("❌ Ошибка при обработке запроса. Попробуйте позже.")
+                return
+
+            if response is None:
+                # A newer message took over the chat and is answered together with this one
+                await reply.fail("↪️ Отвечу на это вместе с вашим следующим сообщением.")
+                return
+
+            await self.db.aio.add_message(user_id, "assistant", response)
+            self.summarizer.schedule(user_id)
 
         @self.dp.message(lambda msg: msg.text and "AI Ассистент" in msg.text)
         async def btn_ai_chat(message: Message):
@@ -557,7 +573,7 @@ class FullTelegramBot:
 
             try:
                 # Get news for Kyrgyzstan by default
-                news = self.db.get_news_by_categories(["kyrgyzstan"], limit=5)
+                news = await self.db.aio.get_news_by_categories(["kyrgyzstan"], limit=5)
 
                 if not news:
                     await message.reply("📰 Новости временно недоступны. Попробуйте позже.")
@@ -585,6 +601,21 @@ class FullTelegramBot:
                 logger.error(f"News error: {e}")
                 await message.reply("❌ Ошибка при получении новостей.")
         
+        @self.dp.message(Command("find"))
+        async def find_news(message: Message):
+            """Full-text search over stored news."""
+            if await self.check_banned(message):
+                return
+
+            query = message.text.partition(" ")[2].strip()
+            if not query:
+                await message.reply("Использование: /find запрос\nНапример: /find бишкек выборы")
+                return
+
+            results = await self.db.aio.search_news(query, limit=10)
+            await message.reply(format_news_search(query, results), parse_mode=ParseMode.HTML,
+                                disable_web_page_preview=True)
+
         @self.dp.message(Command("digest"))
         async def get_digest(message: Message):
             if await self.check_banned(message):
@@ -593,7 +624,7 @@ class FullTelegramBot:
             await self.bot.send_chat_action(message.chat.id, "typing")
 
             try:
-                digest = self.news_agg.generate_digest("kyrgyzstan")
+                digest = await self.db.aio.run(self.news_agg.generate_digest, ["kyrgyzstan"])
 
                 if digest:
                     # Split if too long
@@ -638,7 +669,7 @@ class FullTelegramBot:
             await self.bot.send_chat_action(message.chat.id, "typing")
 
             try:
-                digest = self.news_agg.generate_digest("kyrgyzstan")
+                digest = await self.db.aio.run(self.news_agg.generate_digest, ["kyrgyzstan"])
 
                 if digest:
                     # Split if too long
@@ -682,7 +713,8 @@ class FullTelegramBot:
                 return
 
             user_id = message.from_user.id
-            contacts = self.db.get_all_contacts()
+            contacts = (await self.db.aio.get_contacts_page(limit=5))['contacts']
+            total_contacts = await self.db.aio.get_contact_count() if contacts else 0
 
             # Create inline keyboard for contact actions
             inline_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -697,14 +729,14 @@ class FullTelegramBot:
                     f"       📇 <b>Контакты</b>\n"
                     f"┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛\n\n"
                     f"━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                    f"📊 <b>Всего:</b> {len(contacts)}\n\n"
+                    f"📊 <b>Всего:</b> {total_contacts}\n\n"
                 )
-                for c in contacts[:5]:
+                for c in contacts:
                     name = c.get('name', 'Без имени')
                     phone = c.get('phone', 'Нет телефона')
                     text += f"• <b>{name}</b>\n  📞 {phone}\n\n"
-                if len(contacts) > 5:
-                    text += f"📄 ... и ещё {len(contacts) - 5} контактов\n\n"
+                if total_contacts > len(contacts):
+                    text += f"📄 ... и ещё {total_contacts - len(contacts)} контактов\n\n"
                 text += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
             else:
                 text = (
@@ -747,8 +779,22 @@ class FullTelegramBot:
                     parse_mode=ParseMode.HTML
                 )
 
-            elif action == "list":
-                contacts = self.db.get_contacts(user_id)
+            elif action == "list" or action.startswith(("next_", "prev_")):
+                # Keyset pages of the user's own contacts; the cursor is a contact id
+                direction, _, cursor_id = action.partition("_")
+                cursor_id = int(cursor_id) if cursor_id.isdigit() else None
+                page = await self.db.aio.get_contacts_page(
+                    after_id=cursor_id if direction == "next" else None,
+                    before_id=cursor_id if direction == "prev" else None,
+                    limit=self.CONTACTS_PAGE_SIZE, added_by=user_id
+                )
+                contacts = page['contacts']
+                nav = []
+                if contacts and page['has_prev']:
+                    nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"contact_prev_{contacts[0]['id']}"))
+                if contacts and page['has_next']:
+                    nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"contact_next_{contacts[-1]['id']}"))
+                list_kb = InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
                 if contacts:
                     text = (
                         f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
@@ -769,7 +815,7 @@ class FullTelegramBot:
                         f"📭 <i>У вас нет сохранённых контактов</i>"
                     )
 
-                await callback_query.message.edit_text(text, parse_mode=ParseMode.HTML)
+                await callback_query.message.edit_text(text, parse_mode=ParseMode.HTML, reply_markup=list_kb)
 
             await callback_query.answer()
         
@@ -831,7 +877,7 @@ class FullTelegramBot:
                 return
 
             user_id = message.from_user.id
-            portfolio = self.db.get_user_portfolio(user_id)
+            portfolio = await self.db.aio.get_user_portfolio(user_id)
 
             if not portfolio:
                 await message.reply(
@@ -889,7 +935,7 @@ class FullTelegramBot:
                 await message.reply("⛔ У вас нет доступа к админ-панели.")
                 return
 
-            stats = self.db.get_admin_stats()
+            stats = await self.db.aio.get_admin_stats()
 
             text = (
                 f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
@@ -918,16 +964,16 @@ class FullTelegramBot:
                 await message.reply("Использование: /broadcast текст сообщения")
                 return
 
-            users = self.db.get_all_users()
+            total_users = await self.db.aio.get_user_count()
             sent = 0
             failed = 0
 
-            status_msg = await message.reply(f"📤 <b>Начинаю рассылку для {len(users)} пользователей...</b>")
+            status_msg = await message.reply(f"📤 <b>Начинаю рассылку для {total_users} пользователей...</b>")
 
-            for user in users:
+            async for user in self.db.aio.iter_users():
                 try:
                     await self.bot.send_message(
-                        user['id'],
+                        user['telegram_id'],
                         f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
                         f"       📢 <b>Сообщение от админа</b>\n"
                         f"┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛\n\n"
@@ -938,7 +984,7 @@ class FullTelegramBot:
                     sent += 1
                 except Exception as e:
                     failed += 1
-                    logger.error(f"Broadcast failed for {user['id']}: {e}")
+                    logger.error(f"Broadcast failed for {user['telegram_id']}: {e}")
 
             await status_msg.edit_text(
                 f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
@@ -994,7 +1040,7 @@ class FullTelegramBot:
                     phone = text
 
                     try:
-                        self.db.add_contact(name, phone, user_id)
+                        await self.db.aio.add_contact(name, phone, user_id)
                         await message.reply(
                             f"┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓\n"
                             f"       ✅ <b>Готово!</b>\n"
@@ -1013,9 +1059,7 @@ class FullTelegramBot:
 
                 elif state == "awaiting_contact_search":
                     # Search contacts (filter by user's contacts)
-                    all_contacts = self.db.get_contacts(user_id)
-                    query = text.lower()
-                    contacts = [c for c in all_contacts if query in c.get('name', '').lower() or query in c.get('phone', '').lower()]
+                    contacts = await self.db.aio.search_contacts(text, added_by=user_id)
 
                     if contacts:
                         result_text = (
@@ -1089,8 +1133,7 @@ class FullTelegramBot:
 
         logger.info("Full Telegram bot started!")
 
-        # Start news scheduler in background
-        scheduler_task = asyncio.create_task(self._run_scheduler())
+        self.start_background()
 
         try:
             if use_webhook:
@@ -1112,15 +1155,31 @@ class FullTelegramBot:
                 logger.info("Telegram bot running in polling mode (local)")
                 await self.dp.start_polling(self.bot)
         finally:
-            scheduler_task.cancel()
+            await self.stop_background()
+    
+    def start_background(self):
+        """Start hourly news collection and scheduled digests (polling and webhook modes)"""
+        if self._background_tasks:
+            return
+        self._background_tasks = [
+            asyncio.create_task(self._run_scheduler()),
+            asyncio.create_task(self.news_scheduler.start(collect=False)),
+        ]
+    
+    async def stop_background(self):
+        self.news_scheduler.stop()
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
     
     async def _run_scheduler(self):
-        """Run news scheduler in background."""
+        """Collect news every hour; digests are sent by news_scheduler."""
         try:
-            scheduler = NewsScheduler(self.db)
             while True:
                 try:
-                    run_scheduler_once(scheduler, self.news_agg, self.bot)
+                    count = await self.news_agg.process_and_save_news()
+                    logger.info(f"Collected {count} news items")
                 except Exception as e:
                     logger.error(f"Scheduler error: {e}")
                 await asyncio.sleep(3600)  # Check every hour
@@ -24,19 +24,21 @@ class WhatsAppWebhookBot:
     Better suited for Railway deployment than polling.
     """
 
-    def __init__(self):
+    def __init__(self, services=None):
         self.id_instance = os.environ.get("GREEN_API_ID")
         self.api_token = os.environ.get("GREEN_API_TOKEN")
 
         # User states for multi-step interactions
         self.user_states = {}
         self.user_contexts = {}
+        self.services = services
+        self._session = None
 
         # Initialize services
         if self.id_instance and self.api_token:
             self.enabled = True
-            self.db = Database()
-            self.news_agg = NewsAggregator(self.db)
+            self.db = services.db if services else Database()
+            self.news_agg = services.news_aggregator if services else NewsAggregator(self.db)
             logger.info(f"WhatsApp Webhook bot initialized (ID: {self.id_instance[:5]}...)")
         else:
             logger.warning("Green API credentials not set! WhatsApp bot disabled.")
@@ -47,7 +49,6 @@ class WhatsAppWebhookBot:
         if not self.enabled:
             return False
 
-        import aiohttp
         api_url = "https://api.green-api.com"
         url = f"{api_url}/waInstance{self.id_instance}/SendMessage/{self.api_token}"
         payload = {
@@ -56,19 +57,26 @@ class WhatsAppWebhookBot:
         }
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, timeout=30) as response:
-                    if response.status == 200:
-                        logger.info(f"WhatsApp message sent to {chat_id}")
-                        return True
-                    else:
-                        text = await response.text()
-                        logger.error(f"Failed to send WhatsApp message: {text}")
-                        return False
+            async with self._http().post(url, json=payload, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    logger.info(f"WhatsApp message sent to {chat_id}")
+                    return True
+                else:
+                    text = await response.text()
+                    logger.error(f"Failed to send WhatsApp message: {text}")
+                    return False
         except Exception as e:
             logger.error(f"Error sending WhatsApp message: {e}")
             return False
 
+    def _http(self) -> aiohttp.ClientSession:
+        """Keep-alive session: the shared one, or our own when run standalone"""
+        if self.services:
+            return self.services.http_session()
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
     async def send_menu(self, chat_id):
         """Send main menu."""
         logger.info(f"Preparing to send menu to {chat_id}")
@@ -233,7 +241,7 @@ class WhatsAppWebhookBot:
     async def _send_news(self, chat_id):
         """Send latest news."""
         try:
-            news = self.news_agg.get_news_by_category("kyrgyzstan", limit=5)
+            news = await self.db.aio.get_news_by_categories(["kyrgyzstan"], limit=5)
 
             if not news:
                 await self.send_message(chat_id, "📰 Новости временно недоступны.")
@@ -255,7 +263,7 @@ class WhatsAppWebhookBot:
         """Send AI digest."""
         try:
             await self.send_message(chat_id, "⏳ Генерирую AI дайджест...")
-            digest = self.news_agg.generate_digest("kyrgyzstan")
+            digest = await self.db.aio.run(self.news_agg.generate_digest, ["kyrgyzstan"])
 
             if digest:
                 # WhatsApp has 4096 char limit, split if needed
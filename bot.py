@@ -12,8 +12,12 @@ from datetime import datetime, timedelta, timezone
 import xml.etree.ElementTree as ET
 from database import Database
 from news_scheduler import NewsScheduler, run_scheduler_once
-from news_aggregator import NewsAggregator
+from news_aggregator import NewsAggregator, format_news_search
+from db_metrics import format_query_stats
 from image_generator import ImageGenerator, DeepSeekChat
+from llm import (get_client, OpenRouterError, UserRateLimited, format_model_health, format_cache_stats,
+                 format_llm_usage, ChatSummarizer, InflightRequests)
+from telegram_streaming import StreamingReply
 from crypto_tracker import crypto
 
 try:
@@ -56,8 +60,6 @@ logging.info(f'OPENROUTER_API_KEY source: {key_source}, length: {len(OPENROUTER_
 logging.info(f'OPENROUTER_API_KEY value: {OPENROUTER_API_KEY[:25]}...')
 WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", config.get("weather_api_key", "YOUR_OPENWEATHERMAP_API_KEY"))
 
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-
 # Webhook configuration (for production)
 WEBHOOK_HOST = os.environ.get("RAILWAY_PUBLIC_DOMAIN", "")  # Railway provides this automatically
 WEBHOOK_PATH = "/webhook"
@@ -68,8 +70,15 @@ dp = Dispatcher()
 
 # Initialize database
 db = Database()
+news_aggregator = NewsAggregator(db)
 
 # Initialize AI services
+llm_client = get_client(OPENROUTER_API_KEY)
+llm_client.usage.attach(db)
+# Folds older turns into a per-user summary after replies
+summarizer = ChatSummarizer(db, llm_client)
+# One generation per chat; newer messages supersede or join the running one
+inflight = InflightRequests()
 image_gen = ImageGenerator()
 deepseek_chat = DeepSeekChat()
 
@@ -91,7 +100,7 @@ def is_banned(user_id: int) -> bool:
 
 async def check_banned(message: types.Message) -> bool:
     """Check and notify if user is banned"""
-    ban_info = db.is_banned(message.from_user.id)
+    ban_info = db.is_banned(message.from_user.id)  # in-memory ACL, no I/O
     if ban_info:
         await message.reply(
             f"⛔ <b>Вы заблокированы</b>\n\n"
@@ -121,12 +130,16 @@ main_keyboard = ReplyKeyboardMarkup(
     one_time_keyboard=False
 )
 
-async def show_all_contacts(message: types.Message):
-    """Show all contacts from database"""
-    user_id = message.from_user.id
-    contacts_list = db.get_all_contacts()
+CONTACTS_PAGE_SIZE = 8
+
+async def show_all_contacts(message: types.Message, after_id: int = None,
+                            before_id: int = None, edit: bool = False):
+    """Show contacts from database, one keyset page at a time"""
+    page = await db.aio.get_contacts_page(after_id=after_id, before_id=before_id,
+                                          limit=CONTACTS_PAGE_SIZE)
+    contacts_list = page['contacts']
     
-    if not contacts_list:
+    if not contacts_list and after_id is None and before_id is None:
         # Show keyboard with Add Contact button
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="➕ Добавить контакт", callback_data="contact:add")]
@@ -141,9 +154,21 @@ async def show_all_contacts(message: types.Message):
             callback_data=f"contact:{contact['id']}"
         )])
     
+    # Page cursors are contact ids, so callback_data stays well under 64 bytes
+    nav = []
+    if page['has_prev'] and contacts_list:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"contact:prev:{contacts_list[0]['id']}"))
+    if page['has_next'] and contacts_list:
+        nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"contact:next:{contacts_list[-1]['id']}"))
+    if nav:
+        rows.append(nav)
+    
     rows.append([InlineKeyboardButton(text="➕ Добавить контакт", callback_data="contact:add")])
     kb = InlineKeyboardMarkup(inline_keyboard=rows)
-    await message.reply('Выберите контакт:', reply_markup=kb)
+    if edit:
+        await message.edit_text('Выберите контакт:', reply_markup=kb)
+    else:
+        await message.reply('Выберите контакт:', reply_markup=kb)
 
 
 async def contact_callback_handler(callback: types.CallbackQuery):
@@ -170,10 +195,22 @@ async def contact_callback_handler(callback: types.CallbackQuery):
         await show_all_contacts(callback.message)
         return
     
+    if action.startswith(('next:', 'prev:')):
+        direction, _, cursor_id = action.partition(':')
+        try:
+            cursor_id = int(cursor_id)
+        except ValueError:
+            return
+        if direction == 'next':
+            await show_all_contacts(callback.message, after_id=cursor_id, edit=True)
+        else:
+            await show_all_contacts(callback.message, before_id=cursor_id, edit=True)
+        return
+    
     # Show contact details
     try:
         contact_id = int(action)
-        contact = db.get_contact_by_id(contact_id)
+        contact = await db.aio.get_contact_by_id(contact_id)
         if contact:
             kb = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text='Вернуться', callback_data='contact:back')]
@@ -206,13 +243,9 @@ async def ensure_auth(message: types.Message) -> bool:
     await message.reply('Доступ закрыт. Отправьте /start и введите пароль.')
     return False
 
-# Function to query OpenRouter API (sync) with fallback models
-def query_deepseek_sync(messages):
-    if not OPENROUTER_API_KEY:
-        return "OPENROUTER_API_KEY не установлен. Установите переменную окружения OPENROUTER_API_KEY."
-    
-    # List of models to try (with fallback)
-    models_to_try = [
+# OpenRouter fallback chain, tried in order
+def chat_models():
+    return [
         config.get("default_model", "openrouter/free"),
         "deepseek/deepseek-r1-0528:free",
         "arcee-ai/trinity-large-preview:free",
@@ -220,59 +253,21 @@ def query_deepseek_sync(messages):
         "stepfun/step-3.5-flash:free",
         "google/gemini-2.5-flash-lite"
     ]
+
+# Query OpenRouter with fallback models (shared async client, no thread hop)
+async def query_deepseek(messages, user_id: int = None):
+    if not OPENROUTER_API_KEY:
+        return "OPENROUTER_API_KEY не установлен. Установите переменную окружения OPENROUTER_API_KEY."
     
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    last_error = None
-    
-    for model in models_to_try:
-        try:
-            logging.info(f"[OpenRouter] Попытка использовать модель: {model}")
-            
-            data = {
-                "model": model,
-                "messages": messages,
-                "max_tokens": 1000
-            }
-            
-            response = requests.post(OPENROUTER_API_URL, headers=headers, json=data, timeout=60)
-            
-            # Handle rate limiting
-            if response.status_code == 429:
-                logging.warning(f"[OpenRouter] Модель {model} достигла лимита (429), пробуем следующую...")
-                continue
-            
-            # Handle auth error
-            if response.status_code == 401:
-                logging.error("Ошибка 401: Неверный токен авторизации для OpenRouter API.")
-                return "❌ Ошибка 401: Неверный токен авторизации. Проверьте OPENROUTER_API_KEY."
-            
-            # Handle bad request
-            if response.status_code == 400:
-                logging.warning(f"[OpenRouter] Модель {model} вернула 400, пробуем следующую...")
-                continue
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            # Extract the message content from the response
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-                logging.info(f"[OpenRouter] Успешно использована модель: {model}")
-                return content
-            
-            logging.warning(f"[OpenRouter] Модель {model} вернула пустой ответ, пробуем следующую...")
-            
-        except requests.exceptions.Timeout:
-            logging.warning(f"[OpenRouter] Таймаут модели {model}, пробуем следующую...")
-            last_error = "Таймаут"
-        except requests.exceptions.RequestException as e:
-            logging.warning(f"[OpenRouter] Ошибка модели {model}: {e}")
-            last_error = str(e)
-            continue
+    try:
+        return await llm_client.chat(messages, chat_models(), max_tokens=1000, user_id=user_id)
+    except UserRateLimited as e:
+        return f"⏳ {e}."
+    except OpenRouterError as e:
+        if e.is_auth_error:
+            logging.error("Ошибка 401: Неверный токен авторизации для OpenRouter API.")
+            return "❌ Ошибка 401: Неверный токен авторизации. Проверьте OPENROUTER_API_KEY."
+        last_error = str(e)
     
     # All models failed
     error_msg = f"❌ Все модели недоступны. Последняя ошибка: {last_error}\n\n"
@@ -285,9 +280,39 @@ def query_deepseek_sync(messages):
     logging.error(f"[OpenRouter] Все модели исчерпаны: {last_error}")
     return error_msg
 
-# Async wrapper for query_deepseek
-async def query_deepseek(messages):
-    return await asyncio.to_thread(query_deepseek_sync, messages)
+# Streamed variant: the reply message grows as tokens arrive
+async def stream_deepseek(messages, reply: StreamingReply, user_id: int = None) -> str:
+    if not OPENROUTER_API_KEY:
+        text = "OPENROUTER_API_KEY не установлен. Установите переменную окружения OPENROUTER_API_KEY."
+        await reply.fail(text)
+        return text
+    
+    try:
+        return await reply.consume(llm_client.chat_stream(messages, chat_models(), max_tokens=1000,
+                                                          user_id=user_id))
+    except OpenRouterError as e:
+        if isinstance(e, UserRateLimited):
+            error_msg = f"⏳ {e}."
+        elif e.is_auth_error:
+            logging.error("Ошибка 401: Неверный токен авторизации для OpenRouter API.")
+            error_msg = "❌ Ошибка 401: Неверный токен авторизации. Проверьте OPENROUTER_API_KEY."
+        elif reply.text:
+            logging.error(f"[OpenRouter] Поток прерван: {e}")
+            error_msg = "⚠️ Ответ прерван. Попробуйте ещё раз."
+        else:
+            logging.error(f"[OpenRouter] Все модели исчерпаны: {e}")
+            error_msg = f"❌ Все модели недоступны. Последняя ошибка: {e}\n\n⏰ Попробуйте позже или завтра."
+        await reply.fail(error_msg)
+        return reply.text
+
+SUPERSEDED_TEXT = "↪️ Отвечу на это вместе с вашим следующим сообщением."
+
+async def answer_from_history(user_id: int, reply: StreamingReply = None) -> str:
+    """Next assistant turn; run through `inflight`, so the context is read when it starts"""
+    history = await db.aio.get_chat_context(user_id)
+    if reply is None:
+        return await query_deepseek(history, user_id)
+    return await stream_deepseek(history, reply, user_id)
 
 # Sync function to generate voice
 def generate_voice_sync(text, lang='ru'):
@@ -335,23 +360,10 @@ async def generate_voice_edge(text, voice="ru-RU-SvetlanaNeural"):
 async def transcribe_voice(voice_file_path: str) -> str:
     """Transcribe voice message using OpenAI Whisper via OpenRouter"""
     try:
-        url = "https://openrouter.ai/api/v1/audio/transcriptions"
-        headers = {
-            "Authorization": f"Bearer {OPENROUTER_API_KEY}"
-        }
-        
-        with open(voice_file_path, 'rb') as audio_file:
-            files = {'file': audio_file}
-            data = {'model': 'openai/whisper-1'}
-            
-            response = requests.post(url, headers=headers, files=files, data=data)
-            
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('text', '')
-            else:
-                logging.error(f"Whisper error: {response.status_code} - {response.text}")
-                return ""
+        return await llm_client.transcribe(voice_file_path, model='openai/whisper-1')
+    except OpenRouterError as e:
+        logging.error(f"Whisper error: {e}")
+        return ""
     except Exception as e:
         logging.error(f"Error transcribing voice: {e}")
         return ""
@@ -598,7 +610,7 @@ async def send_welcome(message: types.Message):
         return
     
     # Save user to database
-    db.add_or_update_user(
+    await db.aio.add_or_update_user(
         telegram_id=user_id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
@@ -627,7 +639,8 @@ async def send_welcome(message: types.Message):
             "<b>📰 Новостной дайджест с AI:</b>\n"
             "📋 /interests - Мои интересы\n"
             "📰 /digest - Получить дайджест сейчас\n"
-            "📅 /schedule - Настроить расписание\n\n"
+            "📅 /schedule - Настроить расписание\n"
+            "🔍 /find &lt;запрос&gt; - Поиск по новостям\n\n"
             "<b>🎨 AI Генерация:</b>\n"
             "🎨 /image &lt;описание&gt; - Сгенерировать картинку (бесплатно)\n"
             "🧠 /gpt4 &lt;вопрос&gt; - DeepSeek R1 (бесплатно)\n\n"
@@ -723,7 +736,7 @@ async def voice_handler(message: types.Message):
         await message.reply("🎤 Пожалуйста, укажите вопрос после команды /voice")
         return
     await message.reply("🎤 Обрабатываю ваш вопрос для голосового ответа...")
-    response = await query_deepseek([{"role": "user", "content": user_input}])
+    response = await query_deepseek([{"role": "user", "content": user_input}], message.from_user.id)
     voice_fp = await generate_voice(response)
     if voice_fp:
         try:
@@ -742,9 +755,9 @@ async def toggle_voice(message: types.Message):
     user_id = message.from_user.id
     if not await ensure_auth(message):
         return
-    current_mode = db.get_voice_mode(user_id)
+    current_mode = await db.aio.get_voice_mode(user_id)
     new_mode = not current_mode
-    db.set_voice_mode(user_id, new_mode)
+    await db.aio.set_voice_mode(user_id, new_mode)
     status = "включен" if new_mode else "выключен"
     await message.reply(f"🎤 Голосовой режим {status}.")
 
@@ -753,7 +766,7 @@ async def clear_history(message: types.Message):
     user_id = message.from_user.id
     if not await ensure_auth(message):
         return
-    db.clear_chat_history(user_id)
+    await db.aio.clear_chat_history(user_id)
     await message.reply("🗑 История чата очищена.")
 
 # Handler for user stats
@@ -761,7 +774,7 @@ async def user_stats(message: types.Message):
     user_id = message.from_user.id
     if not await ensure_auth(message):
         return
-    stats = db.get_user_stats(user_id)
+    stats = await db.aio.get_user_stats(user_id)
     await message.reply(
         f"📊 Ваша статистика:\n"
         f"💬 Сообщений: {stats['message_count']}\n"
@@ -812,7 +825,7 @@ async def handle_text(message: types.Message):
         if not query:
             await message.reply('Пожалуйста, введите имя или номер для поиска контакта.')
             return
-        results = db.search_contacts(query)
+        results = await db.aio.search_contacts(query)
         if not results:
             await message.reply('Контакты не найдены.')
             return
@@ -905,7 +918,7 @@ async def handle_text(message: types.Message):
         phone = user_input.strip()
         name = user_states[user_id].get('contact_name', '')
         if name and phone:
-            if db.add_contact(name, phone, user_id):
+            if await db.aio.add_contact(name, phone, user_id):
                 await message.reply(f'✅ Контакт добавлен:\n{name}: {phone}')
             else:
                 await message.reply('❌ Ошибка при добавлении контакта.')
@@ -961,43 +974,53 @@ async def handle_text(message: types.Message):
         await weather_bishkek(message)
         return
     # Save user message to database
-    db.add_message(user_id, 'user', user_input)
-
-    # Get chat history from database (last 20 messages)
-    history = db.get_chat_history(user_id, limit=20)
+    await db.aio.add_message(user_id, 'user', user_input)
 
-    await message.reply("🤖 Обрабатываю ваш вопрос...")
-    response = await query_deepseek(history)
+    voice_mode = await db.aio.get_voice_mode(user_id)
+    status_msg = await message.reply("🤖 Обрабатываю ваш вопрос...")
+    
+    if not voice_mode:
+        # Text replies are streamed into the status message
+        reply = StreamingReply(status_msg, header="🤖 ")
+        response = await inflight.run(user_id, lambda: answer_from_history(user_id, reply))
+        if response is None:
+            await reply.fail(SUPERSEDED_TEXT)
+            return
+        await db.aio.add_message(user_id, 'assistant', response)
+        summarizer.schedule(user_id)
+        return
+    
+    response = await inflight.run(user_id, lambda: answer_from_history(user_id))
+    if response is None:
+        await status_msg.edit_text(SUPERSEDED_TEXT)
+        return
     # Limit response length for TTS to avoid issues
     voice_text = response[:2000] if len(response) > 2000 else response
-    voice_mode = db.get_voice_mode(user_id)
     
-    if voice_mode:
-        if TTS_AVAILABLE or EDGE_TTS_AVAILABLE:
-            voice_file = await generate_voice(voice_text)
-            logging.info(f"Voice file получен: {voice_file is not None}")
-            if voice_file:
-                logging.info("Отправка голоса")
-                try:
-                    await bot.send_voice(message.chat.id, voice=FSInputFile(voice_file))
-                    logging.info("Голос отправлен успешно")
-                    os.unlink(voice_file)  # Удалить файл после отправки
-                except Exception as e:
-                    logging.error(f"Ошибка при отправке голоса: {e}")
-                    os.unlink(voice_file)  # Удалить файл в случае ошибки
-                    await message.reply("❌ Ошибка при отправке голоса. Отправляю текст.")
-                    await message.reply(f"🤖 {response}")
-            else:
-                await message.reply("❌ Ошибка при генерации голоса. Отправляю текст.")
+    if TTS_AVAILABLE or EDGE_TTS_AVAILABLE:
+        voice_file = await generate_voice(voice_text)
+        logging.info(f"Voice file получен: {voice_file is not None}")
+        if voice_file:
+            logging.info("Отправка голоса")
+            try:
+                await bot.send_voice(message.chat.id, voice=FSInputFile(voice_file))
+                logging.info("Голос отправлен успешно")
+                os.unlink(voice_file)  # Удалить файл после отправки
+            except Exception as e:
+                logging.error(f"Ошибка при отправке голоса: {e}")
+                os.unlink(voice_file)  # Удалить файл в случае ошибки
+                await message.reply("❌ Ошибка при отправке голоса. Отправляю текст.")
                 await message.reply(f"🤖 {response}")
         else:
-            await message.reply("🎤 Голосовые ответы недоступны. Отправляю текст.")
+            await message.reply("❌ Ошибка при генерации голоса. Отправляю текст.")
             await message.reply(f"🤖 {response}")
     else:
+        await message.reply("🎤 Голосовые ответы недоступны. Отправляю текст.")
         await message.reply(f"🤖 {response}")
 
     # Save assistant response to database
-    db.add_message(user_id, 'assistant', response)
+    await db.aio.add_message(user_id, 'assistant', response)
+    summarizer.schedule(user_id)
 
 # ========== ADMIN COMMANDS ==========
 
@@ -1010,7 +1033,7 @@ async def admin_panel(message: types.Message):
         await message.reply("⛔ Доступ запрещен.")
         return
     
-    stats = db.get_admin_stats_extended()
+    stats = await db.aio.get_admin_stats_extended()
     
     # Create admin keyboard
     admin_kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -1047,12 +1070,10 @@ async def broadcast_message(message: types.Message):
         await message.reply("Использование: /broadcast &lt;текст&gt;")
         return
     
-    # Получаем всех пользователей из БД
-    users = db.get_all_users()
-    
+    # Пользователи читаются из БД постранично, без загрузки всей таблицы
     sent = 0
     failed = 0
-    for user in users:
+    async for user in db.aio.iter_users():
         try:
             await bot.send_message(user['telegram_id'], f"📢 <b>Сообщение от админа:</b>\n\n{text}", parse_mode='HTML')
             sent += 1
@@ -1087,7 +1108,7 @@ async def user_info(message: types.Message):
             await message.reply("❌ Пользователь не найден.")
             return
         
-        stats = db.get_user_stats(user_id)
+        stats = await db.aio.get_user_stats(user_id)
         
         await message.reply(
             f"👤 <b>Информация о пользователе</b>\n\n"
@@ -1132,13 +1153,16 @@ async def handle_voice_message(message: types.Message):
         
         await message.reply(f"📝 <b>Распознанный текст:</b>\n{transcribed_text}", parse_mode='HTML')
         
-        db.add_message(user_id, 'user', transcribed_text)
-        history = db.get_chat_history(user_id, limit=20)
+        await db.aio.add_message(user_id, 'user', transcribed_text)
         
-        response = await query_deepseek(history)
-        db.add_message(user_id, 'assistant', response)
+        response = await inflight.run(user_id, lambda: answer_from_history(user_id))
+        if response is None:
+            await message.reply(SUPERSEDED_TEXT)
+            return
+        await db.aio.add_message(user_id, 'assistant', response)
+        summarizer.schedule(user_id)
         
-        voice_mode = db.get_voice_mode(user_id)
+        voice_mode = await db.aio.get_voice_mode(user_id)
         if voice_mode and (TTS_AVAILABLE or EDGE_TTS_AVAILABLE):
             voice_text = response[:2000] if len(response) > 2000 else response
             voice_file = await generate_voice(voice_text)
@@ -1164,7 +1188,7 @@ async def show_interests(message: types.Message):
     if not await ensure_auth(message):
         return
     
-    interests = db.get_user_interests(user_id)
+    interests = await db.aio.get_user_interests(user_id)
     categories = db.get_all_categories()
     
     if not interests:
@@ -1190,7 +1214,7 @@ async def add_interest_handler(message: types.Message):
     # Extract category from command
     command = message.text.split()[0].lower().replace('/', '').replace('add_', '')
     
-    if db.add_user_interest(user_id, command):
+    if await db.aio.add_user_interest(user_id, command):
         await message.reply(f"✅ Добавлен интерес: {command}")
     else:
         await message.reply("❌ Не удалось добавить интерес")
@@ -1203,7 +1227,7 @@ async def remove_interest_handler(message: types.Message):
     
     command = message.text.split()[0].lower().replace('/', '').replace('remove_', '')
     
-    if db.remove_user_interest(user_id, command):
+    if await db.aio.remove_user_interest(user_id, command):
         await message.reply(f"❌ Удалён интерес: {command}")
     else:
         await message.reply("❌ Не удалось удалить интерес или категория не найдена")
@@ -1214,13 +1238,26 @@ async def get_digest(message: types.Message):
     if not await ensure_auth(message):
         return
     
-    scheduler = NewsScheduler(bot, db)
+    scheduler = NewsScheduler(bot, db, news_aggregator)
     result = await scheduler.send_digest_now(user_id)
-    await scheduler.aggregator.close_session()
     
     if not result.startswith("✅"):
         await message.reply(result)
 
+async def find_news(message: types.Message):
+    """Full-text search over stored news"""
+    if not await ensure_auth(message):
+        return
+    
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        await message.reply("Использование: /find &lt;запрос&gt;\nНапример: /find бишкек выборы", parse_mode='HTML')
+        return
+    
+    results = await db.aio.search_news(query, limit=10)
+    await message.reply(format_news_search(query, results), parse_mode='HTML',
+                        disable_web_page_preview=True)
+
 async def schedule_digest(message: types.Message):
     """Set digest schedule"""
     user_id = message.from_user.id
@@ -1242,13 +1279,13 @@ async def schedule_digest(message: types.Message):
     time_arg = args[1].lower()
     
     if time_arg == 'off':
-        db.set_digest_schedule(user_id, False)
+        await db.aio.set_digest_schedule(user_id, False)
         await message.reply("❌ Автоматический дайджест отключен")
     else:
         # Validate time format HH:MM
         import re
         if re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', time_arg):
-            db.set_digest_schedule(user_id, True, time_arg)
+            await db.aio.set_digest_schedule(user_id, True, time_arg)
             await message.reply(f"✅ Дайджест будет приходить каждый день в {time_arg}")
         else:
             await message.reply("❌ Неверный формат времени. Используйте HH:MM (например, 09:00)")
@@ -1262,7 +1299,7 @@ async def admin_collect_news(message: types.Message):
     await message.reply("🔄 Начинаю сбор новостей...")
     
     try:
-        count = await run_scheduler_once(db)
+        count = await run_scheduler_once(db, news_aggregator)
         await message.reply(f"✅ Собрано {count} новых новостей")
     except Exception as e:
         await message.reply(f"❌ Ошибка: {e}")
@@ -1280,7 +1317,7 @@ async def admin_news_stats(message: types.Message):
         total_news = cursor.fetchone()[0]
         
         if db.use_postgres:
-            cursor.execute('SELECT COUNT(*) FROM news_articles WHERE DATE(published) = CURRENT_DATE')
+            cursor.execute("SELECT COUNT(*) FROM news_articles WHERE published >= CURRENT_DATE AND published < CURRENT_DATE + INTERVAL '1 day'")
             today_news = cursor.fetchone()[0]
             
             cursor.execute('SELECT category, COUNT(*) FROM news_articles GROUP BY category')
@@ -1291,7 +1328,7 @@ async def admin_news_stats(message: types.Message):
             
             categories_text = "\n".join([f"  {row[0]}: {row[1]}" for row in by_category])
         else:
-            cursor.execute('SELECT COUNT(*) FROM news_articles WHERE date(published) = date("now")')
+            cursor.execute("SELECT COUNT(*) FROM news_articles WHERE published >= date('now') AND published < date('now', '+1 day')")
             today_news = cursor.fetchone()[0]
             
             cursor.execute('SELECT category, COUNT(*) FROM news_articles GROUP BY category')
@@ -1383,11 +1420,11 @@ async def deepseek_chat_handler(message: types.Message):
     await message.reply("🧠 Думаю над ответом (DeepSeek R1)...")
     
     try:
-        response = await asyncio.to_thread(deepseek_chat.simple_chat, user_input)
+        response = await deepseek_chat.simple_chat(user_input, user_id)
         
         # Save to chat history
-        db.add_message(user_id, 'user', f'[GPT4] {user_input}')
-        db.add_message(user_id, 'assistant', response)
+        await db.aio.add_message(user_id, 'user', f'[GPT4] {user_input}')
+        await db.aio.add_message(user_id, 'assistant', response)
         
         await message.reply(f"🧠 <b>DeepSeek R1:</b>\n{response}", parse_mode='HTML')
     except Exception as e:
@@ -1427,7 +1464,7 @@ async def admin_callback_handler(callback: types.CallbackQuery):
         await callback.message.reply(f"🚫 Введите причину блокировки пользователя {target_id}:")
     elif data.startswith("admin:unban:"):
         target_id = int(data.split(':')[2])
-        if db.unban_user(target_id):
+        if await db.aio.unban_user(target_id):
             await callback.message.reply(f"✅ Пользователь {target_id} разблокирован")
         else:
             await callback.message.reply(f"❌ Не удалось разблокировать пользователя {target_id}")
@@ -1439,7 +1476,7 @@ async def admin_callback_handler(callback: types.CallbackQuery):
         target_id = int(data.split(':')[2])
         if target_id == ADMIN_ID:
             await callback.message.reply("❌ Нельзя удалить главного администратора")
-        elif db.remove_admin(target_id):
+        elif await db.aio.remove_admin(target_id):
             await callback.message.reply(f"✅ Администратор {target_id} удален")
         else:
             await callback.message.reply(f"❌ Не удалось удалить администратора {target_id}")
@@ -1448,7 +1485,7 @@ async def admin_callback_handler(callback: types.CallbackQuery):
 
 async def show_user_management(message: types.Message):
     """Show user management interface"""
-    stats = db.get_admin_stats_extended()
+    stats = await db.aio.get_admin_stats_extended()
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔍 Найти по ID", callback_data="admin:find_user")],
@@ -1468,7 +1505,7 @@ async def show_user_management(message: types.Message):
 
 async def show_admin_management(message: types.Message):
     """Show admin management interface"""
-    admins = db.get_all_admins()
+    admins = await db.aio.get_all_admins()
     
     text = "🛡️ <b>Управление администраторами</b>\n\n"
     text += f"<b>Главный админ:</b> {ADMIN_ID}\n\n"
@@ -1489,7 +1526,7 @@ async def show_admin_management(message: types.Message):
 
 async def show_banned_users(message: types.Message):
     """Show banned users list"""
-    banned = db.get_all_banned()
+    banned = await db.aio.get_all_banned()
     
     if not banned:
         await message.reply(
@@ -1519,7 +1556,7 @@ async def show_banned_users(message: types.Message):
 
 async def show_detailed_stats(message: types.Message):
     """Show detailed statistics"""
-    stats = db.get_admin_stats_extended()
+    stats = await db.aio.get_admin_stats_extended()
     
     await message.reply(
         f"📊 <b>Детальная статистика</b>\n\n"
@@ -1531,7 +1568,14 @@ async def show_detailed_stats(message: types.Message):
         f"💬 Сообщений: {stats['total_messages']}\n\n"
         f"<b>Модерация:</b>\n"
         f"🛡️ Администраторов: {stats['total_admins']}\n"
-        f"🚫 Заблокировано: {stats['total_banned']}\n",
+        f"🚫 Заблокировано: {stats['total_banned']}\n\n"
+        f"<b>База данных (самые затратные методы):</b>\n"
+        f"{format_query_stats(db.query_stats())}\n\n"
+        f"<b>AI модели:</b>\n"
+        f"{format_model_health(llm_client.health.snapshot())}\n"
+        f"{format_cache_stats(llm_client.cache.stats() if llm_client.cache else {})}\n\n"
+        f"<b>Квота AI (сутки):</b>\n"
+        f"{format_llm_usage(llm_client.usage.snapshot())}\n",
         parse_mode='HTML',
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin:back")],
@@ -1551,11 +1595,10 @@ async def handle_admin_text(message: types.Message):
     if state.get('awaiting_broadcast'):
         admin_states.pop(user_id, None)
         text = message.text
-        users = db.get_all_users()
         
         sent = 0
         failed = 0
-        for user in users:
+        async for user in db.aio.iter_users():
             try:
                 await bot.send_message(
                     user['telegram_id'], 
@@ -1583,7 +1626,7 @@ async def handle_admin_text(message: types.Message):
             row = cursor.fetchone()
             username = row[0] if row else None
         
-        if db.ban_user(target_id, username, reason, user_id):
+        if await db.aio.ban_user(target_id, username, reason, user_id):
             await message.reply(f"✅ Пользователь {target_id} заблокирован\nПричина: {reason}")
             try:
                 await bot.send_message(
@@ -1617,7 +1660,7 @@ async def handle_admin_text(message: types.Message):
             row = cursor.fetchone()
             username = row[0] if row else None
         
-        if db.add_admin(target_id, username, user_id, role):
+        if await db.aio.add_admin(target_id, username, user_id, role):
             await message.reply(f"✅ Пользователь {target_id} назначен администратором\nРоль: {role}")
             try:
                 await bot.send_message(
@@ -1669,7 +1712,7 @@ async def show_user_actions(message: types.Message, target_id: int):
             return
         
         # Get stats
-        stats = db.get_user_stats(target_id)
+        stats = await db.aio.get_user_stats(target_id)
         is_user_admin = db.is_admin(target_id)
         is_user_banned = db.is_banned(target_id)
     
@@ -1746,7 +1789,7 @@ async def crypto_portfolio(message: types.Message):
         return
     
     user_id = message.from_user.id
-    portfolio = db.get_user_portfolio(user_id)
+    portfolio = await db.aio.get_user_portfolio(user_id)
     
     if not portfolio:
         kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -2008,7 +2051,7 @@ async def handle_crypto_text(message: types.Message):
             return
         
         # Add to portfolio
-        if db.add_crypto_to_portfolio(user_id, coin['id'], coin['symbol'], amount, avg_price):
+        if await db.aio.add_crypto_to_portfolio(user_id, coin['id'], coin['symbol'], amount, avg_price):
             await message.reply(
                 f"✅ <b>{coin['symbol']}</b> добавлен в портфель!\n"
                 f"Количество: {amount}\n"
@@ -2041,7 +2084,7 @@ async def handle_crypto_text(message: types.Message):
         price_data = crypto.get_price(coin_id)
         symbol = coin_id.upper()
         
-        if db.add_crypto_to_portfolio(user_id, coin_id, symbol, amount, avg_price):
+        if await db.aio.add_crypto_to_portfolio(user_id, coin_id, symbol, amount, avg_price):
             await message.reply(
                 f"✅ <b>{symbol}</b> добавлен в портфель!\n"
                 f"Количество: {amount}",
@@ -2079,14 +2122,14 @@ async def handle_crypto_text(message: types.Message):
         
         # Remove if amount is 0
         if amount == 0:
-            if db.remove_crypto_from_portfolio(user_id, coin_id):
+            if await db.aio.remove_crypto_from_portfolio(user_id, coin_id):
                 await message.reply(f"✅ <b>{symbol}</b> удален из портфеля", parse_mode='HTML')
             else:
                 await message.reply("❌ Ошибка при удалении")
             return
         
         # Update
-        if db.add_crypto_to_portfolio(user_id, coin_id, coin['symbol'], amount, avg_price):
+        if await db.aio.add_crypto_to_portfolio(user_id, coin_id, coin['symbol'], amount, avg_price):
             await message.reply(
                 f"✅ <b>{symbol}</b> обновлен!\n"
                 f"Новое количество: {amount}",
@@ -2098,7 +2141,7 @@ async def handle_crypto_text(message: types.Message):
 
 async def main():
     # Initialize scheduler
-    scheduler = NewsScheduler(bot, db)
+    scheduler = NewsScheduler(bot, db, news_aggregator)
     
     # Start scheduler in background
     scheduler_task = asyncio.create_task(scheduler.start())
@@ -2120,6 +2163,7 @@ async def main():
     dp.message.register(show_interests, Command(commands=['interests']))
     dp.message.register(get_digest, Command(commands=['digest']))
     dp.message.register(schedule_digest, Command(commands=['schedule']))
+    dp.message.register(find_news, Command(commands=['find']))
     # Add interest handlers for each category
     for cat in ['tech', 'ai', 'science', 'space', 'finance', 'kyrgyzstan', 'world', 'sports', 'other']:
         dp.message.register(add_interest_handler, Command(commands=[f'add_{cat}']))
@@ -0,0 +1,95 @@
+"""
+Shared pytest fixtures.
+
+Database tests run against a throwaway SQLite file: the working directory is
+switched to a temporary one, so the tracked bot.db is never opened. LLM
+tests talk to a local fake OpenRouter endpoint instead of the real API.
+"""
+import json
+import asyncio
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    from database import Database
+    database = Database()
+    yield database
+    database.close()
+
+
+class FakeOpenRouter:
+    """Local /chat/completions endpoint; `modes[model]` picks how that model answers"""
+
+    def __init__(self):
+        self.modes = {}
+        self.requests = []
+        self.delay = 2.0
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        model = body["model"]
+        self.requests.append(model)
+        mode = self.modes.get(model, "ok")
+        if mode == "slow":
+            await asyncio.sleep(self.delay)
+        if mode == "html":
+            return web.Response(text="<html>502 Bad Gateway</html>", content_type="text/html")
+        if mode == "list":
+            return web.json_response(["not", "an", "object"])
+        if mode == "daily_limit":
+            return web.Response(status=429, text="Rate limit exceeded: free-models-per-day")
+        if mode == "error":
+            return web.Response(status=500, text="upstream error")
+        text = f"ответ {model}"
+        if not body.get("stream"):
+            return web.json_response({"choices": [{"message": {"content": text}}]})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in text.split(" "):
+            chunk = {"choices": [{"delta": {"content": word + " "}}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            if mode == "slow_stream":
+                await asyncio.sleep(self.delay)
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+
+@pytest.fixture
+def openrouter(monkeypatch):
+    """FakeOpenRouter served from a background thread; the LLM client is pointed at it"""
+    from aiohttp import web
+
+    fake = FakeOpenRouter()
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_post("/chat/completions", fake.handle)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        state["runner"] = runner
+        state["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    ready.wait(5)
+    monkeypatch.setattr("llm.openrouter.OPENROUTER_BASE_URL", f"http://127.0.0.1:{state['port']}")
+    yield fake
+    asyncio.run_coroutine_threadsafe(state["runner"].cleanup(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
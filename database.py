@@ -3,33 +3,102 @@ Database module - supports SQLite (local) and PostgreSQL (Railway)
 """
 
 import os
+import asyncio
 import logging
-from datetime import datetime
-from typing import List, Dict, Optional
-import json
+import functools
+import hashlib
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator, AsyncIterator, Callable, Tuple
+from contextlib import contextmanager
 
 # Try to import psycopg2 for PostgreSQL (Railway)
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import execute_values
     POSTGRES_AVAILABLE = True
     logging.info("psycopg2 imported successfully")
 except ImportError as e:
     POSTGRES_AVAILABLE = False
     logging.warning(f"psycopg2 not available: {e}")
 
-# SQLite for local development
-import sqlite3
+from db_pool import PostgresConnectionPool, SQLiteConnectionManager, POOL_MAX_SIZE
+from db_migrations import migrate, COUNTED_TABLES, RECONCILE_COUNTERS_SQL
+from db_chat_buffer import ChatHistoryBuffer, CHAT_WRITE_BEHIND
+from db_acl import get_acl_cache
+from db_search import (search_terms, fts5_prefix_query, tsquery_prefix_query, sqlite_fts_available,
+                       phone_digits, PHONE_DIGITS_SQL)
+from db_metrics import QueryMetrics, InstrumentedConnection, instrument_methods, DB_METRICS
+from llm.context import estimate_tokens, build_context, LLM_CONTEXT_TOKENS, LLM_CONTEXT_MAX_MESSAGES
 
+# Threads dedicated to running blocking queries for async callers
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", str(POOL_MAX_SIZE)))
 
+
+# Register hot statements as server-side prepared statements (PostgreSQL only)
+PREPARED_STATEMENTS = os.environ.get("DB_PREPARED_STATEMENTS", "false").lower() == "true"
+
+# Prepared statement names per live PostgreSQL connection
+_prepared_by_connection = weakref.WeakKeyDictionary()
+
+
+# news_articles columns returned to callers (PostgreSQL also has search_vector)
+NEWS_COLUMNS = ('id, title, link, summary, category, source_name, source_category, '
+                'published, sentiment, sentiment_score, created_at')
+
+
+class CompiledQuery:
+    """A ?-style statement translated to PostgreSQL syntax"""
+    
+    __slots__ = ('sql', 'prepare_sql', 'param_count', 'name', 'preparable')
+    
+    def __init__(self, sql: str, prepare_sql: str, param_count: int, name: str, preparable: bool):
+        self.sql = sql                  # %s placeholders, literal % escaped
+        self.prepare_sql = prepare_sql  # $1..$n placeholders for PREPARE
+        self.param_count = param_count
+        self.name = name
+        self.preparable = preparable
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile_query(query: str) -> CompiledQuery:
+    """Translate ? placeholders (outside string literals) for psycopg2, once per statement"""
+    sql_parts = []
+    prepare_parts = []
+    count = 0
+    in_string = False
+    for ch in query:
+        if ch == "'":
+            in_string = not in_string
+        if ch == '?' and not in_string:
+            count += 1
+            sql_parts.append('%s')
+            prepare_parts.append(f'${count}')
+            continue
+        # psycopg2 interpolates the whole string, so every literal % is escaped
+        sql_parts.append('%%' if ch == '%' else ch)
+        prepare_parts.append(ch)
+    
+    name = 'stmt_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+    verb = query.lstrip().split(None, 1)[0].upper() if query.strip() else ''
+    preparable = verb in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+    return CompiledQuery(''.join(sql_parts), ''.join(prepare_parts), count, name, preparable)
+
+
+@instrument_methods
 class Database:
     def __init__(self):
+        # Per-method call/latency/row aggregates and slow-query log
+        self._metrics = QueryMetrics() if DB_METRICS else None
         # Check if Railway PostgreSQL is available
         self.database_url = os.environ.get("DATABASE_URL")
         self.use_postgres = False
+        self._pool = None
+        self._aio = None
+        self._chat_buffer = None
+        self._fts5 = False
+        self._digest_listeners = []
         
-        logging.info(f"DATABASE_URL raw from os.environ: {os.environ.get("DATABASE_URL", "<NOT SET>")}")
-        logging.info(f"DATABASE_URL assigned to self.database_url: {self.database_url}")
         logging.info(f"DATABASE_URL exists: {bool(self.database_url)}")
         if self.database_url:
             logging.info(f"DATABASE_URL starts with: {self.database_url[:20]}...")
@@ -37,9 +106,12 @@ class Database:
         
         if POSTGRES_AVAILABLE and self.database_url:
             try:
-                # Test connection
-                conn = psycopg2.connect(self.database_url, sslmode='require')
-                conn.close()
+                # Warming the pool doubles as the connection test
+                pool = PostgresConnectionPool(
+                    lambda: psycopg2.connect(self.database_url, sslmode='require')
+                )
+                pool.warm()
+                self._pool = pool
                 self.use_postgres = True
                 logging.info("✅ PostgreSQL connection successful")
             except Exception as e:
@@ -50,303 +122,108 @@ class Database:
             logging.info("Using PostgreSQL database (Railway)")
         else:
             self.db_file = "bot.db"
+            self._pool = SQLiteConnectionManager(self.db_file)
             logging.info(f"Using SQLite database: {self.db_file}")
         
+        # Identifies the database for process-wide caches (schema check, ACL)
+        self.target = self.database_url if self.use_postgres else os.path.abspath(self.db_file)
         self.init_db()
+        
+        # Ban/admin lookups are answered from memory from here on
+        self._acl = get_acl_cache(self.target)
+        self._acl.ensure_loaded(self._load_acl)
+        
+        if CHAT_WRITE_BEHIND:
+            self._chat_buffer = ChatHistoryBuffer(self._write_chat_rows)
     
+    @contextmanager
     def get_connection(self):
-        """Get database connection"""
-        if self.use_postgres:
-            # Railway requires SSL
-            conn = psycopg2.connect(self.database_url, sslmode='require')
-            return conn
-        else:
-            conn = sqlite3.connect(self.db_file)
-            conn.row_factory = sqlite3.Row
-            return conn
+        """Borrow a pooled connection; commits on success, rolls back on error"""
+        with self._pool.connection() as conn:
+            try:
+                yield InstrumentedConnection(conn, self._metrics) if self._metrics else conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def pool_stats(self) -> Dict:
+        """Connection pool metrics (in-use, waiters, checkout latency)"""
+        return self._pool.stats()
+    
+    def query_stats(self) -> Dict[str, Dict]:
+        """Per-method calls, latency histogram/percentiles, statements, rows, slow count"""
+        return self._metrics.snapshot() if self._metrics else {}
+    
+    def reset_query_stats(self):
+        if self._metrics:
+            self._metrics.reset()
+    
+    def chat_buffer_stats(self) -> Dict:
+        """Write-behind chat buffer metrics (pending rows, flushes, cached users)"""
+        return self._chat_buffer.stats() if self._chat_buffer else {}
+    
+    def flush_chat_history(self):
+        """Write queued chat messages now"""
+        if self._chat_buffer:
+            self._chat_buffer.flush()
+    
+    def close(self):
+        """Drain queued writes and close all pooled connections"""
+        if self._aio:
+            self._aio.shutdown()
+        if self._chat_buffer:
+            self._chat_buffer.close()
+        self._pool.close()
+    
+    @property
+    def aio(self) -> "AsyncDatabase":
+        """Awaitable view of this database for async handlers"""
+        if self._aio is None:
+            self._aio = AsyncDatabase(self)
+        return self._aio
     
     def _execute(self, cursor, query: str, params: tuple = ()):
-        """Execute query with automatic ? to %s conversion for PostgreSQL"""
-        if self.use_postgres and params:
-            # Replace each '?' with '%s' for PostgreSQL
-            # Count the number of ? placeholders and replace them with %s
-            query = self._convert_placeholders(query, len(params))
-        
-        cursor.execute(query, params)
-
-    def _convert_placeholders(self, query: str, param_count: int) -> str:
-        """Convert ? placeholders to %s for PostgreSQL, only replacing the first param_count occurrences"""
-        if not self.use_postgres or param_count == 0:
-            return query
+        """Execute a ?-style query, translated once per dialect and memoized"""
+        if not self.use_postgres or not params:
+            cursor.execute(query, params)
+            return
         
-        # Replace only the first param_count occurrences of '?' with '%s'
-        result = query
-        for _ in range(param_count):
-            pos = result.find('?')
-            if pos == -1:
-                break
-            result = result[:pos] + '%s' + result[pos+1:]
+        compiled = _compile_query(query)
+        if PREPARED_STATEMENTS and compiled.preparable:
+            if self._execute_prepared(cursor, compiled, params):
+                return
+        cursor.execute(compiled.sql, params)
+    
+    def _execute_prepared(self, cursor, compiled: "CompiledQuery", params: tuple) -> bool:
+        """Run a server-side prepared statement; False means fall back to plain execute"""
+        conn = cursor.connection
+        prepared = _prepared_by_connection.setdefault(conn, set())
+        if compiled.name not in prepared:
+            # A failed PREPARE must not abort the caller's transaction
+            cursor.execute(f"SAVEPOINT {compiled.name}")
+            try:
+                cursor.execute(f"PREPARE {compiled.name} AS {compiled.prepare_sql}")
+                cursor.execute(f"RELEASE SAVEPOINT {compiled.name}")
+            except Exception as e:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {compiled.name}")
+                compiled.preparable = False
+                logging.warning(f"Could not prepare statement {compiled.name}: {e}")
+                return False
+            prepared.add(compiled.name)
         
-        return result
+        placeholders = ', '.join(['%s'] * compiled.param_count)
+        cursor.execute(f"EXECUTE {compiled.name} ({placeholders})", params)
+        return True
     
     def init_db(self):
-        """Initialize database tables"""
+        """Bring the schema up to date (no-op when the stored version is current)"""
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Users table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        telegram_id BIGINT PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                # Chat history table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS chat_history (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT,
-                            role TEXT NOT NULL,
-                            content TEXT NOT NULL,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS chat_history (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER,
-                            role TEXT NOT NULL,
-                            content TEXT NOT NULL,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                
-                # Contacts table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS contacts (
-                            id SERIAL PRIMARY KEY,
-                            name TEXT NOT NULL,
-                            phone TEXT NOT NULL,
-                            added_by BIGINT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS contacts (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT NOT NULL,
-                            phone TEXT NOT NULL,
-                            added_by INTEGER,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                
-                # User settings table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS user_settings (
-                        user_id BIGINT PRIMARY KEY,
-                        voice_mode INTEGER DEFAULT 0,
-                        preferred_voice TEXT DEFAULT 'ru-RU-SvetlanaNeural',
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                    )
-                ''')
-                
-                # News articles table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS news_articles (
-                            id SERIAL PRIMARY KEY,
-                            title TEXT NOT NULL,
-                            link TEXT UNIQUE NOT NULL,
-                            summary TEXT,
-                            category TEXT DEFAULT 'other',
-                            source_name TEXT,
-                            source_category TEXT,
-                            published TIMESTAMP,
-                            sentiment TEXT DEFAULT 'neutral',
-                            sentiment_score REAL DEFAULT 0.0,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS news_articles (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            title TEXT NOT NULL,
-                            link TEXT UNIQUE NOT NULL,
-                            summary TEXT,
-                            category TEXT DEFAULT 'other',
-                            source_name TEXT,
-                            source_category TEXT,
-                            published TIMESTAMP,
-                            sentiment TEXT DEFAULT 'neutral',
-                            sentiment_score REAL DEFAULT 0.0,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    ''')
-                
-                # User interests table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS user_interests (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT,
-                            category TEXT NOT NULL,
-                            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            UNIQUE(user_id, category)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS user_interests (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER,
-                            category TEXT NOT NULL,
-                            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            UNIQUE(user_id, category)
-                        )
-                    ''')
-                
-                # User news feedback table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS user_news_feedback (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT,
-                            news_id INTEGER,
-                            feedback INTEGER,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            FOREIGN KEY (news_id) REFERENCES news_articles(id),
-                            UNIQUE(user_id, news_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS user_news_feedback (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER,
-                            news_id INTEGER,
-                            feedback INTEGER,
-                            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            FOREIGN KEY (news_id) REFERENCES news_articles(id),
-                            UNIQUE(user_id, news_id)
-                        )
-                    ''')
-                
-                # Digest schedule table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS digest_schedules (
-                        user_id BIGINT PRIMARY KEY,
-                        enabled INTEGER DEFAULT 0,
-                        schedule_time TEXT DEFAULT '09:00',
-                        last_sent TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                    )
-                ''')
-                
-                # Admins table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS admins (
-                            id SERIAL PRIMARY KEY,
-                            telegram_id BIGINT UNIQUE NOT NULL,
-                            username TEXT,
-                            role TEXT DEFAULT 'admin',
-                            added_by BIGINT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS admins (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            telegram_id BIGINT UNIQUE NOT NULL,
-                            username TEXT,
-                            role TEXT DEFAULT 'admin',
-                            added_by INTEGER,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                
-                # Banned users table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS banned_users (
-                            id SERIAL PRIMARY KEY,
-                            telegram_id BIGINT UNIQUE NOT NULL,
-                            username TEXT,
-                            reason TEXT,
-                            banned_by BIGINT,
-                            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (banned_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS banned_users (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            telegram_id BIGINT UNIQUE NOT NULL,
-                            username TEXT,
-                            reason TEXT,
-                            banned_by INTEGER,
-                            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (banned_by) REFERENCES users(telegram_id)
-                        )
-                    ''')
-                
-                # Crypto portfolio table
-                if self.use_postgres:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS crypto_portfolio (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT,
-                            coin_id TEXT NOT NULL,
-                            symbol TEXT NOT NULL,
-                            amount REAL DEFAULT 0,
-                            avg_buy_price REAL DEFAULT 0,
-                            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            UNIQUE(user_id, coin_id)
-                        )
-                    ''')
-                else:
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS crypto_portfolio (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER,
-                            coin_id TEXT NOT NULL,
-                            symbol TEXT NOT NULL,
-                            amount REAL DEFAULT 0,
-                            avg_buy_price REAL DEFAULT 0,
-                            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                            UNIQUE(user_id, coin_id)
-                        )
-                    ''')
-                
-                conn.commit()
-                logging.info(f"✅ Database initialized successfully (PostgreSQL: {self.use_postgres})")
+            version = migrate(self)
+            if not self.use_postgres:
+                with self.get_connection() as conn:
+                    self._fts5 = sqlite_fts_available(conn.cursor())
+            logging.info(f"✅ Database ready, schema v{version} (PostgreSQL: {self.use_postgres})")
         except Exception as e:
             logging.error(f"❌ Database initialization failed: {e}")
             raise
@@ -403,72 +280,209 @@ class Database:
         """Get total number of users"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM users')
-            return cursor.fetchone()[0]
+            return self._read_counters(cursor)["users"]
     
     def get_active_users_today(self) -> int:
         """Get number of active users today"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            if self.use_postgres:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE DATE(last_active) = CURRENT_DATE
-                ''')
-            else:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE date(last_active) = date('now')
-                ''')
-            return cursor.fetchone()[0]
+            return self._count_active_today(cursor)
+    
+    # ========== STATS COUNTERS ==========
+    
+    def _read_counters(self, cursor) -> Dict[str, int]:
+        """Row counts kept current by triggers (see db_migrations)"""
+        cursor.execute('SELECT name, value FROM stats_counters')
+        counters = {name: 0 for _, name in COUNTED_TABLES}
+        counters.update((row[0], row[1]) for row in cursor.fetchall())
+        counters["messages"] += self._pending_messages()
+        return counters
+    
+    def _count_active_today(self, cursor) -> int:
+        # Range on the raw column so idx_users_last_active is used
+        if self.use_postgres:
+            cursor.execute('SELECT COUNT(*) FROM users WHERE last_active >= CURRENT_DATE')
+        else:
+            cursor.execute("SELECT COUNT(*) FROM users WHERE last_active >= date('now')")
+        return cursor.fetchone()[0]
+    
+    def reconcile_stats(self) -> Dict[str, int]:
+        """Recount all counters with COUNT(*) (repairs drift, e.g. after manual SQL)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(RECONCILE_COUNTERS_SQL)
+            return self._read_counters(cursor)
     
     # ========== CHAT HISTORY ==========
     
     def add_message(self, user_id: int, role: str, content: str):
-        """Add message to chat history"""
+        """Add message to chat history (queued for the next group commit)"""
+        tokens = estimate_tokens(content)
+        if self._chat_buffer:
+            self._chat_buffer.append(user_id, role, content, tokens)
+            return
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            # Ensure user exists before adding message to prevent FK constraint violations
-            # Check if user exists
-            self._execute(cursor, 'SELECT telegram_id FROM users WHERE telegram_id = ?', (user_id,))
-            user_exists = cursor.fetchone()
-            
-            if not user_exists:
-                # Add user with minimal info to satisfy FK constraint
-                self._execute(cursor, '''
-                    INSERT INTO users (telegram_id, created_at, last_active)
-                    VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT (telegram_id) DO NOTHING
-                ''', (user_id,))
-            
+            # Add user with minimal info to satisfy FK constraint
             self._execute(cursor, '''
-                INSERT INTO chat_history (user_id, role, content)
-                VALUES (?, ?, ?)
-            ''', (user_id, role, content))
-            conn.commit()
+                INSERT INTO users (telegram_id, created_at, last_active)
+                VALUES (?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                ON CONFLICT (telegram_id) DO NOTHING
+            ''', (user_id,))
+            self._execute(cursor, '''
+                INSERT INTO chat_history (user_id, role, content, token_count)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, role, content, tokens))
+    
+    def _write_chat_rows(self, rows: list):
+        """Group commit: insert a batch of buffered messages in one transaction"""
+        user_ids = list(dict.fromkeys(row.user_id for row in rows))
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Ensure users exist before adding messages to prevent FK constraint violations
+            self._execute(cursor, f'''
+                INSERT INTO users (telegram_id)
+                VALUES {', '.join(['(?)'] * len(user_ids))}
+                ON CONFLICT (telegram_id) DO NOTHING
+            ''', tuple(user_ids))
+            
+            params = []
+            for row in rows:
+                # Keep the enqueue time; SQLite stores CURRENT_TIMESTAMP's text format
+                ts = row.created_at if self.use_postgres else row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                params.extend((row.user_id, row.role, row.content, row.tokens, ts))
+            self._execute(cursor, f'''
+                INSERT INTO chat_history (user_id, role, content, token_count, timestamp)
+                VALUES {', '.join(['(?, ?, ?, ?, ?)'] * len(rows))}
+            ''', tuple(params))
     
     def get_chat_history(self, user_id: int, limit: int = 20) -> List[Dict]:
-        """Get recent chat history for user"""
+        """Get recent chat history for user (served from memory when cached)"""
+        return [{"role": m["role"], "content": m["content"]} for m in self._history_rows(user_id, limit)]
+    
+    def get_chat_context(self, user_id: int, token_budget: int = LLM_CONTEXT_TOKENS,
+                         limit: int = LLM_CONTEXT_MAX_MESSAGES) -> List[Dict]:
+        """Rolling summary plus recent history for an LLM prompt, within a token budget"""
+        rows = self._history_rows(user_id, limit)
+        summary = self.get_chat_summary(user_id)
+        if summary is None:
+            return build_context(rows, token_budget)
+        # Only the turns the summary does not cover yet
+        fresh = summary["fresh_messages"]
+        return build_context(rows[-fresh:] if fresh else [], token_budget, summary["summary"])
+    
+    def _history_rows(self, user_id: int, limit: int) -> List[Dict]:
+        """Oldest-first {role, content, tokens} rows"""
+        if self._chat_buffer:
+            cached = self._chat_buffer.recent(user_id, limit)
+            if cached is not None:
+                return cached
+            return self._chat_buffer.load(
+                user_id, limit, lambda fetch: self._read_chat_history(user_id, fetch)
+            )
+        return self._read_chat_history(user_id, limit)
+    
+    def _read_chat_history(self, user_id: int, limit: int) -> List[Dict]:
         with self.get_connection() as conn:
             cursor = conn.cursor()
             self._execute(cursor, '''
-                SELECT role, content FROM chat_history
+                SELECT role, content, token_count FROM chat_history
                 WHERE user_id = ?
-                ORDER BY timestamp DESC
+                ORDER BY timestamp DESC, id DESC
                 LIMIT ?
             ''', (user_id, limit))
             rows = cursor.fetchall()
             if self.use_postgres:
-                return [{"role": row[0], "content": row[1]} for row in reversed(rows)]
+                return [{"role": row[0], "content": row[1], "tokens": row[2]} for row in reversed(rows)]
             else:
-                return [{"role": row["role"], "content": row["content"]} for row in reversed(rows)]
+                return [{"role": row["role"], "content": row["content"], "tokens": row["token_count"]}
+                        for row in reversed(rows)]
     
-    def clear_chat_history(self, user_id: int):
-        """Clear chat history for user"""
+    def get_chat_summary(self, user_id: int) -> Optional[Dict]:
+        """Stored rolling summary and how many messages were written after it"""
+        def read():
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._execute(cursor, '''
+                    SELECT s.summary, s.covered_until_id,
+                           (SELECT COUNT(*) FROM chat_history h
+                            WHERE h.user_id = s.user_id AND h.id > s.covered_until_id)
+                    FROM chat_summaries s
+                    WHERE s.user_id = ?
+                ''', (user_id,))
+                return cursor.fetchone()
+        
+        row, pending = self._read_with_pending(user_id, read)
+        if not row:
+            return None
+        return {"summary": row[0], "covered_until_id": row[1], "fresh_messages": row[2] + pending}
+    
+    def count_chat_messages(self, user_id: int) -> int:
+        """Stored plus queued messages of a user"""
+        def read():
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._execute(cursor, 'SELECT COUNT(*) FROM chat_history WHERE user_id = ?', (user_id,))
+                return cursor.fetchone()[0]
+        
+        count, pending = self._read_with_pending(user_id, read)
+        return count + pending
+    
+    def get_chat_turns_after(self, user_id: int, after_id: int, limit: int) -> List[Dict]:
+        """Oldest-first {id, role, content, tokens} rows with id > after_id (flushes queued rows)"""
+        self.flush_chat_history()
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            self._execute(cursor, 'DELETE FROM chat_history WHERE user_id = ?', (user_id,))
-            conn.commit()
+            self._execute(cursor, '''
+                SELECT id, role, content, token_count FROM chat_history
+                WHERE user_id = ? AND id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (user_id, after_id, limit))
+            return [{"id": row[0], "role": row[1], "content": row[2], "tokens": row[3]}
+                    for row in cursor.fetchall()]
+    
+    def save_chat_summary(self, user_id: int, summary: str, covered_until_id: int) -> bool:
+        """Store a summary of the user's turns up to covered_until_id; False if it is stale"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Skipped if the history was cleared meanwhile or a newer summary won the race
+            self._execute(cursor, '''
+                INSERT INTO chat_summaries (user_id, summary, covered_until_id, token_count, updated_at)
+                SELECT ?, ?, ?, ?, CURRENT_TIMESTAMP
+                WHERE EXISTS (SELECT 1 FROM chat_history WHERE user_id = ? AND id = ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    summary = excluded.summary,
+                    covered_until_id = excluded.covered_until_id,
+                    token_count = excluded.token_count,
+                    updated_at = excluded.updated_at
+                WHERE chat_summaries.covered_until_id < excluded.covered_until_id
+            ''', (user_id, summary, covered_until_id, estimate_tokens(summary), user_id, covered_until_id))
+            return cursor.rowcount > 0
+    
+    def clear_chat_history(self, user_id: int):
+        """Clear chat history for user"""
+        def delete():
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                self._execute(cursor, 'DELETE FROM chat_summaries WHERE user_id = ?', (user_id,))
+                self._execute(cursor, 'DELETE FROM chat_history WHERE user_id = ?', (user_id,))
+        
+        if self._chat_buffer:
+            self._chat_buffer.clear_user(user_id, delete)
+        else:
+            delete()
+    
+    def _read_with_pending(self, user_id: int, read: Callable):
+        """(read(), user's queued rows) with no flush in between, so the two add up exactly"""
+        if self._chat_buffer:
+            return self._chat_buffer.read_with_pending(user_id, read)
+        return read(), 0
+    
+    def _pending_messages(self, user_id: int = None) -> int:
+        """Messages accepted by add_message but not yet written"""
+        return self._chat_buffer.pending_count(user_id) if self._chat_buffer else 0
     
     # ========== CONTACTS ==========
     
@@ -510,28 +524,51 @@ class Database:
             conn.commit()
             return cursor.rowcount > 0
     
-    def search_contacts(self, query: str) -> List[Dict]:
-        """Search contacts by name or phone"""
+    def search_contacts(self, query: str, added_by: int = None, limit: int = 50) -> List[Dict]:
+        """Search contacts by name or phone (ranked, word-prefix matching; digits match anywhere in the phone)"""
+        terms = search_terms(query)
+        if not terms:
+            return []
+        digits = phone_digits(query)
+        owner = ' AND c.added_by = ?' if added_by is not None else ''
+        owner_params = (added_by,) if added_by is not None else ()
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            if self.use_postgres:
-                cursor.execute('''
-                    SELECT id, name, phone FROM contacts
-                    WHERE name ILIKE %s OR phone ILIKE %s
-                    ORDER BY name
-                ''', (f'%{query}%', f'%{query}%'))
+            if digits:
+                # Part of a phone number: substring scan, the indexes only match prefixes
+                self._execute(cursor, f'''
+                    SELECT c.id, c.name, c.phone FROM contacts c
+                    WHERE {PHONE_DIGITS_SQL} LIKE ?{owner}
+                    ORDER BY c.name
+                    LIMIT ?
+                ''', (f'%{digits}%', *owner_params, limit))
+            elif self.use_postgres:
+                self._execute(cursor, f'''
+                    SELECT c.id, c.name, c.phone
+                    FROM contacts c, to_tsquery('simple', ?) AS q
+                    WHERE c.search_vector @@ q{owner}
+                    ORDER BY ts_rank(c.search_vector, q) DESC, c.name
+                    LIMIT ?
+                ''', (tsquery_prefix_query(terms), *owner_params, limit))
+            elif self._fts5:
+                self._execute(cursor, f'''
+                    SELECT c.id, c.name, c.phone
+                    FROM contacts_fts JOIN contacts c ON c.id = contacts_fts.rowid
+                    WHERE contacts_fts MATCH ?{owner}
+                    ORDER BY bm25(contacts_fts), c.name
+                    LIMIT ?
+                ''', (fts5_prefix_query(terms), *owner_params, limit))
             else:
-                cursor.execute('''
-                    SELECT id, name, phone FROM contacts
-                    WHERE name LIKE ? OR phone LIKE ?
-                    ORDER BY name
-                ''', (f'%{query}%', f'%{query}%'))
+                # SQLite without FTS5: substring scan
+                self._execute(cursor, f'''
+                    SELECT c.id, c.name, c.phone FROM contacts c
+                    WHERE (c.name LIKE ? OR c.phone LIKE ?){owner}
+                    ORDER BY c.name
+                    LIMIT ?
+                ''', (f'%{query}%', f'%{query}%', *owner_params, limit))
             
-            rows = cursor.fetchall()
-            if self.use_postgres:
-                return [{"id": row[0], "name": row[1], "phone": row[2]} for row in rows]
-            else:
-                return [{"id": row["id"], "name": row["name"], "phone": row["phone"]} for row in rows]
+            return [{"id": row[0], "name": row[1], "phone": row[2]} for row in cursor.fetchall()]
     
     def get_all_contacts(self) -> List[Dict]:
         """Get all contacts"""
@@ -544,6 +581,82 @@ class Database:
             else:
                 return [{"id": row["id"], "name": row["name"], "phone": row["phone"]} for row in rows]
     
+    def get_contact_count(self) -> int:
+        """Total number of contacts (trigger-maintained counter)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            return self._read_counters(cursor)["contacts"]
+    
+    def get_contacts_page(self, after_id: int = None, before_id: int = None,
+                          limit: int = 10, added_by: int = None, after_key: Tuple = None) -> Dict:
+        """
+        One page of contacts ordered by (name, id), resumed from a contact id
+        (keyset pagination: cost does not grow with the page number). If the
+        cursor contact was deleted meanwhile, the first page is returned.
+        after_key resumes from a (name, id) pair directly (used by iterators).
+        Returns {"contacts": [...], "has_prev": bool, "has_next": bool}.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            before_key = None
+            anchor_id = after_id if after_id is not None else before_id
+            if after_key is None and anchor_id is not None:
+                self._execute(cursor, 'SELECT name, id FROM contacts WHERE id = ?', (anchor_id,))
+                anchor = cursor.fetchone()
+                if anchor is not None:
+                    if after_id is not None:
+                        after_key = (anchor[0], anchor[1])
+                    else:
+                        before_key = (anchor[0], anchor[1])
+            
+            conditions = []
+            params = []
+            if added_by is not None:
+                conditions.append('added_by = ?')
+                params.append(added_by)
+            if after_key is not None:
+                conditions.append('(name, id) > (?, ?)')
+                params.extend(after_key)
+            elif before_key is not None:
+                conditions.append('(name, id) < (?, ?)')
+                params.extend(before_key)
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+            # Walk backwards for "previous page", then restore display order
+            backwards = before_key is not None
+            order = 'name DESC, id DESC' if backwards else 'name, id'
+            params.append(limit + 1)
+            
+            self._execute(cursor, f'''
+                SELECT id, name, phone FROM contacts
+                {where}
+                ORDER BY {order}
+                LIMIT ?
+            ''', tuple(params))
+            rows = [{"id": row[0], "name": row[1], "phone": row[2]} for row in cursor.fetchall()]
+        
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+            return {"contacts": rows, "has_prev": more, "has_next": True}
+        return {"contacts": rows, "has_prev": after_key is not None, "has_next": more}
+    
+    def iter_contacts(self, batch_size: int = 500) -> Iterator[Dict]:
+        """Yield every contact in (name, id) order without building a list"""
+        if self.use_postgres:
+            yield from self._iter_server_side(
+                'iter_contacts', 'SELECT id, name, phone FROM contacts ORDER BY name, id',
+                ('id', 'name', 'phone'), batch_size
+            )
+            return
+        after_key = None
+        while True:
+            page = self.get_contacts_page(after_key=after_key, limit=batch_size)["contacts"]
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_key = (page[-1]["name"], page[-1]["id"])
+    
     def get_contacts(self, user_id: int) -> List[Dict]:
         """Get contacts for specific user"""
         with self.get_connection() as conn:
@@ -619,7 +732,7 @@ class Database:
             cursor = conn.cursor()
             
             self._execute(cursor, 'SELECT COUNT(*) FROM chat_history WHERE user_id = ?', (user_id,))
-            message_count = cursor.fetchone()[0]
+            message_count = cursor.fetchone()[0] + self._pending_messages(user_id)
             
             self._execute(cursor, 'SELECT COUNT(*) FROM contacts WHERE added_by = ?', (user_id,))
             contact_count = cursor.fetchone()[0]
@@ -643,132 +756,240 @@ class Database:
                 return [{"telegram_id": row["telegram_id"], "username": row["username"],
                         "first_name": row["first_name"]} for row in rows]
     
+    def get_users_page(self, after_id: int = None, limit: int = 500) -> List[Dict]:
+        """Users with telegram_id > after_id, in id order (keyset pagination)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, '''
+                SELECT telegram_id, username, first_name FROM users
+                WHERE telegram_id > ?
+                ORDER BY telegram_id
+                LIMIT ?
+            ''', (after_id if after_id is not None else -2**63, limit))
+            return [{"telegram_id": row[0], "username": row[1], "first_name": row[2]}
+                    for row in cursor.fetchall()]
+    
+    def iter_users(self, batch_size: int = 500) -> Iterator[Dict]:
+        """Yield every user without loading the table into memory"""
+        if self.use_postgres:
+            yield from self._iter_server_side(
+                'iter_users', 'SELECT telegram_id, username, first_name FROM users ORDER BY telegram_id',
+                ('telegram_id', 'username', 'first_name'), batch_size
+            )
+            return
+        after_id = None
+        while True:
+            page = self.get_users_page(after_id, batch_size)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after_id = page[-1]["telegram_id"]
+    
+    def _iter_server_side(self, name: str, query: str, columns: tuple, batch_size: int) -> Iterator[Dict]:
+        """Stream a PostgreSQL result through a named (server-side) cursor"""
+        with self.get_connection() as conn:
+            with conn.cursor(name=name) as cursor:
+                cursor.itersize = batch_size
+                cursor.execute(query)
+                for row in cursor:
+                    yield dict(zip(columns, row))
+    
     def get_admin_stats(self) -> Dict:
         """Get admin statistics"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM contacts')
-            total_contacts = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM chat_history')
-            total_messages = cursor.fetchone()[0]
-            
-            if self.use_postgres:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE DATE(last_active) = CURRENT_DATE
-                ''')
-            else:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE date(last_active) = date('now')
-                ''')
-            active_today = cursor.fetchone()[0]
+            counters = self._read_counters(cursor)
             
             return {
-                "total_users": total_users,
-                "total_contacts": total_contacts,
-                "total_messages": total_messages,
-                "active_today": active_today
+                "total_users": counters["users"],
+                "total_contacts": counters["contacts"],
+                "total_messages": counters["messages"],
+                "active_today": self._count_active_today(cursor)
             }
     
     # ========== NEWS FUNCTIONS ==========
     
     def save_news_item(self, item: Dict) -> bool:
         """Save news article to database"""
+        return bool(self.save_news_items([item]))
+    
+    def save_news_items(self, items: List[Dict]) -> List[str]:
+        """Save a batch of news articles in one transaction; returns links that were new"""
+        rows = []
+        seen = set()
+        for item in items:
+            if item['link'] in seen:
+                continue
+            seen.add(item['link'])
+            rows.append((
+                item['title'], item['link'], item['summary'],
+                item['category'], item.get('source_name', ''),
+                item.get('source_category', ''), item['published'],
+                item.get('sentiment', 'neutral'), item.get('sentiment_score', 0.0)
+            ))
+        if not rows:
+            return []
+        
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
                 if self.use_postgres:
-                    cursor.execute('''
+                    inserted = execute_values(cursor, '''
                         INSERT INTO news_articles 
                         (title, link, summary, category, source_name, source_category, 
                          published, sentiment, sentiment_score)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        VALUES %s
                         ON CONFLICT (link) DO NOTHING
-                    ''', (
-                        item['title'], item['link'], item['summary'], 
-                        item['category'], item.get('source_name', ''),
-                        item.get('source_category', ''), item['published'],
-                        item.get('sentiment', 'neutral'), item.get('sentiment_score', 0.0)
-                    ))
-                else:
+                        RETURNING link
+                    ''', rows, page_size=500, fetch=True)
+                    return [row[0] for row in inserted]
+                
+                # SQLite: in-process, so per-row statements inside one transaction are cheap
+                new_links = []
+                for row in rows:
                     cursor.execute('''
                         INSERT OR IGNORE INTO news_articles 
                         (title, link, summary, category, source_name, source_category, 
                          published, sentiment, sentiment_score)
                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        item['title'], item['link'], item['summary'], 
-                        item['category'], item.get('source_name', ''),
-                        item.get('source_category', ''), item['published'],
-                        item.get('sentiment', 'neutral'), item.get('sentiment_score', 0.0)
-                    ))
-                
-                conn.commit()
-                return cursor.rowcount > 0
+                    ''', row)
+                    if cursor.rowcount > 0:
+                        new_links.append(row[1])
+                return new_links
         except Exception as e:
             logging.error(f"Error saving news: {e}")
-            return False
+            return []
+    
+    def get_news_sentiments(self, link_hashes: List[str]) -> Dict[str, tuple]:
+        """Cached (sentiment, score) by link hash"""
+        found = {}
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(link_hashes), 500):
+                chunk = link_hashes[start:start + 500]
+                self._execute(cursor, f'''
+                    SELECT link_hash, sentiment, score FROM news_sentiment
+                    WHERE link_hash IN ({', '.join(['?'] * len(chunk))})
+                ''', tuple(chunk))
+                for row in cursor.fetchall():
+                    found[row[0]] = (row[1], row[2])
+        return found
+    
+    def save_news_sentiments(self, rows: List[tuple]):
+        """Cache (link_hash, sentiment, score) rows; existing hashes are kept"""
+        if not rows:
+            return
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                execute_values(cursor, '''
+                    INSERT INTO news_sentiment (link_hash, sentiment, score)
+                    VALUES %s
+                    ON CONFLICT (link_hash) DO NOTHING
+                ''', rows, page_size=500)
+            else:
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO news_sentiment (link_hash, sentiment, score)
+                    VALUES (?, ?, ?)
+                ''', rows)
+    
+    def _news_cutoff_sql(self) -> str:
+        """Start of the 3-day news window, compared against the bare column so
+        idx_news_category_published / idx_news_published can be range-scanned"""
+        if self.use_postgres:
+            return "CURRENT_DATE - INTERVAL '3 days'"
+        # Stored as 'YYYY-MM-DD HH:MM:SS', which sorts as text
+        return "date('now', '-3 days')"
+    
+    def _fetch_news(self, cursor, query: str, params: tuple) -> List[Dict]:
+        self._execute(cursor, query, params)
+        if self.use_postgres:
+            columns = [desc[0] for desc in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def search_news(self, query: str, limit: int = 10) -> List[Dict]:
+        """Full-text search over stored news titles and summaries (best match first)"""
+        terms = search_terms(query)
+        if not terms:
+            return []
+        columns = ', '.join(f'n.{c}' for c in NEWS_COLUMNS.split(', '))
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if self.use_postgres:
+                return self._fetch_news(cursor, f'''
+                    SELECT {columns}
+                    FROM news_articles n, to_tsquery('simple', ?) AS q
+                    WHERE n.search_vector @@ q
+                    ORDER BY ts_rank(n.search_vector, q) DESC, n.published DESC
+                    LIMIT ?
+                ''', (tsquery_prefix_query(terms), limit))
+            if self._fts5:
+                return self._fetch_news(cursor, f'''
+                    SELECT {columns}
+                    FROM news_fts JOIN news_articles n ON n.id = news_fts.rowid
+                    WHERE news_fts MATCH ?
+                    ORDER BY bm25(news_fts), n.published DESC
+                    LIMIT ?
+                ''', (fts5_prefix_query(terms), limit))
+            pattern = f'%{query}%'
+            return self._fetch_news(cursor, f'''
+                SELECT {columns} FROM news_articles n
+                WHERE n.title LIKE ? OR n.summary LIKE ?
+                ORDER BY n.published DESC
+                LIMIT ?
+            ''', (pattern, pattern, limit))
     
     def get_news_by_categories(self, categories: List[str], limit: int = 10) -> List[Dict]:
         """Get news by categories (last 3 days)"""
         # Handle empty categories list
+        categories = list(dict.fromkeys(categories or []))
         if not categories:
             return []
         
+        cutoff = self._news_cutoff_sql()
+        # One index range scan per category, each stopping after `limit` rows;
+        # a plain IN (...) would have to sort every matching row first
+        per_category = ' UNION ALL '.join(
+            f'''SELECT * FROM (
+                    SELECT {NEWS_COLUMNS} FROM news_articles
+                    WHERE category = ? AND published >= {cutoff}
+                    ORDER BY published DESC
+                    LIMIT ?
+                ) AS c{i}'''
+            for i in range(len(categories))
+        )
+        params = []
+        for category in categories:
+            params.extend((category, limit))
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            if self.use_postgres:
-                placeholders = ','.join('%s' for _ in categories)
-                cursor.execute(f'''
-                    SELECT * FROM news_articles 
-                    WHERE category IN ({placeholders})
-                    AND DATE(published) >= CURRENT_DATE - INTERVAL '3 days'
-                    ORDER BY published DESC
-                    LIMIT %s
-                ''', (*categories, limit))
-                columns = [desc[0] for desc in cursor.description]
-                return [dict(zip(columns, row)) for row in cursor.fetchall()]
-            else:
-                placeholders = ','.join('?' for _ in categories)
-                cursor.execute(f'''
-                    SELECT * FROM news_articles 
-                    WHERE category IN ({placeholders})
-                    AND date(published) >= date('now', '-3 days')
+            if len(categories) == 1:
+                return self._fetch_news(cursor, f'''
+                    SELECT {NEWS_COLUMNS} FROM news_articles
+                    WHERE category = ? AND published >= {cutoff}
                     ORDER BY published DESC
                     LIMIT ?
-                ''', (*categories, limit))
-                return [dict(row) for row in cursor.fetchall()]
+                ''', (categories[0], limit))
+            return self._fetch_news(cursor, f'''
+                SELECT * FROM ({per_category}) AS recent
+                ORDER BY published DESC
+                LIMIT ?
+            ''', (*params, limit))
     
     def get_latest_news(self, limit: int = 20) -> List[Dict]:
         """Get latest news regardless of category"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            if self.use_postgres:
-                cursor.execute('''
-                    SELECT * FROM news_articles 
-                    WHERE DATE(published) >= CURRENT_DATE - INTERVAL '3 days'
-                    ORDER BY published DESC
-                    LIMIT %s
-                ''', (limit,))
-                columns = [desc[0] for desc in cursor.description]
-                return [dict(zip(columns, row)) for row in cursor.fetchall()]
-            else:
-                cursor.execute('''
-                    SELECT * FROM news_articles 
-                    WHERE date(published) >= date('now', '-3 days')
-                    ORDER BY published DESC
-                    LIMIT ?
-                ''', (limit,))
-                return [dict(row) for row in cursor.fetchall()]
+            return self._fetch_news(cursor, f'''
+                SELECT {NEWS_COLUMNS} FROM news_articles
+                WHERE published >= {self._news_cutoff_sql()}
+                ORDER BY published DESC
+                LIMIT ?
+            ''', (limit,))
     
     # ========== USER INTERESTS ==========
     
@@ -903,9 +1124,38 @@ class Database:
                         enabled = excluded.enabled,
                         schedule_time = excluded.schedule_time
                 ''', (user_id, 1 if enabled else 0, schedule_time))
-            
+
             conn.commit()
-    
+
+        # Let running schedulers move the user's next fire time
+        for listener in list(self._digest_listeners):
+            try:
+                listener(user_id, enabled, schedule_time)
+            except Exception as e:
+                logging.error(f"Digest schedule listener failed: {e}")
+
+    def add_digest_listener(self, listener: Callable[[int, bool, str], None]):
+        """Call listener(user_id, enabled, schedule_time) after each set_digest_schedule"""
+        self._digest_listeners.append(listener)
+
+    def remove_digest_listener(self, listener: Callable[[int, bool, str], None]):
+        if listener in self._digest_listeners:
+            self._digest_listeners.remove(listener)
+
+    def get_digest_schedules(self) -> List[Dict]:
+        """All enabled schedules, for loading the in-memory digest timer"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, schedule_time, last_sent FROM digest_schedules
+                WHERE enabled = 1
+            ''')
+            if self.use_postgres:
+                return [{'user_id': row[0], 'schedule_time': row[1], 'last_sent': row[2]}
+                        for row in cursor.fetchall()]
+            return [{'user_id': row['user_id'], 'schedule_time': row['schedule_time'],
+                     'last_sent': row['last_sent']} for row in cursor.fetchall()]
+
     def get_digest_schedule(self, user_id: int) -> Optional[Dict]:
         """Get digest schedule for user"""
         with self.get_connection() as conn:
@@ -964,19 +1214,31 @@ class Database:
 
     # ========== ADMIN MANAGEMENT ==========
     
+    def _load_acl(self):
+        """Read the banned and admin tables for the ACL cache"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id, telegram_id, username, reason, banned_by, banned_at FROM banned_users')
+            banned = [self._ban_row(row) for row in cursor.fetchall()]
+            cursor.execute('SELECT telegram_id, role FROM admins')
+            admins = [(row[0], row[1]) for row in cursor.fetchall()]
+        return banned, admins
+    
+    @staticmethod
+    def _ban_row(row) -> Dict:
+        return {
+            "id": row[0], "telegram_id": row[1], "username": row[2],
+            "reason": row[3], "banned_by": row[4], "banned_at": row[5]
+        }
+    
     def is_admin(self, telegram_id: int) -> bool:
-        """Check if user is admin (including main admin from env)"""
-        import os
+        """Check if user is admin (including main admin from env); no I/O"""
         main_admin = int(os.environ.get("ADMIN_ID", "0"))
         if telegram_id == main_admin:
             return True
         
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            self._execute(cursor, '''
-                SELECT COUNT(*) FROM admins WHERE telegram_id = ?
-            ''', (telegram_id,))
-            return cursor.fetchone()[0] > 0
+        self._acl.ensure_loaded(self._load_acl)
+        return self._acl.is_admin(telegram_id)
     
     def add_admin(self, telegram_id: int, username: str, added_by: int, role: str = 'admin') -> bool:
         """Add new admin"""
@@ -1000,14 +1262,14 @@ class Database:
                             role = excluded.role
                     ''', (telegram_id, username, role, added_by))
                 conn.commit()
-                return True
+            self._acl.set_admin(telegram_id, role)
+            return True
         except Exception as e:
             logging.error(f"Error adding admin: {e}")
             return False
     
     def remove_admin(self, telegram_id: int) -> bool:
         """Remove admin (can't remove main admin)"""
-        import os
         main_admin = int(os.environ.get("ADMIN_ID", "0"))
         if telegram_id == main_admin:
             return False
@@ -1018,7 +1280,9 @@ class Database:
                 DELETE FROM admins WHERE telegram_id = ?
             ''', (telegram_id,))
             conn.commit()
-            return cursor.rowcount > 0
+            removed = cursor.rowcount > 0
+        self._acl.drop_admin(telegram_id)
+        return removed
     
     def get_all_admins(self) -> List[Dict]:
         """Get all admins"""
@@ -1048,27 +1312,17 @@ class Database:
                 UPDATE admins SET role = ? WHERE telegram_id = ?
             ''', (new_role, telegram_id))
             conn.commit()
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+        if updated:
+            self._acl.set_admin(telegram_id, new_role)
+        return updated
     
     # ========== BAN MANAGEMENT ==========
     
     def is_banned(self, telegram_id: int) -> Optional[Dict]:
-        """Check if user is banned"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            self._execute(cursor, '''
-                SELECT * FROM banned_users WHERE telegram_id = ?
-            ''', (telegram_id,))
-            row = cursor.fetchone()
-            if row:
-                if self.use_postgres:
-                    return {
-                        "id": row[0], "telegram_id": row[1], "username": row[2],
-                        "reason": row[3], "banned_by": row[4], "banned_at": row[5]
-                    }
-                else:
-                    return dict(row)
-            return None
+        """Check if user is banned (ban details or None); no I/O"""
+        self._acl.ensure_loaded(self._load_acl)
+        return self._acl.is_banned(telegram_id)
     
     def ban_user(self, telegram_id: int, username: str, reason: str, banned_by: int) -> bool:
         """Ban user"""
@@ -1093,8 +1347,15 @@ class Database:
                             banned_by = excluded.banned_by,
                             banned_at = CURRENT_TIMESTAMP
                     ''', (telegram_id, username, reason, banned_by))
+                # Read back id/banned_at for the cached ban details
+                self._execute(cursor, '''
+                    SELECT id, telegram_id, username, reason, banned_by, banned_at
+                    FROM banned_users WHERE telegram_id = ?
+                ''', (telegram_id,))
+                ban_info = self._ban_row(cursor.fetchone())
                 conn.commit()
-                return True
+            self._acl.set_banned(telegram_id, ban_info)
+            return True
         except Exception as e:
             logging.error(f"Error banning user: {e}")
             return False
@@ -1107,7 +1368,9 @@ class Database:
                 DELETE FROM banned_users WHERE telegram_id = ?
             ''', (telegram_id,))
             conn.commit()
-            return cursor.rowcount > 0
+            removed = cursor.rowcount > 0
+        self._acl.drop_banned(telegram_id)
+        return removed
     
     def get_all_banned(self) -> List[Dict]:
         """Get all banned users"""
@@ -1136,45 +1399,15 @@ class Database:
         """Extended admin statistics"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Basic stats
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM contacts')
-            total_contacts = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM chat_history')
-            total_messages = cursor.fetchone()[0]
-            
-            # Admins count
-            cursor.execute('SELECT COUNT(*) FROM admins')
-            total_admins = cursor.fetchone()[0]
-            
-            # Banned count
-            cursor.execute('SELECT COUNT(*) FROM banned_users')
-            total_banned = cursor.fetchone()[0]
-            
-            # Active today
-            if self.use_postgres:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE DATE(last_active) = CURRENT_DATE
-                ''')
-            else:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM users 
-                    WHERE date(last_active) = date('now')
-                ''')
-            active_today = cursor.fetchone()[0]
+            counters = self._read_counters(cursor)
             
             return {
-                "total_users": total_users,
-                "total_contacts": total_contacts,
-                "total_messages": total_messages,
-                "total_admins": total_admins,
-                "total_banned": total_banned,
-                "active_today": active_today
+                "total_users": counters["users"],
+                "total_contacts": counters["contacts"],
+                "total_messages": counters["messages"],
+                "total_admins": counters["admins"],
+                "total_banned": counters["banned"],
+                "active_today": self._count_active_today(cursor)
             }
 
     
@@ -1259,3 +1492,97 @@ class Database:
             ''', (amount, user_id, coin_id.lower()))
             conn.commit()
             return cursor.rowcount > 0
+    
+    # ========== LLM USAGE ==========
+    
+    def record_llm_usage(self, day: str, model: str, requests: int = 1, failures: int = 0,
+                         exhausted: bool = False):
+        """Add to a model's usage for a UTC day (YYYY-MM-DD)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, '''
+                INSERT INTO llm_usage (day, model, requests, failures, exhausted, updated_at)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (day, model) DO UPDATE SET
+                    requests = llm_usage.requests + excluded.requests,
+                    failures = llm_usage.failures + excluded.failures,
+                    exhausted = CASE WHEN excluded.exhausted = 1 THEN 1 ELSE llm_usage.exhausted END,
+                    updated_at = excluded.updated_at
+            ''', (day, model, requests, failures, 1 if exhausted else 0))
+    
+    def get_llm_usage(self, day: str) -> List[Dict]:
+        """Per-model usage for a UTC day"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._execute(cursor, '''
+                SELECT model, requests, failures, exhausted FROM llm_usage
+                WHERE day = ?
+                ORDER BY model
+            ''', (day,))
+            return [{"model": row[0], "requests": row[1], "failures": row[2], "exhausted": bool(row[3])}
+                    for row in cursor.fetchall()]
+
+
+class AsyncDatabase:
+    """
+    Awaitable mirror of the Database API.
+    
+    Every public method of Database is available as a coroutine that runs the
+    blocking query on a dedicated, bounded thread pool, so a slow query never
+    stalls the event loop:
+    
+        history = await db.aio.get_chat_history(user_id, limit=20)
+    """
+    
+    def __init__(self, db: Database, max_workers: int = DB_EXECUTOR_WORKERS):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                            thread_name_prefix="db")
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self._db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(attr, *args, **kwargs)
+            )
+        
+        # Cache so repeated lookups skip __getattr__
+        setattr(self, name, call)
+        return call
+    
+    async def iter_users(self, batch_size: int = 500) -> AsyncIterator[Dict]:
+        """Stream users page by page; no connection is held between pages"""
+        after_id = None
+        while True:
+            page = await self.get_users_page(after_id, batch_size)
+            for user in page:
+                yield user
+            if len(page) < batch_size:
+                return
+            after_id = page[-1]["telegram_id"]
+    
+    async def iter_contacts(self, batch_size: int = 500) -> AsyncIterator[Dict]:
+        """Stream contacts page by page; no connection is held between pages"""
+        after_key = None
+        while True:
+            page = (await self.get_contacts_page(after_key=after_key, limit=batch_size))["contacts"]
+            for contact in page:
+                yield contact
+            if len(page) < batch_size:
+                return
+            after_key = (page[-1]["name"], page[-1]["id"])
+    
+    async def run(self, func, *args, **kwargs):
+        """Run an arbitrary blocking function (e.g. raw SQL) on the DB executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+    
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,92 @@
+"""
+Process-wide cache of banned users and admins.
+
+Every incoming update runs a ban check and the admin dispatcher filter. Both
+sets are tiny and only change through the ban/admin methods of `Database`,
+so they are loaded once and kept in memory; the mutating methods update the
+cache right after their transaction commits.
+"""
+
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+
+class AclCache:
+    """Banned users (with ban details) and admin roles, O(1) lookups"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._banned: Dict[int, Dict] = {}
+        self._admins: Dict[int, str] = {}
+        self._loaded = False
+
+    def ensure_loaded(self, loader: Callable[[], Tuple[Iterable[Dict], Iterable[Tuple[int, str]]]]):
+        """Populate from `loader() -> (ban rows, (telegram_id, role) pairs)` once"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            banned, admins = loader()
+            self._banned = {row["telegram_id"]: _normalize_ban(row) for row in banned}
+            self._admins = {telegram_id: role for telegram_id, role in admins}
+            self._loaded = True
+
+    def invalidate(self):
+        """Forget everything; the next ensure_loaded() reads the tables again"""
+        with self._lock:
+            self._loaded = False
+
+    # ----- lookups -----
+
+    def is_banned(self, telegram_id: int) -> Optional[Dict]:
+        info = self._banned.get(telegram_id)
+        return dict(info) if info is not None else None
+
+    def is_admin(self, telegram_id: int) -> bool:
+        return telegram_id in self._admins
+
+    def admin_role(self, telegram_id: int) -> Optional[str]:
+        return self._admins.get(telegram_id)
+
+    # ----- updates (call after the DB change committed) -----
+
+    def set_banned(self, telegram_id: int, info: Dict):
+        with self._lock:
+            self._banned[telegram_id] = _normalize_ban(info)
+
+    def drop_banned(self, telegram_id: int):
+        with self._lock:
+            self._banned.pop(telegram_id, None)
+
+    def set_admin(self, telegram_id: int, role: str):
+        with self._lock:
+            self._admins[telegram_id] = role
+
+    def drop_admin(self, telegram_id: int):
+        with self._lock:
+            self._admins.pop(telegram_id, None)
+
+    def stats(self) -> Dict:
+        return {"loaded": self._loaded, "banned": len(self._banned), "admins": len(self._admins)}
+
+
+def _normalize_ban(row: Dict) -> Dict:
+    info = dict(row)
+    # PostgreSQL returns datetime, SQLite text; handlers slice the string
+    if info.get("banned_at") is not None:
+        info["banned_at"] = str(info["banned_at"])
+    return info
+
+
+_caches: Dict[str, AclCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_acl_cache(key: str) -> AclCache:
+    """Shared cache for one database (all Database() instances in the process)"""
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = AclCache()
+        return cache
@@ -0,0 +1,232 @@
+"""
+Write-behind buffer for chat history.
+
+`add_message` runs twice per conversation turn. Instead of a round trip per
+message, rows are queued in memory and written by a background thread with
+one multi-row INSERT every CHAT_FLUSH_INTERVAL_MS or CHAT_FLUSH_MAX_ROWS rows.
+A per-user ring buffer of recent messages (including rows not yet flushed)
+serves `get_chat_history`, so the chat path mostly never reads the database.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+CHAT_WRITE_BEHIND = os.environ.get("CHAT_WRITE_BEHIND", "true").lower() == "true"
+CHAT_FLUSH_INTERVAL_MS = int(os.environ.get("CHAT_FLUSH_INTERVAL_MS", "200"))
+CHAT_FLUSH_MAX_ROWS = int(os.environ.get("CHAT_FLUSH_MAX_ROWS", "100"))
+CHAT_RING_SIZE = int(os.environ.get("CHAT_RING_SIZE", "50"))        # messages kept per user
+CHAT_RING_USERS = int(os.environ.get("CHAT_RING_USERS", "2000"))    # users kept in memory
+CHAT_MAX_PENDING = int(os.environ.get("CHAT_MAX_PENDING", "10000"))  # cap while the DB is down
+
+
+class _PendingRow:
+    __slots__ = ("user_id", "role", "content", "tokens", "created_at")
+
+    def __init__(self, user_id: int, role: str, content: str, tokens: Optional[int] = None):
+        self.user_id = user_id
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+        self.created_at = datetime.utcnow().replace(microsecond=0)
+
+
+class _Ring:
+    """Most recent messages of one user"""
+
+    __slots__ = ("messages", "complete")
+
+    def __init__(self, messages: List[Dict], complete: bool):
+        self.messages = deque(messages, maxlen=CHAT_RING_SIZE)
+        # True while the ring holds the user's entire history
+        self.complete = complete and len(self.messages) < CHAT_RING_SIZE
+
+    def append(self, message: Dict):
+        self.messages.append(message)
+        if len(self.messages) >= CHAT_RING_SIZE:
+            self.complete = False
+
+
+class ChatHistoryBuffer:
+    """Group-commit queue plus per-user read cache for chat_history"""
+
+    def __init__(self, write_rows: Callable[[List[_PendingRow]], None],
+                 interval_ms: int = CHAT_FLUSH_INTERVAL_MS,
+                 max_rows: int = CHAT_FLUSH_MAX_ROWS):
+        self._write_rows = write_rows
+        self.interval = interval_ms / 1000.0
+        self.max_rows = max(1, max_rows)
+
+        self._lock = threading.Lock()            # guards _pending and _rings
+        self._flush_lock = threading.RLock()     # one writer at a time; held while hydrating
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: deque = deque()
+        self._rings: "OrderedDict[int, _Ring]" = OrderedDict()
+        self._closed = False
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.dropped_rows = 0
+
+        self._thread = threading.Thread(target=self._run, name="chat-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ----- writes -----
+
+    def append(self, user_id: int, role: str, content: str, tokens: Optional[int] = None):
+        row = _PendingRow(user_id, role, content, tokens)
+        with self._lock:
+            if len(self._pending) >= CHAT_MAX_PENDING:
+                self._pending.popleft()
+                self.dropped_rows += 1
+                logging.error("Chat history buffer full, dropping oldest unflushed message")
+            self._pending.append(row)
+            ring = self._rings.get(user_id)
+            if ring is not None:
+                ring.append({"role": role, "content": content, "tokens": tokens})
+                self._rings.move_to_end(user_id)
+            if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                # Start the group-commit window, or cut it short when the batch is full
+                self._wakeup.notify()
+
+    def flush(self):
+        """Write every queued row now (blocks until committed)"""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._pending[i] for i in range(min(len(self._pending), self.max_rows))]
+                if not batch:
+                    return
+                try:
+                    self._write_rows(batch)
+                    rejected = 0
+                except Exception as e:
+                    rejected = self._write_one_by_one(batch, e)
+                with self._lock:
+                    # Only flush/clear_user remove rows, both under _flush_lock
+                    for _ in batch:
+                        self._pending.popleft()
+                    self.flushed_rows += len(batch) - rejected
+                    self.dropped_rows += rejected
+                    self.flushes += 1
+
+    def _write_one_by_one(self, batch: List[_PendingRow], error: Exception) -> int:
+        """Retry a failed batch row by row; returns how many rows the DB rejected.
+
+        If no row gets in, the database itself is down: re-raise and keep the
+        batch queued. Otherwise the failing rows are bad data and are dropped,
+        so one poison row cannot block every later write.
+        """
+        rejected = []
+        for row in batch:
+            try:
+                self._write_rows([row])
+            except Exception as e:
+                rejected.append((row, e))
+        if len(rejected) == len(batch):
+            raise error
+        for row, e in rejected:
+            logging.error(f"Dropping chat message of user {row.user_id} the database rejected: {e}")
+        return len(rejected)
+
+    def clear_user(self, user_id: int, delete: Callable[[], None]):
+        """Drop a user's queued rows and run `delete` with no flush in between"""
+        with self._flush_lock:
+            with self._lock:
+                self._pending = deque(r for r in self._pending if r.user_id != user_id)
+                self._rings.pop(user_id, None)
+            delete()
+            with self._lock:
+                self._remember(user_id, _Ring([], complete=True))
+
+    # ----- reads -----
+
+    def recent(self, user_id: int, limit: int) -> Optional[List[Dict]]:
+        """Last `limit` messages from memory, or None if the DB must be consulted"""
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if ring is None or (limit > CHAT_RING_SIZE and not ring.complete):
+                return None
+            self._rings.move_to_end(user_id)
+            messages = list(ring.messages)
+        return [dict(m) for m in messages[-limit:]] if limit > 0 else []
+
+    def load(self, user_id: int, limit: int, read_rows: Callable[[int], List[Dict]]) -> List[Dict]:
+        """Read history from the DB, merge unflushed rows and cache the result"""
+        fetch = max(limit, CHAT_RING_SIZE)
+        # Holding the flush lock guarantees no row moves from pending to the
+        # table while we read, so DB rows + pending rows is exact
+        with self._flush_lock:
+            rows = read_rows(fetch)
+            with self._lock:
+                pending = [{"role": r.role, "content": r.content, "tokens": r.tokens}
+                           for r in self._pending if r.user_id == user_id]
+                merged = rows + pending
+                self._remember(user_id, _Ring(merged[-CHAT_RING_SIZE:], complete=len(rows) < fetch))
+        return [dict(m) for m in merged[-limit:]] if limit > 0 else []
+
+    def read_with_pending(self, user_id: int, read: Callable[[], Any]) -> Tuple[Any, int]:
+        """Run a DB read with no flush in between; returns (result, user's unflushed rows)"""
+        with self._flush_lock:
+            return read(), self.pending_count(user_id)
+
+    def pending_count(self, user_id: Optional[int] = None) -> int:
+        with self._lock:
+            if user_id is None:
+                return len(self._pending)
+            return sum(1 for r in self._pending if r.user_id == user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "cached_users": len(self._rings),
+                "flushes": self.flushes,
+                "flushed_rows": self.flushed_rows,
+                "dropped_rows": self.dropped_rows,
+            }
+
+    # ----- lifecycle -----
+
+    def close(self):
+        """Stop the flusher and drain the queue"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Failed to drain chat history buffer: {e}")
+
+    def _remember(self, user_id: int, ring: _Ring):
+        self._rings[user_id] = ring
+        self._rings.move_to_end(user_id)
+        while len(self._rings) > CHAT_RING_USERS:
+            self._rings.popitem(last=False)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                if len(self._pending) < self.max_rows:
+                    # Group commit: give other messages a moment to join the batch
+                    self._wakeup.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Chat history flush failed, will retry: {e}")
+                time.sleep(max(self.interval, 1.0))
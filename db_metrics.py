@@ -0,0 +1,322 @@
+"""
+Query instrumentation for the database layer.
+
+`@instrument_methods` tags every Database method call with its name (through a
+context variable, so it also works on the async executor threads), and
+`get_connection()` hands out connections whose cursors time each
+execute/executemany and count rows. Aggregates are kept per method: call
+count and latency histogram, statement count, DB time, rows. Statements
+slower than DB_SLOW_QUERY_MS are logged with the shape of their parameters,
+never the values.
+"""
+
+import os
+import html
+import time
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from typing import Dict, List, Optional
+
+
+DB_METRICS = os.environ.get("DB_METRICS", "true").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", "200"))
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+UNATTRIBUTED = "(direct)"  # statements issued outside any Database method
+
+_current_method: contextvars.ContextVar = contextvars.ContextVar("db_method", default=None)
+
+
+class _MethodStats:
+    __slots__ = ("calls", "errors", "total_ms", "max_ms", "histogram",
+                 "statements", "db_ms", "rows", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.statements = 0
+        self.db_ms = 0.0
+        self.rows = 0
+        self.slow = 0
+
+    def as_dict(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "p50_ms": _percentile(self.histogram, 0.50),
+            "p95_ms": _percentile(self.histogram, 0.95),
+            "histogram": dict(zip([f"<={b}ms" for b in LATENCY_BUCKETS_MS] + ["inf"], self.histogram)),
+            "statements": self.statements,
+            "db_ms": round(self.db_ms, 3),
+            "rows": self.rows,
+            "slow_statements": self.slow,
+        }
+
+
+def _percentile(histogram: List[int], q: float) -> Optional[float]:
+    """Upper bound of the bucket holding the q-th call (None if unbounded/empty)"""
+    total = sum(histogram)
+    if not total:
+        return None
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= total * q:
+            return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+
+def param_shape(params) -> str:
+    """Describe parameters without their values: (int, str[42], datetime)"""
+    if params is None:
+        return "()"
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {_value_shape(v)}" for k, v in params.items()) + "}"
+    if isinstance(params, (list, tuple)):
+        if len(params) > 12:
+            counts: Dict[str, int] = {}
+            for value in params:
+                name = type(value).__name__
+                counts[name] = counts.get(name, 0) + 1
+            return f"[{len(params)} params: " + ", ".join(f"{n}×{c}" for n, c in counts.items()) + "]"
+        return "(" + ", ".join(_value_shape(v) for v in params) + ")"
+    return _value_shape(params)
+
+
+def _value_shape(value) -> str:
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+class QueryMetrics:
+    """Thread-safe per-method aggregates"""
+
+    def __init__(self, slow_ms: float = DB_SLOW_QUERY_MS):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._methods: Dict[str, _MethodStats] = {}
+        self._started = time.time()
+
+    def _stats(self, method: str) -> _MethodStats:
+        stats = self._methods.get(method)
+        if stats is None:
+            stats = self._methods[method] = _MethodStats()
+        return stats
+
+    def record_call(self, method: str, elapsed_ms: float, failed: bool):
+        bucket = _bucket(elapsed_ms)
+        with self._lock:
+            stats = self._stats(method)
+            stats.calls += 1
+            stats.errors += failed
+            stats.total_ms += elapsed_ms
+            stats.max_ms = max(stats.max_ms, elapsed_ms)
+            stats.histogram[bucket] += 1
+
+    def record_statement(self, sql: str, params, elapsed_ms: float, rows: int):
+        method = _current_method.get() or UNATTRIBUTED
+        slow = elapsed_ms >= self.slow_ms
+        with self._lock:
+            stats = self._stats(method)
+            stats.statements += 1
+            stats.db_ms += elapsed_ms
+            stats.rows += max(rows, 0)
+            stats.slow += slow
+        if slow:
+            statement = " ".join(str(sql).split())
+            logging.warning(
+                f"🐢 Slow query {elapsed_ms:.1f}ms in {method}: {statement[:300]} "
+                f"params={param_shape(params)}"
+            )
+
+    def record_rows(self, rows: int):
+        if rows <= 0:
+            return
+        method = _current_method.get() or UNATTRIBUTED
+        with self._lock:
+            self._stats(method).rows += rows
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """{method: {calls, avg_ms, p95_ms, statements, db_ms, rows, ...}}"""
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self._methods.items()}
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+            self._started = time.time()
+
+    def uptime(self) -> float:
+        return time.time() - self._started
+
+
+def _bucket(elapsed_ms: float) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if elapsed_ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times statements and counts rows"""
+
+    __slots__ = ("_cursor", "_metrics")
+
+    def __init__(self, cursor, metrics: QueryMetrics):
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_metrics", metrics)
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            result = self._cursor.execute(sql, params) if params is not None else self._cursor.execute(sql)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self._metrics.record_statement(sql, params, elapsed, self._affected())
+        # sqlite3 returns the cursor itself; keep callers on the proxy
+        return self if result is self._cursor else result
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        started = time.perf_counter()
+        try:
+            result = self._cursor.executemany(sql, seq_of_params)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self._metrics.record_statement(sql, seq_of_params[:1] and seq_of_params[0], elapsed, self._affected())
+        return self if result is self._cursor else result
+
+    def _affected(self) -> int:
+        # DML reports rowcount; SELECT rows are counted as they are fetched
+        rowcount = getattr(self._cursor, "rowcount", -1)
+        if rowcount is None or rowcount < 0 or getattr(self._cursor, "description", None):
+            return 0
+        return rowcount
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._metrics.record_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._metrics.record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._metrics.record_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._metrics.record_rows(1)
+            yield row
+
+    def __enter__(self):
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cursor.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # e.g. psycopg2 named cursor `itersize`
+        setattr(self._cursor, name, value)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are instrumented"""
+
+    __slots__ = ("_conn", "_metrics")
+
+    def __init__(self, conn, metrics: QueryMetrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._metrics)
+
+    def execute(self, sql, params=None):
+        """sqlite3 shortcut (conn.execute)"""
+        return self.cursor().execute(sql, params)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# Methods that manage connections rather than run a logical operation
+_NOT_INSTRUMENTED = {"get_connection", "close", "pool_stats", "query_stats",
+                     "chat_buffer_stats", "reset_query_stats", "_execute", "_execute_prepared",
+                     "add_digest_listener", "remove_digest_listener"}
+
+
+def instrument_methods(cls):
+    """Class decorator: attribute statements to the outermost Database method called"""
+    for name, func in list(vars(cls).items()):
+        if (name.startswith("__") or name in _NOT_INSTRUMENTED or not inspect.isfunction(func)
+                or inspect.isgeneratorfunction(func)):
+            continue
+        setattr(cls, name, _timed(name, func))
+    return cls
+
+
+def _timed(name: str, func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        metrics = getattr(self, "_metrics", None)
+        if metrics is None or _current_method.get() is not None:
+            # Nested call: statements belong to the outer method
+            return func(self, *args, **kwargs)
+        token = _current_method.set(name)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = func(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _current_method.reset(token)
+            metrics.record_call(name, (time.perf_counter() - started) * 1000, failed)
+    return wrapper
+
+
+def format_query_stats(snapshot: Dict[str, Dict], top: int = 8) -> str:
+    """Admin panel summary: methods by total time spent"""
+    if not snapshot:
+        return "нет данных"
+    ranked = sorted(snapshot.items(), key=lambda kv: kv[1]["avg_ms"] * kv[1]["calls"] or kv[1]["db_ms"],
+                    reverse=True)
+    lines = []
+    for name, stats in ranked[:top]:
+        if stats["calls"]:
+            p95 = f"≤{stats['p95_ms']:.0f}" if stats["p95_ms"] is not None else f">{LATENCY_BUCKETS_MS[-1]}"
+            timing = f"{stats['calls']}× avg {stats['avg_ms']:.1f}ms, p95 {p95}ms"
+        else:
+            timing = f"{stats['statements']} запросов, {stats['db_ms']:.0f}ms"
+        lines.append(
+            f"• <code>{html.escape(name)}</code>: {timing}, rows {stats['rows']}"
+            + (f", 🐢{stats['slow_statements']}" if stats["slow_statements"] else "")
+        )
+    return "\n".join(lines)
@@ -0,0 +1,383 @@
+"""
+Versioned schema migrations for SQLite (local) and PostgreSQL (Railway).
+
+The applied version is stored in `schema_version`; `Database()` only checks it
+and runs the migrations that are still pending, instead of replaying every
+CREATE statement on each start.
+"""
+
+import logging
+import threading
+from typing import Callable, List, Optional, Sequence
+
+from db_search import POSTGRES_SEARCH_SQL, create_sqlite_fts
+from llm.context import estimate_tokens
+
+
+class Migration:
+    """One schema step; statements may use {pk} and {user_id} dialect placeholders"""
+
+    def __init__(self, version: int, description: str, statements: Sequence[str] = (),
+                 postgres: Sequence[str] = (), sqlite: Sequence[str] = (),
+                 apply: Optional[Callable] = None):
+        self.version = version
+        self.description = description
+        self.statements = list(statements)
+        self.postgres = list(postgres)
+        self.sqlite = list(sqlite)
+        self.apply = apply  # optional callable(db, cursor) for steps that need logic
+
+    def sql_for(self, use_postgres: bool) -> List[str]:
+        types = {
+            'pk': 'SERIAL PRIMARY KEY' if use_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT',
+            'user_id': 'BIGINT' if use_postgres else 'INTEGER',
+        }
+        specific = self.postgres if use_postgres else self.sqlite
+        return [sql.format(**types) for sql in self.statements + specific]
+
+
+# (table, counter name) pairs kept in stats_counters by triggers
+COUNTED_TABLES = [
+    ('users', 'users'),
+    ('contacts', 'contacts'),
+    ('chat_history', 'messages'),
+    ('admins', 'admins'),
+    ('banned_users', 'banned'),
+]
+
+# Recount every counter in one statement (seeding and drift repair)
+RECONCILE_COUNTERS_SQL = '''
+    INSERT INTO stats_counters (name, value)
+    SELECT name, value FROM (
+        {}
+    ) AS counts WHERE 1 = 1
+    ON CONFLICT (name) DO UPDATE SET value = excluded.value
+'''.format('\n        UNION ALL '.join(
+    f"SELECT '{counter}' AS name, COUNT(*) AS value FROM {table}" for table, counter in COUNTED_TABLES
+))
+
+
+MIGRATIONS = [
+    Migration(1, "baseline tables", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id BIGINT PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id {pk},
+            user_id {user_id},
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS contacts (
+            id {pk},
+            name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            added_by {user_id},
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id BIGINT PRIMARY KEY,
+            voice_mode INTEGER DEFAULT 0,
+            preferred_voice TEXT DEFAULT 'ru-RU-SvetlanaNeural',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS news_articles (
+            id {pk},
+            title TEXT NOT NULL,
+            link TEXT UNIQUE NOT NULL,
+            summary TEXT,
+            category TEXT DEFAULT 'other',
+            source_name TEXT,
+            source_category TEXT,
+            published TIMESTAMP,
+            sentiment TEXT DEFAULT 'neutral',
+            sentiment_score REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_interests (
+            id {pk},
+            user_id {user_id},
+            category TEXT NOT NULL,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
+            UNIQUE(user_id, category)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_news_feedback (
+            id {pk},
+            user_id {user_id},
+            news_id INTEGER,
+            feedback INTEGER,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
+            FOREIGN KEY (news_id) REFERENCES news_articles(id),
+            UNIQUE(user_id, news_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS digest_schedules (
+            user_id BIGINT PRIMARY KEY,
+            enabled INTEGER DEFAULT 0,
+            schedule_time TEXT DEFAULT '09:00',
+            last_sent TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS admins (
+            id {pk},
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username TEXT,
+            role TEXT DEFAULT 'admin',
+            added_by {user_id},
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (added_by) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS banned_users (
+            id {pk},
+            telegram_id BIGINT UNIQUE NOT NULL,
+            username TEXT,
+            reason TEXT,
+            banned_by {user_id},
+            banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (banned_by) REFERENCES users(telegram_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS crypto_portfolio (
+            id {pk},
+            user_id {user_id},
+            coin_id TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            amount REAL DEFAULT 0,
+            avg_buy_price REAL DEFAULT 0,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
+            UNIQUE(user_id, coin_id)
+        )
+        ''',
+    ]),
+    Migration(2, "indexes for hot access paths", [
+        # Chat turn: WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?
+        'CREATE INDEX IF NOT EXISTS idx_chat_history_user_ts ON chat_history (user_id, timestamp, id)',
+        # Digest: WHERE category IN (...) AND published >= ? ORDER BY published DESC
+        'CREATE INDEX IF NOT EXISTS idx_news_category_published ON news_articles (category, published DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_news_published ON news_articles (published DESC)',
+        # Digest poll only ever looks at enabled schedules
+        'CREATE INDEX IF NOT EXISTS idx_digest_enabled_time ON digest_schedules (schedule_time) WHERE enabled = 1',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_added_by ON contacts (added_by, name)',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_name ON contacts (name)',
+        'CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)',
+    ]),
+    Migration(3, "incremental row counters for admin stats", [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+    ], postgres=[
+        # Statement-level triggers: a multi-row insert bumps the counter once
+        '''
+        CREATE OR REPLACE FUNCTION stats_counters_bump() RETURNS trigger AS $$
+        DECLARE
+            delta BIGINT;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT COUNT(*) INTO delta FROM new_rows;
+            ELSE
+                SELECT -COUNT(*) INTO delta FROM old_rows;
+            END IF;
+            IF delta <> 0 THEN
+                UPDATE stats_counters SET value = value + delta WHERE name = TG_ARGV[0];
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+    ] + [
+        sql
+        for table, counter in COUNTED_TABLES
+        for sql in (
+            f'DROP TRIGGER IF EXISTS trg_{table}_count_ins ON {table}',
+            f'CREATE TRIGGER trg_{table}_count_ins AFTER INSERT ON {table} '
+            f'REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+            f"EXECUTE FUNCTION stats_counters_bump('{counter}')",
+            f'DROP TRIGGER IF EXISTS trg_{table}_count_del ON {table}',
+            f'CREATE TRIGGER trg_{table}_count_del AFTER DELETE ON {table} '
+            f'REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+            f"EXECUTE FUNCTION stats_counters_bump('{counter}')",
+        )
+    ], sqlite=[
+        sql
+        for table, counter in COUNTED_TABLES
+        for sql in (
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_count_ins AFTER INSERT ON {table} '
+            f"BEGIN UPDATE stats_counters SET value = value + 1 WHERE name = '{counter}'; END",
+            f'CREATE TRIGGER IF NOT EXISTS trg_{table}_count_del AFTER DELETE ON {table} '
+            f"BEGIN UPDATE stats_counters SET value = value - 1 WHERE name = '{counter}'; END",
+        )
+    ], apply=lambda db, cursor: cursor.execute(RECONCILE_COUNTERS_SQL)),
+    Migration(4, "keyset pagination indexes for contacts", [
+        # Pages are ordered by (name, id) and resumed with (name, id) > (?, ?)
+        'DROP INDEX IF EXISTS idx_contacts_name',
+        'DROP INDEX IF EXISTS idx_contacts_added_by',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_name_id ON contacts (name, id)',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_added_by_name_id ON contacts (added_by, name, id)',
+    ]),
+    Migration(5, "full-text search over contacts and news", postgres=POSTGRES_SEARCH_SQL,
+              apply=lambda db, cursor: None if db.use_postgres else create_sqlite_fts(db, cursor)),
+    Migration(6, "token counts for chat context budgeting",
+              postgres=['ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS token_count INTEGER'],
+              sqlite=['ALTER TABLE chat_history ADD COLUMN token_count INTEGER'],
+              apply=lambda db, cursor: backfill_token_counts(db, cursor)),
+    Migration(7, "rolling chat summaries", [
+        # One row per user: condensed turns up to and including chat_history.id = covered_until_id
+        '''
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id BIGINT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            covered_until_id INTEGER NOT NULL,
+            token_count INTEGER,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_chat_history_user_id ON chat_history (user_id, id)',
+    ]),
+    Migration(8, "daily LLM usage ledger", [
+        # One row per UTC day and model; "exhausted" = daily free-tier quota hit
+        '''
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            day TEXT NOT NULL,
+            model TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            failures INTEGER NOT NULL DEFAULT 0,
+            exhausted INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (day, model)
+        )
+        ''',
+    ]),
+    Migration(9, "news sentiment cache", [
+        # Keyed by a hash of the article link, so no article is scored twice
+        '''
+        CREATE TABLE IF NOT EXISTS news_sentiment (
+            link_hash TEXT PRIMARY KEY,
+            sentiment TEXT NOT NULL,
+            score REAL NOT NULL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def backfill_token_counts(db, cursor, batch_size: int = 1000):
+    """Estimate token_count for rows written before the column existed"""
+    last_id = 0
+    while True:
+        db._execute(cursor, '''
+            SELECT id, content FROM chat_history
+            WHERE token_count IS NULL AND id > ?
+            ORDER BY id LIMIT ?
+        ''', (last_id, batch_size))
+        rows = [tuple(row) for row in cursor.fetchall()]
+        if not rows:
+            return
+        updates = [(estimate_tokens(content or ''), row_id) for row_id, content in rows]
+        cursor.executemany('UPDATE chat_history SET token_count = %s WHERE id = %s' if db.use_postgres
+                           else 'UPDATE chat_history SET token_count = ? WHERE id = ?', updates)
+        last_id = rows[-1][0]
+
+
+def current_version(db, cursor) -> int:
+    """Applied schema version, 0 for a fresh or pre-migration database"""
+    if db.use_postgres:
+        cursor.execute("SELECT to_regclass('schema_version') IS NOT NULL")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+    if not cursor.fetchone()[0]:
+        return 0
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    return cursor.fetchone()[0] or 0
+
+
+# Databases already verified at LATEST_VERSION in this process
+_current_targets = set()
+_current_lock = threading.Lock()
+
+
+def migrate(db) -> int:
+    """Apply pending migrations; returns the resulting schema version"""
+    target = getattr(db, 'target', None)
+    if target in _current_targets:
+        return LATEST_VERSION
+    with _current_lock:
+        if target in _current_targets:
+            return LATEST_VERSION
+        version = _migrate(db)
+        if target is not None and version >= LATEST_VERSION:
+            _current_targets.add(target)
+        return version
+
+
+def _migrate(db) -> int:
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        version = current_version(db, cursor)
+    if version >= LATEST_VERSION:
+        return version
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            if db.use_postgres:
+                # Serialize concurrent deploys; re-check once we hold the lock
+                cursor.execute('SELECT pg_advisory_xact_lock(727001)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            if current_version(db, cursor) >= migration.version:
+                continue
+            for sql in migration.sql_for(db.use_postgres):
+                cursor.execute(sql)
+            if migration.apply:
+                migration.apply(db, cursor)
+            db._execute(cursor, 'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                        (migration.version, migration.description))
+        logging.info(f"✅ Applied migration {migration.version}: {migration.description}")
+        version = migration.version
+
+    return version
@@ -0,0 +1,336 @@
+"""
+Connection pooling for the database layer.
+
+PostgreSQL (Railway): bounded thread-safe pool with health checks and
+max-lifetime recycling, so a chat turn reuses warm TLS connections instead of
+doing a fresh handshake per query.
+SQLite (local): one long-lived connection per thread.
+"""
+
+import os
+import time
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+
+# Pool tuning (environment overrides)
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "10"))
+POOL_MAX_LIFETIME = float(os.environ.get("DB_POOL_MAX_LIFETIME", "1800"))      # seconds
+POOL_HEALTH_CHECK_AFTER = float(os.environ.get("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # idle seconds
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))                  # checkout wait
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the checkout timeout"""
+
+
+class _PooledConnection:
+    """Pool bookkeeping for a single connection"""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class _CheckoutStats:
+    """Checkout counters shared by both pool implementations"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.checkouts += 1
+        self.total_wait += wait
+        if wait > self.max_wait:
+            self.max_wait = wait
+
+    def as_dict(self) -> Dict:
+        avg = self.total_wait / self.checkouts if self.checkouts else 0.0
+        return {
+            "checkouts": self.checkouts,
+            "avg_checkout_ms": round(avg * 1000, 3),
+            "max_checkout_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class PostgresConnectionPool:
+    """Bounded, thread-safe pool of psycopg2 connections"""
+
+    def __init__(self, connect: Callable, min_size: int = POOL_MIN_SIZE,
+                 max_size: int = POOL_MAX_SIZE, max_lifetime: float = POOL_MAX_LIFETIME,
+                 health_check_after: float = POOL_HEALTH_CHECK_AFTER,
+                 timeout: float = POOL_TIMEOUT):
+        self._connect = connect
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle: List[_PooledConnection] = []
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._size = 0
+        self._waiters = 0
+        self._closed = False
+        self._recycled = 0
+        self._failed_checks = 0
+        self._stats = _CheckoutStats()
+
+    def warm(self):
+        """Open min_size connections up front (raises if the server is unreachable)"""
+        opened = []
+        try:
+            for _ in range(self.min_size):
+                opened.append(self.acquire())
+        finally:
+            for conn in opened:
+                self.release(conn)
+
+    def acquire(self):
+        """Check out a healthy connection, waiting up to `timeout` seconds"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout:.0f}s "
+                            f"(pool size {self.max_size})"
+                        )
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+
+            if entry is None:
+                # Reserved a slot above, open the connection outside the lock
+                try:
+                    entry = _PooledConnection(self._connect())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_usable(entry):
+                self._discard(entry)
+                continue
+
+            entry.last_used = time.monotonic()
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                self._stats.record(time.monotonic() - started)
+            return entry.conn
+
+    def release(self, conn, discard: bool = False):
+        """Return a connection to the pool (or close it if broken/expired)"""
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != 0:  # TRANSACTION_STATUS_IDLE
+                    conn.rollback()
+            except Exception:
+                discard = True
+
+        expired = time.monotonic() - entry.created_at > self.max_lifetime
+        if discard or conn.closed or expired or self._closed:
+            if expired:
+                with self._cond:
+                    self._recycled += 1
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def close(self):
+        """Close idle connections and refuse new checkouts"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            data = {
+                "backend": "postgres",
+                "size": self._size,
+                "max_size": self.max_size,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_checks,
+            }
+            data.update(self._stats.as_dict())
+        return data
+
+    def _is_usable(self, entry: _PooledConnection) -> bool:
+        conn = entry.conn
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - entry.created_at > self.max_lifetime:
+            with self._cond:
+                self._recycled += 1
+            return False
+        if now - entry.last_used < self.health_check_after:
+            return True
+        # Idle for a while: the server or a proxy may have dropped it
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception as e:
+            with self._cond:
+                self._failed_checks += 1
+            logging.warning(f"Dropping stale PostgreSQL connection: {e}")
+            return False
+
+    def _discard(self, entry: _PooledConnection):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+class SQLiteConnectionManager:
+    """One long-lived SQLite connection per thread"""
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._stats = _CheckoutStats()
+
+    def warm(self):
+        self.release(self.acquire())
+
+    def acquire(self) -> sqlite3.Connection:
+        started = time.monotonic()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers in other threads proceed while one thread writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections[threading.get_ident()] = conn
+        with self._lock:
+            self._stats.record(time.monotonic() - started)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, discard: bool = False):
+        if not discard:
+            return
+        if getattr(self._local, "conn", None) is conn:
+            self._local.conn = None
+        with self._lock:
+            for ident, known in list(self._connections.items()):
+                if known is conn:
+                    del self._connections[ident]
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception as e:
+            broken = _is_connection_error(e)
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def close(self):
+        """Close every thread's connection"""
+        with self._lock:
+            connections, self._connections = list(self._connections.values()), {}
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            data = {
+                "backend": "sqlite",
+                "size": len(self._connections),
+                "in_use": 0,
+                "idle": len(self._connections),
+                "waiters": 0,
+            }
+            data.update(self._stats.as_dict())
+        return data
+
+
+def _is_connection_error(error: Exception) -> bool:
+    """True if the error means the connection itself is unusable"""
+    if isinstance(error, sqlite3.ProgrammingError):
+        return "closed" in str(error).lower()
+    try:
+        import psycopg2
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    except ImportError:
+        return False
@@ -0,0 +1,113 @@
+"""
+Full-text search helpers for contacts and news.
+
+SQLite: FTS5 external-content tables (contacts_fts, news_fts) kept in sync by
+triggers. PostgreSQL: generated `search_vector` tsvector columns with GIN
+indexes. Both are created by migration 5 in db_migrations; this module turns
+free-form user input into safe prefix queries for either engine.
+"""
+
+import re
+import logging
+import sqlite3
+from typing import List
+
+
+MAX_SEARCH_TERMS = 8
+
+# Letters and digits only: FTS5 / tsquery operators can never leak through
+_TERM_RE = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def search_terms(query: str) -> List[str]:
+    """Lower-cased words of a user query"""
+    return _TERM_RE.findall((query or '').lower())[:MAX_SEARCH_TERMS]
+
+
+def fts5_prefix_query(terms: List[str]) -> str:
+    """All terms must match, each as a prefix: "ali"* "996"*"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def tsquery_prefix_query(terms: List[str]) -> str:
+    """to_tsquery() form of the same query: ali:* & 996:*"""
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+# A phone number fragment: digits plus the separators people type between them
+_PHONE_QUERY_RE = re.compile(r'[\d\s()+-]*\d[\d\s()+-]*')
+
+# contacts.phone with those separators removed, for substring matching
+PHONE_DIGITS_SQL = "REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(c.phone, ' ', ''), '-', ''), '(', ''), ')', ''), '+', '')"
+
+
+def phone_digits(query: str) -> str:
+    """Digits of a phone-number query ("555", "+996 555"), else ''.
+
+    Full-text indexes only match token prefixes, so "555" would never find
+    "+996555123456"; such queries are matched as substrings instead.
+    """
+    query = (query or '').strip()
+    return re.sub(r'\D', '', query) if _PHONE_QUERY_RE.fullmatch(query) else ''
+
+
+SQLITE_FTS_TABLES = {
+    # fts table: (content table, indexed columns)
+    'contacts_fts': ('contacts', ('name', 'phone')),
+    'news_fts': ('news_articles', ('title', 'summary')),
+}
+
+
+def create_sqlite_fts(db, cursor):
+    """Create FTS5 tables + sync triggers; skipped (LIKE fallback) if FTS5 is missing"""
+    try:
+        for fts, (table, columns) in SQLITE_FTS_TABLES.items():
+            cols = ', '.join(columns)
+            new_vals = ', '.join(f'new.{c}' for c in columns)
+            old_vals = ', '.join(f'old.{c}' for c in columns)
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                    {cols}, content='{table}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_vals});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+                END
+            ''')
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_vals});
+                    INSERT INTO {fts} (rowid, {cols}) VALUES (new.id, {new_vals});
+                END
+            ''')
+            # Index rows that existed before the migration
+            cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        logging.warning(f"SQLite FTS5 unavailable, search will use LIKE: {e}")
+
+
+def sqlite_fts_available(cursor) -> bool:
+    cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'contacts_fts'")
+    return cursor.fetchone()[0] > 0
+
+
+POSTGRES_SEARCH_SQL = [
+    # 'simple' config: contacts and news mix Russian, Kyrgyz and English
+    '''
+    ALTER TABLE contacts ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(phone, ''))) STORED
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_contacts_search ON contacts USING GIN (search_vector)',
+    '''
+    ALTER TABLE news_articles ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(summary, ''))) STORED
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_news_search ON news_articles USING GIN (search_vector)',
+]
@@ -10,6 +10,8 @@ import tempfile
 import logging
 from typing import Optional
 
+from llm import get_client, OpenRouterError, PRIORITY_COMMAND
+
 
 class ImageGenerator:
     """
@@ -186,60 +188,43 @@ class DeepSeekChat:
     """DeepSeek R1 (free) via OpenRouter for advanced chat"""
     
     def __init__(self):
-        self.api_key = os.environ.get("OPENROUTER_API_KEY", "")
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.model = "deepseek/deepseek-r1-0528:free"
     
-    def chat(self, messages: list, max_tokens: int = 2000) -> str:
+    async def chat(self, messages: list, max_tokens: int = 2000, user_id: int = None) -> str:
         """
         Chat with DeepSeek R1 (free)
         messages: list of dicts with 'role' and 'content'
         """
-        if not self.api_key:
+        client = get_client()
+        if not client.api_key:
             return "❌ OPENROUTER_API_KEY не установлен"
         
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "deepseek/deepseek-r1-0528:free",
-                "messages": messages,
-                "max_tokens": max_tokens,
-                "temperature": 0.7
-            }
-            
             logging.info(f"Sending request to DeepSeek R1 (free)")
-            
-            response = requests.post(
-                self.api_url,
-                headers=headers,
-                json=data,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if "choices" in result and len(result["choices"]) > 0:
-                    return result["choices"][0]["message"]["content"]
-                return "❌ Пустой ответ от API"
-            elif response.status_code == 429:
+            return await client.chat(messages, [self.model], max_tokens=max_tokens, temperature=0.7,
+                                     user_id=user_id, priority=PRIORITY_COMMAND)
+        except OpenRouterError as e:
+            if e.status == 429:
                 return "❌ Превышен лимит запросов. Попробуйте позже."
-            elif response.status_code == 401:
+            elif e.status == 401:
                 return "❌ Ошибка авторизации. Проверьте API ключ."
-            else:
-                logging.error(f"DeepSeek error: {response.status_code} - {response.text}")
-                return f"❌ Ошибка API: {response.status_code}"
-                
+            elif e.status == 200:
+                return "❌ Пустой ответ от API"
+            logging.error(f"DeepSeek error: {e}")
+            return f"❌ Ошибка API: {e.status}" if e.status else f"❌ Ошибка: {e}"
         except Exception as e:
             logging.error(f"Error in DeepSeek chat: {e}")
             return f"❌ Ошибка: {e}"
     
-    def simple_chat(self, user_message: str) -> str:
+    def stream(self, messages: list, max_tokens: int = 2000, user_id: int = None):
+        """Same request as chat(), streamed as text deltas (raises OpenRouterError)"""
+        return get_client().chat_stream(messages, [self.model], max_tokens=max_tokens, temperature=0.7,
+                                        user_id=user_id, priority=PRIORITY_COMMAND)
+    
+    async def simple_chat(self, user_message: str, user_id: int = None) -> str:
         """Simple single message chat"""
         messages = [
             {"role": "system", "content": "You are a helpful assistant. Answer in the same language as the user's question."},
             {"role": "user", "content": user_message}
         ]
-        return self.chat(messages)
+        return await self.chat(messages, user_id=user_id)
@@ -0,0 +1,29 @@
+"""LLM access (OpenRouter) shared by all adapters."""
+from .errors import OpenRouterError, UserRateLimited, QuotaExhausted
+from .openrouter import OpenRouterClient, get_client
+from .health import ModelHealth, format_model_health
+from .cache import ResponseCache, format_cache_stats
+from .summarizer import ChatSummarizer
+from .inflight import InflightRequests
+from .scheduler import LLMScheduler, PRIORITY_CHAT, PRIORITY_COMMAND, PRIORITY_BACKGROUND
+from .usage import UsageLedger, format_llm_usage
+
+__all__ = [
+    'OpenRouterClient',
+    'OpenRouterError',
+    'UserRateLimited',
+    'QuotaExhausted',
+    'get_client',
+    'ModelHealth',
+    'format_model_health',
+    'ResponseCache',
+    'format_cache_stats',
+    'ChatSummarizer',
+    'InflightRequests',
+    'LLMScheduler',
+    'PRIORITY_CHAT',
+    'PRIORITY_COMMAND',
+    'PRIORITY_BACKGROUND',
+    'UsageLedger',
+    'format_llm_usage'
+]
@@ -0,0 +1,157 @@
+"""
+LLM response cache.
+
+Answers are keyed on the normalized user prompt plus a context fingerprint:
+the model chain, the system prompt and a hash of every message before the
+prompt. The cache is shared by all users, so only a request with exactly the
+same conversation can reuse an answer; one user's history never answers
+another user's question. Repeated questions are then answered from memory
+without spending free-tier quota. Entries expire
+after LLM_CACHE_TTL seconds and the least recently used ones are evicted
+beyond LLM_CACHE_MAX_ENTRIES. Set LLM_CACHE_DB to a file path to persist the
+cache in SQLite across restarts.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+LLM_CACHE = os.environ.get("LLM_CACHE", "true").lower() == "true"
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "21600"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_DB = os.environ.get("LLM_CACHE_DB", "")
+
+_SPACES = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.,;:…]+$")
+
+
+def normalize_prompt(text: str) -> str:
+    """Case, Unicode form, whitespace and trailing punctuation do not change the question"""
+    text = unicodedata.normalize("NFKC", text or "").lower().replace("ё", "е")
+    return _TRAILING.sub("", _SPACES.sub(" ", text).strip())
+
+
+def cache_key(messages: List[Dict], models: Sequence[str]) -> Optional[str]:
+    """Fingerprint of a chat request; None if it does not end with a user prompt"""
+    if not messages or messages[-1].get("role") != "user":
+        return None
+    system = [m.get("content", "") for m in messages if m.get("role") == "system"]
+    # The whole dialogue, not a recent window: the cache is shared across users
+    dialogue = [m for m in messages[:-1] if m.get("role") != "system"]
+    history = hashlib.sha256(json.dumps(
+        [[m.get("role"), normalize_prompt(m.get("content", ""))] for m in dialogue],
+        ensure_ascii=False).encode("utf-8")).hexdigest()
+    fingerprint = json.dumps([list(models), system, history, normalize_prompt(messages[-1].get("content", ""))],
+                             ensure_ascii=False)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """TTL + LRU cache of answers, optionally written through to SQLite"""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl: float = LLM_CACHE_TTL,
+                 path: str = LLM_CACHE_DB, clock=time.time):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (answer, expires_at)
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._open(path)
+
+    def _open(self, path: str):
+        try:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (self._clock(),))
+            rows = self._db.execute(
+                "SELECT key, answer, expires_at FROM llm_cache ORDER BY expires_at DESC LIMIT ?",
+                (self.max_entries,)).fetchall()
+            # Oldest first, so the freshest entries end up most recently used
+            for key, answer, expires_at in reversed(rows):
+                self._entries[key] = (answer, expires_at)
+            logging.info(f"LLM cache: {len(rows)} answers restored from {path}")
+        except sqlite3.Error as e:
+            logging.warning(f"LLM cache persistence disabled ({path}): {e}")
+            self._db = None
+
+    def get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: Optional[str], answer: str):
+        if key is None or not answer:
+            return
+        expires_at = self._clock() + self.ttl
+        evicted: List[str] = []
+        with self._lock:
+            self._entries[key] = (answer, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self._stats["stores"] += 1
+            self._stats["evictions"] += len(evicted)
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO llm_cache (key, answer, expires_at) VALUES (?, ?, ?)",
+                                     (key, answer, expires_at))
+                    if evicted:
+                        self._db.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in evicted])
+                except sqlite3.Error as e:
+                    logging.warning(f"LLM cache write failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(self._stats, entries=len(self._entries), persistent=self._db is not None,
+                        hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else None)
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def format_cache_stats(stats: Dict) -> str:
+    """Admin panel line (HTML-safe)"""
+    if not stats:
+        return "кэш выключен"
+    rate = f"{stats['hit_rate'] * 100:.0f}%" if stats["hit_rate"] is not None else "—"
+    return (f"🗄️ Кэш ответов: {rate} попаданий ({stats['hits']}/{stats['hits'] + stats['misses']}), "
+            f"{stats['entries']} записей" + (", на диске" if stats["persistent"] else ""))
@@ -0,0 +1,69 @@
+"""
+Token-budgeted chat context.
+
+Token counts are estimated locally (about 4 ASCII characters or 2.5 other
+characters, e.g. Cyrillic, per token), stored per chat_history row, and used
+to fill LLM_CONTEXT_TOKENS newest-first. The newest message is always sent
+whole; the first older turn that does not fit is truncated if enough budget
+is left, and everything older is dropped. A rolling conversation summary, if
+the user has one, goes first as a system message and is paid for up front.
+"""
+import os
+import math
+from typing import Dict, List, Optional
+
+
+LLM_CONTEXT_TOKENS = int(os.environ.get("LLM_CONTEXT_TOKENS", "3000"))
+LLM_CONTEXT_MAX_MESSAGES = int(os.environ.get("LLM_CONTEXT_MAX_MESSAGES", "40"))
+
+# Role/formatting tokens each message costs on top of its text
+MESSAGE_OVERHEAD = 4
+# Below this many tokens a truncated turn is more noise than context
+MIN_TRUNCATED_TOKENS = 48
+
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора:\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast approximation: ASCII/4 + non-ASCII/2.5"""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2.5)
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Beginning of text that fits in about `tokens`, cut at a word boundary"""
+    budget = float(tokens)
+    for end, ch in enumerate(text):
+        budget -= 0.25 if ord(ch) < 128 else 0.4
+        if budget < 0:
+            cut = text.rfind(" ", 0, end)
+            return text[:cut if cut > end // 2 else end].rstrip() + " …"
+    return text
+
+
+def build_context(rows: List[Dict], token_budget: int = LLM_CONTEXT_TOKENS,
+                  summary: Optional[str] = None) -> List[Dict]:
+    """Messages (oldest first, optional 'tokens' per row) that fit the budget, newest kept"""
+    selected: List[Dict] = []
+    remaining = token_budget
+    head: List[Dict] = []
+    if summary:
+        head.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        remaining -= estimate_tokens(head[0]["content"]) + MESSAGE_OVERHEAD
+    for index, row in enumerate(reversed(rows)):
+        tokens = row.get("tokens")
+        if tokens is None:
+            tokens = estimate_tokens(row["content"])
+        cost = tokens + MESSAGE_OVERHEAD
+        if index == 0 or cost <= remaining:
+            selected.append({"role": row["role"], "content": row["content"]})
+            remaining -= cost
+            continue
+        if remaining - MESSAGE_OVERHEAD >= MIN_TRUNCATED_TOKENS:
+            selected.append({"role": row["role"],
+                             "content": truncate_to_tokens(row["content"], remaining - MESSAGE_OVERHEAD)})
+        break
+    selected.reverse()
+    return head + selected
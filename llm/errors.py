@@ -0,0 +1,33 @@
+"""Errors raised by the LLM layer."""
+from typing import Optional
+
+
+class OpenRouterError(Exception):
+    """A failed OpenRouter call; `status` is the HTTP status (None for network errors/timeouts)"""
+
+    def __init__(self, message: str, status: Optional[int] = None, model: Optional[str] = None,
+                 timeout: bool = False):
+        super().__init__(message)
+        self.status = status
+        self.model = model
+        self.timeout = timeout
+
+    @property
+    def is_auth_error(self) -> bool:
+        return self.status == 401
+
+
+class UserRateLimited(OpenRouterError):
+    """The user's request budget is spent; nothing was sent upstream"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Слишком много запросов, повторите через {retry_after:.0f} с", status=429)
+        self.retry_after = retry_after
+
+
+class QuotaExhausted(OpenRouterError):
+    """Every requested model is out of its daily free-tier quota; nothing was sent upstream"""
+
+    def __init__(self, models):
+        super().__init__("Дневной лимит бесплатных моделей исчерпан", status=429,
+                         model=models[0] if len(models) == 1 else None)
@@ -0,0 +1,191 @@
+"""
+Per-model health for the OpenRouter fallback chain.
+
+Every completion reports its outcome here. A model that answers 429 (daily
+free-tier limit) or 400 is benched for a cooldown right away; timeouts and
+other errors open its circuit after LLM_CIRCUIT_FAILURES in a row, with the
+cooldown doubling on each re-open. Once a cooldown is over the circuit is
+half-open: `admit()` lets exactly one trial call through, and other callers
+skip the model until that trial reports back. `rank()` returns only usable
+models, ordered by recent success rate and then p50 latency, so a request goes
+straight to a model that is currently working instead of walking the chain in
+config order; benched models get no traffic until their cooldown is over.
+"""
+import os
+import html
+import time
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+
+LLM_HEALTH_WINDOW = int(os.environ.get("LLM_HEALTH_WINDOW", "50"))
+LLM_CIRCUIT_FAILURES = int(os.environ.get("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN = float(os.environ.get("LLM_CIRCUIT_COOLDOWN", "60"))
+LLM_CIRCUIT_MAX_COOLDOWN = float(os.environ.get("LLM_CIRCUIT_MAX_COOLDOWN", "3600"))
+LLM_RATE_LIMIT_COOLDOWN = float(os.environ.get("LLM_RATE_LIMIT_COOLDOWN", "900"))
+LLM_BAD_REQUEST_COOLDOWN = float(os.environ.get("LLM_BAD_REQUEST_COOLDOWN", "300"))
+
+RATE_LIMITED = "rate_limited"
+BAD_REQUEST = "bad_request"
+TIMEOUT = "timeout"
+ERROR = "error"
+
+
+class _Model:
+    __slots__ = ("outcomes", "latencies", "consecutive_failures", "open_until",
+                 "opened", "probing", "failures_by_kind", "last_error")
+
+    def __init__(self, window: int):
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.latencies: Deque[float] = deque(maxlen=window)  # successful calls only
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.opened = 0  # consecutive circuit openings, for backoff
+        self.probing = False  # half-open trial call in flight
+        self.failures_by_kind: Dict[str, int] = {}
+        self.last_error: Optional[str] = None
+
+    def half_open(self, now: float) -> bool:
+        return self.opened > 0 and self.open_until <= now
+
+    def success_rate(self) -> float:
+        # Beta(1, 1) prior: an untried model ranks below working ones, above failing ones
+        return (sum(self.outcomes) + 1) / (len(self.outcomes) + 2)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ModelHealth:
+    """Thread-safe registry of recent outcomes and circuit state per model"""
+
+    def __init__(self, window: int = LLM_HEALTH_WINDOW, clock=time.monotonic):
+        self.window = window
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models: Dict[str, _Model] = {}
+
+    def _model(self, name: str) -> _Model:
+        model = self._models.get(name)
+        if model is None:
+            model = self._models[name] = _Model(self.window)
+        return model
+
+    def record_success(self, name: str, latency: float):
+        with self._lock:
+            model = self._model(name)
+            model.outcomes.append(True)
+            model.latencies.append(latency)
+            model.consecutive_failures = 0
+            model.opened = 0
+            model.open_until = 0.0
+            model.probing = False
+
+    def record_failure(self, name: str, kind: str, error: str = ""):
+        with self._lock:
+            model = self._model(name)
+            model.outcomes.append(False)
+            model.consecutive_failures += 1
+            model.failures_by_kind[kind] = model.failures_by_kind.get(kind, 0) + 1
+            model.last_error = error[:200] or kind
+            model.probing = False
+
+            if kind == RATE_LIMITED:
+                cooldown = LLM_RATE_LIMIT_COOLDOWN
+            elif kind == BAD_REQUEST:
+                cooldown = LLM_BAD_REQUEST_COOLDOWN
+            elif model.consecutive_failures >= LLM_CIRCUIT_FAILURES or model.opened:
+                # A failed half-open trial re-opens at once, with a longer cooldown
+                cooldown = min(LLM_CIRCUIT_COOLDOWN * (2 ** model.opened), LLM_CIRCUIT_MAX_COOLDOWN)
+            else:
+                return
+            model.opened += 1
+            model.open_until = self._clock() + cooldown
+
+    def is_available(self, name: str) -> bool:
+        """Closed circuit, or cooldown over with no trial call in flight yet"""
+        with self._lock:
+            model = self._models.get(name)
+            return model is None or (model.open_until <= self._clock() and not model.probing)
+
+    def admit(self, name: str) -> Optional[bool]:
+        """Claim a call: None to skip (trial already in flight), True for the half-open trial, else False"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None or not model.half_open(self._clock()):
+                return False
+            if model.probing:
+                return None
+            model.probing = True
+            return True
+
+    def release(self, name: str):
+        """End a trial call that reported no outcome (cancelled, bad key)"""
+        with self._lock:
+            model = self._models.get(name)
+            if model is not None:
+                model.probing = False
+
+    def _split(self, names: Sequence[str]) -> Tuple[List[str], List[str]]:
+        now = self._clock()
+        with self._lock:
+            usable: List[Tuple] = []
+            benched: List[Tuple] = []
+            for index, name in enumerate(dict.fromkeys(names)):
+                model = self._models.get(name)
+                if model is not None and (model.open_until > now or model.probing):
+                    benched.append((model.open_until, index, name))
+                    continue
+                rate = model.success_rate() if model else 0.5
+                p50 = model.percentile(0.5) if model else None
+                # Coarse buckets so noise does not reshuffle the chain on every call
+                usable.append((-round(rate, 1), round(p50) if p50 is not None else 0, index, name))
+        return [entry[-1] for entry in sorted(usable)], [entry[-1] for entry in sorted(benched)]
+
+    def rank(self, names: Sequence[str]) -> List[str]:
+        """Usable models by success rate, then p50 latency, then config order; benched ones are left out"""
+        return self._split(names)[0]
+
+    def benched(self, names: Sequence[str]) -> List[str]:
+        """Models rank() leaves out (open circuit or trial in flight), soonest to recover first"""
+        return self._split(names)[1]
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        with self._lock:
+            model = self._models.get(name)
+            return model.percentile(q) if model else None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        now = self._clock()
+        with self._lock:
+            return {
+                name: {
+                    "calls": len(model.outcomes),
+                    "success_rate": round(sum(model.outcomes) / len(model.outcomes), 3) if model.outcomes else None,
+                    "p50_s": model.percentile(0.5),
+                    "p90_s": model.percentile(0.9),
+                    "circuit": ("open" if model.open_until > now
+                                else "half_open" if model.half_open(now) else "closed"),
+                    "retry_in_s": max(0.0, round(model.open_until - now, 1)),
+                    "failures": dict(model.failures_by_kind),
+                    "last_error": model.last_error,
+                }
+                for name, model in self._models.items()
+            }
+
+
+def format_model_health(snapshot: Dict[str, Dict]) -> str:
+    """Admin panel summary (HTML)"""
+    if not snapshot:
+        return "нет данных"
+    lines = []
+    for name, stats in sorted(snapshot.items()):
+        rate = f"{stats['success_rate'] * 100:.0f}%" if stats["success_rate"] is not None else "—"
+        p50 = f", p50 {stats['p50_s']:.1f}s" if stats["p50_s"] is not None else ""
+        state = {"open": f"⛔ ещё {stats['retry_in_s']:.0f}s", "half_open": "🔄 проверка"}.get(stats["circuit"], "✅")
+        lines.append(f"• <code>{html.escape(name)}</code>: {state} {rate} из {stats['calls']}{p50}")
+    return "\n".join(lines)
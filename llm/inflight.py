@@ -0,0 +1,90 @@
+"""
+At most one LLM generation in flight per chat.
+
+Every message is saved to the history as it arrives. The generation for it
+runs through `InflightRequests.run`, which builds its prompt from the history
+only when the generation starts, so one answer can cover several messages.
+When a user writes again while an answer is still being generated,
+LLM_INFLIGHT_MODE decides what happens:
+
+- "cancel" (default): the stale generation is cancelled at once, which closes
+  its upstream request and frees the connection. A new one starts for
+  everything the user has said so far.
+- "merge": the running answer finishes. Messages that arrive meanwhile
+  collapse into a single follow-up generation.
+
+A superseded call returns None.
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+
+LLM_INFLIGHT_MODE = os.environ.get("LLM_INFLIGHT_MODE", "cancel").lower()
+
+T = TypeVar("T")
+
+
+class _Slot:
+    __slots__ = ("task", "superseded")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.superseded = False
+
+
+class InflightRequests:
+    """Per-chat generation slots (single event loop, no locking needed)"""
+
+    def __init__(self, mode: str = LLM_INFLIGHT_MODE):
+        if mode not in ("cancel", "merge"):
+            logging.warning(f"Unknown LLM_INFLIGHT_MODE={mode!r}, using 'cancel'")
+            mode = "cancel"
+        self.mode = mode
+        self._running: Dict[Hashable, _Slot] = {}
+        self._waiting: Dict[Hashable, _Slot] = {}  # merge mode: the one follow-up per chat
+        self.stats = {"started": 0, "cancelled": 0, "merged": 0}
+
+    def busy(self, key: Hashable) -> bool:
+        return key in self._running
+
+    async def run(self, key: Hashable, generate: Callable[[], Awaitable[T]]) -> Optional[T]:
+        """Run generate() as the chat's only generation; None if a newer message superseded it"""
+        slot = _Slot()
+        if self.mode == "merge" and key in self._running:
+            previous = self._waiting.get(key)
+            if previous is not None:
+                previous.superseded = True
+                self.stats["merged"] += 1
+            self._waiting[key] = slot
+            try:
+                while True:
+                    running = self._running.get(key)
+                    if running is None or running.task.done():
+                        break
+                    await asyncio.wait({running.task})
+                    if slot.superseded:
+                        return None
+            finally:
+                if self._waiting.get(key) is slot:
+                    del self._waiting[key]
+        else:
+            running = self._running.get(key)
+            if running is not None:
+                running.superseded = True
+                running.task.cancel()
+                self.stats["cancelled"] += 1
+
+        slot.task = asyncio.ensure_future(generate())
+        self._running[key] = slot
+        self.stats["started"] += 1
+        try:
+            return await slot.task
+        except asyncio.CancelledError:
+            if slot.superseded:
+                return None
+            raise
+        finally:
+            if self._running.get(key) is slot:
+                del self._running[key]
@@ -0,0 +1,446 @@
+"""
+Async OpenRouter client.
+
+Every LLM call in the project (chat replies, /gpt4, news sentiment, voice
+transcription) goes through one `OpenRouterClient` that keeps a single
+aiohttp session open, so requests reuse pooled keep-alive connections
+instead of paying a TLS handshake each time and never block the event loop.
+Chat requests are admitted by the client's `LLMScheduler` and every upstream
+attempt is counted in its daily `UsageLedger`.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Set, Tuple
+
+import aiohttp
+
+from .errors import OpenRouterError, QuotaExhausted
+from .health import ModelHealth, RATE_LIMITED, BAD_REQUEST, TIMEOUT, ERROR
+from .cache import ResponseCache, cache_key, LLM_CACHE
+from .scheduler import LLMScheduler, PRIORITY_CHAT
+from .usage import UsageLedger, is_daily_limit
+
+logger = logging.getLogger(__name__)
+
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+# Total time for one request / to establish a connection (seconds)
+OPENROUTER_TIMEOUT = float(os.environ.get("OPENROUTER_TIMEOUT", "60"))
+OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get("OPENROUTER_CONNECT_TIMEOUT", "10"))
+# Pooled connections to the API host, and how long idle ones are kept
+OPENROUTER_MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS", "20"))
+OPENROUTER_KEEPALIVE = float(os.environ.get("OPENROUTER_KEEPALIVE", "60"))
+
+# Hedged chat requests: if the current model has not answered after the hedge
+# delay, the next model in the chain is asked too and the first answer wins.
+# The delay is OPENROUTER_HEDGE_DELAY seconds, or (if unset) the model's recent
+# p90 latency, never below OPENROUTER_HEDGE_MIN_DELAY.
+OPENROUTER_HEDGE = os.environ.get("OPENROUTER_HEDGE", "false").lower() == "true"
+OPENROUTER_HEDGE_DELAY = os.environ.get("OPENROUTER_HEDGE_DELAY", "")
+OPENROUTER_HEDGE_MIN_DELAY = float(os.environ.get("OPENROUTER_HEDGE_MIN_DELAY", "2"))
+OPENROUTER_HEDGE_DEFAULT_DELAY = float(os.environ.get("OPENROUTER_HEDGE_DEFAULT_DELAY", "8"))
+OPENROUTER_HEDGE_MAX_PARALLEL = int(os.environ.get("OPENROUTER_HEDGE_MAX_PARALLEL", "2"))
+
+
+class OpenRouterClient:
+    """Chat completions and transcription over one keep-alive session"""
+
+    def __init__(self, api_key: Optional[str] = None, hedge: bool = OPENROUTER_HEDGE,
+                 cache: Optional[ResponseCache] = None):
+        self.api_key = api_key if api_key is not None else os.environ.get("OPENROUTER_API_KEY", "")
+        self.hedge = hedge
+        # Chat answers (chat / chat_stream) for repeated questions; None disables
+        self.cache = cache if cache is not None else (ResponseCache() if LLM_CACHE else None)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing: Set[asyncio.Task] = set()
+        self.health = ModelHealth()
+        self.usage = UsageLedger()
+        self.scheduler = LLMScheduler()
+
+    def _http(self) -> aiohttp.ClientSession:
+        """Lazily open the session inside the running loop (and reopen for a new loop)"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                self._close_stale(self._session, self._loop, loop)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=OPENROUTER_MAX_CONNECTIONS,
+                    limit_per_host=OPENROUTER_MAX_CONNECTIONS,
+                    keepalive_timeout=OPENROUTER_KEEPALIVE,
+                ),
+                timeout=aiohttp.ClientTimeout(total=OPENROUTER_TIMEOUT,
+                                              sock_connect=OPENROUTER_CONNECT_TIMEOUT),
+            )
+            self._loop = loop
+        return self._session
+
+    def _close_stale(self, session: aiohttp.ClientSession, old_loop: Optional[asyncio.AbstractEventLoop],
+                     loop: asyncio.AbstractEventLoop):
+        """Close a session left behind on another loop instead of leaking its connector"""
+        if old_loop is not None and old_loop.is_running() and not old_loop.is_closed():
+            asyncio.run_coroutine_threadsafe(session.close(), old_loop)
+            return
+        # The old loop is gone: its transports died with it, closing releases the connector
+        task = loop.create_task(session.close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def _headers(self, json_body: bool = True) -> Dict[str, str]:
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+        if json_body:
+            headers["Content-Type"] = "application/json"
+        return headers
+
+    async def complete(self, messages: List[Dict], model: str, max_tokens: int = 1000,
+                       temperature: Optional[float] = None, timeout: Optional[float] = None) -> str:
+        """One chat completion from one model; raises OpenRouterError on any failure"""
+        if not self.api_key:
+            raise OpenRouterError("OPENROUTER_API_KEY не установлен", status=401, model=model)
+        if self.usage.is_exhausted(model):
+            raise QuotaExhausted([model])
+        trial = self._admit(model)
+
+        started = time.monotonic()
+        try:
+            content = await self._complete(messages, model, max_tokens, temperature, timeout)
+        except OpenRouterError as e:
+            if not e.is_auth_error:  # a bad key says nothing about the model
+                self.health.record_failure(model, _failure_kind(e), str(e))
+                await self.usage.record(model, ok=False, exhausted=is_daily_limit(e))
+            raise
+        except asyncio.CancelledError:
+            # Hedge loser or superseded request: already sent, so it still uses quota
+            await self.usage.record(model, ok=False)
+            raise
+        finally:
+            if trial:
+                self.health.release(model)
+        self.health.record_success(model, time.monotonic() - started)
+        await self.usage.record(model, ok=True)
+        return content
+
+    def _admit(self, model: str) -> bool:
+        """True if this call is the model's half-open trial; raises while another trial runs"""
+        trial = self.health.admit(model)
+        if trial is None:
+            raise OpenRouterError("Модель восстанавливается, пробный запрос уже выполняется", model=model)
+        return trial
+
+    async def _complete(self, messages: List[Dict], model: str, max_tokens: int,
+                        temperature: Optional[float], timeout: Optional[float]) -> str:
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+
+        try:
+            async with self._http().post(f"{OPENROUTER_BASE_URL}/chat/completions",
+                                         headers=self._headers(), json=payload,
+                                         timeout=request_timeout) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    raise OpenRouterError(f"HTTP {response.status}: {text[:200]}",
+                                          status=response.status, model=model)
+                result = await _json_body(response, model)
+        except asyncio.TimeoutError:
+            raise OpenRouterError("Таймаут", model=model, timeout=True) from None
+        except aiohttp.ClientError as e:
+            raise OpenRouterError(str(e) or type(e).__name__, model=model) from e
+
+        choices = result.get("choices") or []
+        choice = choices[0] if isinstance(choices, list) and choices and isinstance(choices[0], dict) else {}
+        message = choice.get("message")
+        content = message.get("content") if isinstance(message, dict) else None
+        if not content or not isinstance(content, str):
+            raise OpenRouterError("Пустой ответ", status=200, model=model)
+        return content
+
+    def slot(self, user_id=None, priority: int = PRIORITY_CHAT):
+        """Scheduler slot for callers that use complete() directly (e.g. background jobs)"""
+        return self.scheduler.slot(user_id, priority)
+
+    def _ranked(self, models: Sequence[str]) -> List[str]:
+        """Healthy models with quota left today; benched ones get no request while another can answer"""
+        ranked = self.usage.available(self.health.rank(models))
+        if not ranked:
+            # Every model is cooling down: one attempt on the one that recovers soonest
+            ranked = self.usage.available(self.health.benched(models))[:1]
+        if not ranked:
+            raise QuotaExhausted(list(models))
+        return ranked
+
+    def _cached(self, messages: List[Dict], models: Sequence[str]) -> Tuple[Optional[str], Optional[str]]:
+        """(cache key, cached answer) for a chat request"""
+        if self.cache is None:
+            return None, None
+        key = cache_key(messages, models)
+        answer = self.cache.get(key)
+        if answer is not None:
+            logger.info("[OpenRouter] Ответ взят из кэша")
+        return key, answer
+
+    async def chat(self, messages: List[Dict], models: Sequence[str], max_tokens: int = 1000,
+                   temperature: Optional[float] = None, user_id=None, priority: int = PRIORITY_CHAT) -> str:
+        """Cached answer, or the first answer from the model chain (admitted by the scheduler)"""
+        key, answer = self._cached(messages, models)
+        if answer is not None:
+            return answer
+        async with self.scheduler.slot(user_id, priority):
+            answer = await self._chat_chain(messages, models, max_tokens, temperature)
+        if self.cache is not None:
+            self.cache.put(key, answer)
+        return answer
+
+    async def _chat_chain(self, messages: List[Dict], models: Sequence[str], max_tokens: int,
+                          temperature: Optional[float]) -> str:
+        """Try healthy models first until one answers; 401 stops at once, other errors fall through"""
+        ranked = self._ranked(models)
+        if self.hedge and len(ranked) > 1:
+            return await self._chat_hedged(messages, ranked, max_tokens, temperature)
+        last_error: Optional[OpenRouterError] = None
+        for model in ranked:
+            logger.info(f"[OpenRouter] Попытка использовать модель: {model}")
+            try:
+                content = await self.complete(messages, model, max_tokens, temperature)
+            except OpenRouterError as e:
+                if e.is_auth_error:
+                    raise
+                logger.warning(f"[OpenRouter] Модель {model} недоступна ({e}), пробуем следующую...")
+                last_error = e
+                continue
+            logger.info(f"[OpenRouter] Успешно использована модель: {model}")
+            return content
+        raise last_error or OpenRouterError("Нет моделей для запроса")
+
+    async def stream(self, messages: List[Dict], model: str, max_tokens: int = 1000,
+                     temperature: Optional[float] = None) -> AsyncIterator[str]:
+        """One streamed (SSE) completion from one model, yielded as text deltas"""
+        if not self.api_key:
+            raise OpenRouterError("OPENROUTER_API_KEY не установлен", status=401, model=model)
+        if self.usage.is_exhausted(model):
+            raise QuotaExhausted([model])
+        trial = self._admit(model)
+
+        started = time.monotonic()
+        received = False
+        try:
+            async for delta in self._stream(messages, model, max_tokens, temperature):
+                received = True
+                yield delta
+            if not received:
+                raise OpenRouterError("Пустой ответ", status=200, model=model)
+        except OpenRouterError as e:
+            if not e.is_auth_error:
+                self.health.record_failure(model, _failure_kind(e), str(e))
+                await self.usage.record(model, ok=False, exhausted=is_daily_limit(e))
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # Cancelled or abandoned mid-stream: the request still counts against the quota
+            await self.usage.record(model, ok=False)
+            raise
+        finally:
+            if trial:
+                self.health.release(model)
+        self.health.record_success(model, time.monotonic() - started)
+        await self.usage.record(model, ok=True)
+
+    async def _stream(self, messages: List[Dict], model: str, max_tokens: int,
+                      temperature: Optional[float]) -> AsyncIterator[str]:
+        payload = {"model": model, "messages": messages, "max_tokens": max_tokens, "stream": True}
+        if temperature is not None:
+            payload["temperature"] = temperature
+        # A long answer may take minutes; only a stalled stream counts as a timeout
+        stream_timeout = aiohttp.ClientTimeout(total=None, sock_connect=OPENROUTER_CONNECT_TIMEOUT,
+                                               sock_read=OPENROUTER_TIMEOUT)
+        try:
+            async with self._http().post(f"{OPENROUTER_BASE_URL}/chat/completions",
+                                         headers=self._headers(), json=payload,
+                                         timeout=stream_timeout) as response:
+                if response.status != 200:
+                    text = await response.text()
+                    raise OpenRouterError(f"HTTP {response.status}: {text[:200]}",
+                                          status=response.status, model=model)
+                async for raw in response.content:
+                    line = raw.decode("utf-8", "replace").strip()
+                    # Blank lines separate events; ": ..." lines are keep-alive comments
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        return
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+                    if chunk.get("error"):
+                        error = chunk["error"]
+                        code = error.get("code") if isinstance(error, dict) else None
+                        message = error.get("message", "") if isinstance(error, dict) else str(error)
+                        raise OpenRouterError(f"Stream error: {message[:200]}",
+                                              status=code if isinstance(code, int) else None, model=model)
+                    choices = chunk.get("choices") or []
+                    delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                    if delta:
+                        yield delta
+        except asyncio.TimeoutError:
+            raise OpenRouterError("Таймаут", model=model, timeout=True) from None
+        except aiohttp.ClientError as e:
+            raise OpenRouterError(str(e) or type(e).__name__, model=model) from e
+
+    async def chat_stream(self, messages: List[Dict], models: Sequence[str], max_tokens: int = 1000,
+                          temperature: Optional[float] = None, user_id=None,
+                          priority: int = PRIORITY_CHAT) -> AsyncIterator[str]:
+        """Streamed chat; a cached answer arrives as a single delta"""
+        key, answer = self._cached(messages, models)
+        if answer is not None:
+            yield answer
+            return
+        parts: List[str] = []
+        async with self.scheduler.slot(user_id, priority):
+            async for delta in self._chat_stream_chain(messages, models, max_tokens, temperature):
+                parts.append(delta)
+                yield delta
+        # Only complete answers are cached (not ones the consumer abandoned)
+        if self.cache is not None:
+            self.cache.put(key, "".join(parts))
+
+    async def _chat_stream_chain(self, messages: List[Dict], models: Sequence[str], max_tokens: int,
+                                 temperature: Optional[float]) -> AsyncIterator[str]:
+        """Streamed chat over the ranked chain; falls through only while nothing was yielded"""
+        last_error: Optional[OpenRouterError] = None
+        for model in self._ranked(models):
+            logger.info(f"[OpenRouter] Попытка использовать модель: {model} (stream)")
+            started_output = False
+            try:
+                async for delta in self.stream(messages, model, max_tokens, temperature):
+                    started_output = True
+                    yield delta
+            except OpenRouterError as e:
+                # Text already shown to the user cannot be retracted
+                if e.is_auth_error or started_output:
+                    raise
+                logger.warning(f"[OpenRouter] Модель {model} недоступна ({e}), пробуем следующую...")
+                last_error = e
+                continue
+            logger.info(f"[OpenRouter] Успешно использована модель: {model}")
+            return
+        raise last_error or OpenRouterError("Нет моделей для запроса")
+
+    def hedge_delay(self, model: str) -> float:
+        """Seconds to wait on `model` before also asking the next one"""
+        if OPENROUTER_HEDGE_DELAY:
+            return float(OPENROUTER_HEDGE_DELAY)
+        p90 = self.health.percentile(model, 0.9)
+        return max(OPENROUTER_HEDGE_MIN_DELAY, p90 if p90 is not None else OPENROUTER_HEDGE_DEFAULT_DELAY)
+
+    async def _chat_hedged(self, messages: List[Dict], ranked: List[str], max_tokens: int,
+                           temperature: Optional[float]) -> str:
+        """First successful answer wins; the other in-flight requests are cancelled"""
+        queue = list(ranked)
+        in_flight: Dict[asyncio.Task, str] = {}
+        last_error: Optional[OpenRouterError] = None
+        newest = None
+
+        def launch():
+            nonlocal newest
+            newest = queue.pop(0)
+            logger.info(f"[OpenRouter] Попытка использовать модель: {newest}")
+            task = asyncio.ensure_future(self.complete(messages, newest, max_tokens, temperature))
+            in_flight[task] = newest
+
+        try:
+            launch()
+            while in_flight:
+                can_hedge = bool(queue) and len(in_flight) < OPENROUTER_HEDGE_MAX_PARALLEL
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=self.hedge_delay(newest) if can_hedge else None)
+                if not done:
+                    logger.info(f"[OpenRouter] {newest} отвечает долго, параллельно спрашиваем следующую модель")
+                    launch()
+                    continue
+                for task in done:
+                    model = in_flight.pop(task)
+                    try:
+                        content = task.result()
+                    except OpenRouterError as e:
+                        if e.is_auth_error:
+                            raise
+                        logger.warning(f"[OpenRouter] Модель {model} недоступна ({e}), пробуем следующую...")
+                        last_error = e
+                        continue
+                    logger.info(f"[OpenRouter] Успешно использована модель: {model}")
+                    return content
+                if not in_flight and queue:
+                    launch()
+            raise last_error or OpenRouterError("Нет моделей для запроса")
+        finally:
+            # Losers are cancelled; complete() counts them as failed attempts, not as model failures
+            for task in in_flight:
+                task.cancel()
+
+    async def transcribe(self, file_path: str, model: str = "openai/whisper-1") -> str:
+        """Speech to text for a local audio file"""
+        with open(file_path, "rb") as audio_file:
+            form = aiohttp.FormData()
+            form.add_field("file", audio_file, filename=os.path.basename(file_path))
+            form.add_field("model", model)
+            try:
+                async with self._http().post(f"{OPENROUTER_BASE_URL}/audio/transcriptions",
+                                             headers=self._headers(json_body=False),
+                                             data=form) as response:
+                    if response.status != 200:
+                        text = await response.text()
+                        raise OpenRouterError(f"HTTP {response.status}: {text[:200]}",
+                                              status=response.status, model=model)
+                    result = await _json_body(response, model)
+            except asyncio.TimeoutError:
+                raise OpenRouterError("Таймаут", model=model, timeout=True) from None
+            except aiohttp.ClientError as e:
+                raise OpenRouterError(str(e) or type(e).__name__, model=model) from e
+        return result.get("text", "")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self.cache is not None:
+            self.cache.close()
+
+
+async def _json_body(response: aiohttp.ClientResponse, model: str) -> Dict:
+    """JSON object of a 200 response; a proxy / HTML error page becomes OpenRouterError"""
+    try:
+        result = await response.json(content_type=None)
+    except (ValueError, aiohttp.ContentTypeError):
+        raise OpenRouterError("Некорректный ответ: не JSON", status=200, model=model) from None
+    if not isinstance(result, dict):
+        raise OpenRouterError("Некорректный ответ: ожидался JSON-объект", status=200, model=model)
+    return result
+
+
+def _failure_kind(error: OpenRouterError) -> str:
+    if error.timeout:
+        return TIMEOUT
+    if error.status == 429:
+        return RATE_LIMITED
+    if error.status == 400:
+        return BAD_REQUEST
+    return ERROR
+
+
+_client: Optional[OpenRouterClient] = None
+
+
+def get_client(api_key: Optional[str] = None) -> OpenRouterClient:
+    """Process-wide client; a non-empty api_key (e.g. from config.json) replaces the env key"""
+    global _client
+    if _client is None:
+        _client = OpenRouterClient(api_key or None)
+    elif api_key:
+        _client.api_key = api_key
+    return _client
@@ -0,0 +1,155 @@
+"""
+Admission control for LLM requests.
+
+At most LLM_MAX_CONCURRENCY requests run upstream at once. Background work
+(news sentiment, chat summaries) never holds more than
+LLM_BACKGROUND_CONCURRENCY of those slots. When every slot is taken,
+requests wait:
+- by priority class (chat, then commands such as /gpt4, then background);
+- round-robin between users within a class, so one user's burst cannot
+  starve others.
+
+Interactive requests also draw from a per-user token bucket of
+LLM_USER_BURST requests, refilled at LLM_USER_RATE_PER_MIN. A user who
+runs out gets UserRateLimited at once. Nothing is sent upstream for that
+request.
+"""
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, Optional
+
+from .errors import UserRateLimited
+
+
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "4"))
+LLM_BACKGROUND_CONCURRENCY = int(os.environ.get("LLM_BACKGROUND_CONCURRENCY", "1"))
+LLM_USER_RATE_PER_MIN = float(os.environ.get("LLM_USER_RATE_PER_MIN", "6"))
+LLM_USER_BURST = int(os.environ.get("LLM_USER_BURST", "10"))
+
+# Priority classes, most urgent first
+PRIORITY_CHAT = 0
+PRIORITY_COMMAND = 1
+PRIORITY_BACKGROUND = 2
+PRIORITIES = (PRIORITY_CHAT, PRIORITY_COMMAND, PRIORITY_BACKGROUND)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class LLMScheduler:
+    """Global concurrency cap, priority classes, per-user fair share and rate limits"""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 background_concurrency: int = LLM_BACKGROUND_CONCURRENCY,
+                 user_rate_per_min: float = LLM_USER_RATE_PER_MIN, user_burst: int = LLM_USER_BURST,
+                 clock=time.monotonic):
+        self.max_concurrency = max(1, max_concurrency)
+        self.background_concurrency = max(1, min(background_concurrency, self.max_concurrency))
+        self.user_rate = user_rate_per_min / 60.0
+        self.user_burst = user_burst
+        self._clock = clock
+        self._active = 0
+        self._active_background = 0
+        # priority -> user -> waiting futures; users rotate to the back after each grant
+        self._queues: Dict[int, "OrderedDict[Hashable, Deque[asyncio.Future]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._buckets: Dict[Hashable, _Bucket] = {}
+        self.stats = {"admitted": 0, "queued": 0, "rate_limited": 0}
+
+    def _take_token(self, user_id: Hashable):
+        if self.user_burst <= 0:
+            return
+        now = self._clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(float(self.user_burst), now)
+        bucket.tokens = min(float(self.user_burst), bucket.tokens + (now - bucket.updated) * self.user_rate)
+        bucket.updated = now
+        if bucket.tokens < 1:
+            self.stats["rate_limited"] += 1
+            retry_after = (1 - bucket.tokens) / self.user_rate if self.user_rate > 0 else 3600.0
+            raise UserRateLimited(retry_after)
+        bucket.tokens -= 1
+
+    def _can_start(self, priority: int) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        return priority != PRIORITY_BACKGROUND or self._active_background < self.background_concurrency
+
+    def _start(self, priority: int):
+        self._active += 1
+        if priority == PRIORITY_BACKGROUND:
+            self._active_background += 1
+        self.stats["admitted"] += 1
+
+    def _waiting(self, up_to: int) -> bool:
+        return any(self._queues[priority] for priority in PRIORITIES if priority <= up_to)
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[Hashable] = None, priority: int = PRIORITY_CHAT):
+        """Hold one upstream slot; raises UserRateLimited if the user is over budget"""
+        if user_id is not None and priority != PRIORITY_BACKGROUND:
+            self._take_token(user_id)
+        if self._can_start(priority) and not self._waiting(priority):
+            self._start(priority)
+        else:
+            await self._wait(user_id, priority)
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if priority == PRIORITY_BACKGROUND:
+                self._active_background -= 1
+            self._dispatch()
+
+    async def _wait(self, user_id: Optional[Hashable], priority: int):
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[priority]
+        queue.setdefault(user_id, deque()).append(future)
+        self.stats["queued"] += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self._active -= 1
+                if priority == PRIORITY_BACKGROUND:
+                    self._active_background -= 1
+                self._dispatch()
+            else:
+                waiting = queue.get(user_id)
+                if waiting is not None and future in waiting:
+                    waiting.remove(future)
+                    if not waiting:
+                        del queue[user_id]
+            raise
+
+    def _dispatch(self):
+        """Grant free slots: most urgent class first, round-robin across its users"""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                user_id, waiting = next(iter(queue.items()))
+                future = waiting.popleft()
+                if waiting:
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                if future.done():
+                    continue
+                self._start(priority)
+                future.set_result(None)
+
+    def snapshot(self) -> Dict:
+        return dict(self.stats, active=self._active, active_background=self._active_background,
+                    waiting=sum(len(w) for queue in self._queues.values() for w in queue.values()),
+                    max_concurrency=self.max_concurrency)
@@ -0,0 +1,120 @@
+"""
+Rolling conversation summaries.
+
+After a reply, a user with at least CHAT_SUMMARY_TRIGGER messages newer than
+their stored summary gets all but the last CHAT_SUMMARY_KEEP_RECENT of those
+folded into the summary by one call to a cheap model (CHAT_SUMMARY_MODEL).
+This runs in the background, never on the reply path. Prompts then carry the
+summary as a system message plus only the turns it does not cover yet (see
+Database.get_chat_context), so long conversations keep their memory at a
+fraction of the prompt tokens.
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from .context import truncate_to_tokens
+from .errors import OpenRouterError
+from .openrouter import get_client
+from .scheduler import PRIORITY_BACKGROUND
+
+
+CHAT_SUMMARY = os.environ.get("CHAT_SUMMARY", "true").lower() == "true"
+CHAT_SUMMARY_MODEL = os.environ.get("CHAT_SUMMARY_MODEL", "google/gemini-2.5-flash-lite")
+CHAT_SUMMARY_TRIGGER = int(os.environ.get("CHAT_SUMMARY_TRIGGER", "24"))
+CHAT_SUMMARY_KEEP_RECENT = int(os.environ.get("CHAT_SUMMARY_KEEP_RECENT", "8"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", "400"))
+
+# Turns folded per call; a longer backlog is caught up over the next replies
+SUMMARY_BATCH = 100
+# Long answers are clipped in the summarizer prompt, not in the stored history
+SUMMARY_TURN_TOKENS = 300
+
+SUMMARY_INSTRUCTIONS = (
+    "Ты ведёшь краткий конспект диалога пользователя с ассистентом. "
+    "Обнови конспект с учётом новых реплик: сохрани факты о пользователе, его цели, "
+    "просьбы, договорённости, имена, числа и нерешённые вопросы; опусти приветствия, "
+    "повторы и дословные ответы. Пиши сжато, на языке диалога, не длиннее {words} слов. "
+    "Ответь только текстом конспекта."
+)
+
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Ассистент"}
+
+
+def summary_prompt(previous: Optional[str], turns: List[Dict], max_tokens: int) -> List[Dict]:
+    """Messages asking the model to fold `turns` into `previous`"""
+    dialogue = "\n".join(
+        f"{ROLE_NAMES.get(turn['role'], turn['role'])}: {truncate_to_tokens(turn['content'], SUMMARY_TURN_TOKENS)}"
+        for turn in turns
+    )
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS.format(words=max_tokens * 2 // 3)},
+        {"role": "user", "content": f"Текущий конспект:\n{previous or '(пусто)'}\n\nНовые реплики:\n{dialogue}"},
+    ]
+
+
+class ChatSummarizer:
+    """Refreshes per-user summaries in background tasks, at most one per user"""
+
+    def __init__(self, db, client=None, model: str = CHAT_SUMMARY_MODEL,
+                 trigger: int = CHAT_SUMMARY_TRIGGER, keep_recent: int = CHAT_SUMMARY_KEEP_RECENT,
+                 max_tokens: int = CHAT_SUMMARY_MAX_TOKENS, enabled: bool = CHAT_SUMMARY):
+        self.db = db
+        self.client = client or get_client()
+        self.model = model
+        self.trigger = max(trigger, keep_recent + 2)
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self.enabled = enabled
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def schedule(self, user_id: int):
+        """Check the user's backlog after a reply; summarize in the background if needed"""
+        if not self.enabled:
+            return
+        task = self._tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._run(user_id))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda t: self._tasks.pop(user_id, None) if self._tasks.get(user_id) is t else None)
+
+    async def _run(self, user_id: int):
+        try:
+            await self.refresh(user_id)
+        except OpenRouterError as e:
+            logging.warning(f"Chat summary for {user_id} skipped: {e}")
+        except Exception as e:
+            logging.error(f"Chat summary for {user_id} failed: {e}")
+
+    async def refresh(self, user_id: int) -> bool:
+        """Fold older unsummarized turns into the summary; True if a new one was stored"""
+        state = await self.db.aio.get_chat_summary(user_id)
+        if state is not None:
+            fresh, previous, covered = state["fresh_messages"], state["summary"], state["covered_until_id"]
+        else:
+            fresh, previous, covered = await self.db.aio.count_chat_messages(user_id), None, 0
+        if fresh < self.trigger:
+            return False
+
+        turns = await self.db.aio.get_chat_turns_after(user_id, covered, SUMMARY_BATCH + self.keep_recent)
+        fold = turns[:max(0, len(turns) - self.keep_recent)][:SUMMARY_BATCH]
+        if not fold:
+            return False
+
+        async with self.client.slot(priority=PRIORITY_BACKGROUND):
+            summary = await self.client.complete(summary_prompt(previous, fold, self.max_tokens), self.model,
+                                                 max_tokens=self.max_tokens, temperature=0.2, timeout=30)
+        summary = summary.strip()
+        if not summary:
+            return False
+        saved = await self.db.aio.save_chat_summary(user_id, summary, fold[-1]["id"])
+        if saved:
+            logging.info(f"Chat summary for {user_id}: {len(fold)} turns folded, up to #{fold[-1]['id']}")
+        return saved
+
+    async def close(self):
+        """Wait for summaries in flight (used on shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks.values()), return_exceptions=True)
@@ -0,0 +1,132 @@
+"""
+Daily per-model usage ledger for the OpenRouter free tier.
+
+Every upstream attempt is counted per UTC day (OpenRouter resets its free-tier
+quota at UTC midnight) in memory and, once a database is attached, in the
+llm_usage table, so the counts survive restarts. A model is exhausted for the
+rest of the day when OpenRouter reported its daily limit with a 429, or when
+all ":free" models together reached LLM_FREE_DAILY_LIMIT requests. The client
+skips exhausted models up front instead of discovering that through 429
+round trips.
+"""
+import os
+import html
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence
+
+
+LLM_FREE_DAILY_LIMIT = int(os.environ.get("LLM_FREE_DAILY_LIMIT", "200"))
+
+FREE_SUFFIX = ":free"
+
+
+def utc_day() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def is_free_model(model: str) -> bool:
+    return model.endswith(FREE_SUFFIX)
+
+
+def is_daily_limit(error) -> bool:
+    """429 for the per-day quota (OpenRouter: "free-models-per-day"), not the per-minute one"""
+    return error.status == 429 and "per-day" in str(error)
+
+
+class _Usage:
+    __slots__ = ("requests", "failures", "exhausted")
+
+    def __init__(self, requests: int = 0, failures: int = 0, exhausted: bool = False):
+        self.requests = requests
+        self.failures = failures
+        self.exhausted = exhausted
+
+
+class UsageLedger:
+    """Today's requests/failures/exhaustion per model"""
+
+    def __init__(self, free_daily_limit: int = LLM_FREE_DAILY_LIMIT, today=utc_day):
+        self.free_daily_limit = free_daily_limit
+        self._today = today
+        self._lock = threading.Lock()
+        self._day = today()
+        self._models: Dict[str, _Usage] = {}
+        self._db = None
+
+    def attach(self, db):
+        """Persist to db.llm_usage from now on, starting from today's stored counts"""
+        self._db = db
+        try:
+            rows = db.get_llm_usage(self._today())
+        except Exception as e:
+            logging.error(f"LLM usage ledger: could not load today's usage: {e}")
+            return
+        with self._lock:
+            self._roll()
+            for row in rows:
+                self._models[row["model"]] = _Usage(row["requests"], row["failures"], bool(row["exhausted"]))
+
+    def _roll(self):
+        day = self._today()
+        if day != self._day:
+            self._day = day
+            self._models.clear()
+
+    def _free_requests(self) -> int:
+        return sum(usage.requests for model, usage in self._models.items() if is_free_model(model))
+
+    def is_exhausted(self, model: str) -> bool:
+        with self._lock:
+            self._roll()
+            usage = self._models.get(model)
+            if usage is not None and usage.exhausted:
+                return True
+            return (is_free_model(model) and self.free_daily_limit > 0
+                    and self._free_requests() >= self.free_daily_limit)
+
+    def available(self, models: Sequence[str]) -> List[str]:
+        """Models that still have quota today, in the given order"""
+        return [model for model in models if not self.is_exhausted(model)]
+
+    async def record(self, model: str, ok: bool, exhausted: bool = False):
+        """Count one upstream attempt (and write it through when a database is attached)"""
+        with self._lock:
+            self._roll()
+            day = self._day
+            usage = self._models.setdefault(model, _Usage())
+            usage.requests += 1
+            usage.failures += 0 if ok else 1
+            usage.exhausted = usage.exhausted or exhausted
+        if exhausted:
+            logging.warning(f"LLM usage ledger: {model} exhausted its daily quota ({day} UTC)")
+        if self._db is not None:
+            try:
+                await self._db.aio.record_llm_usage(day, model, 1, 0 if ok else 1, exhausted)
+            except Exception as e:
+                logging.error(f"LLM usage ledger write failed: {e}")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            self._roll()
+            return {
+                "day": self._day,
+                "free_requests": self._free_requests(),
+                "free_limit": self.free_daily_limit,
+                "models": {model: {"requests": u.requests, "failures": u.failures, "exhausted": u.exhausted}
+                           for model, u in self._models.items()},
+            }
+
+
+def format_llm_usage(snapshot: Optional[Dict]) -> str:
+    """Admin panel summary (HTML)"""
+    if not snapshot:
+        return "нет данных"
+    lines = [f"📅 {snapshot['day']} UTC: бесплатных запросов {snapshot['free_requests']}"
+             + (f"/{snapshot['free_limit']}" if snapshot["free_limit"] > 0 else "")]
+    for model, usage in sorted(snapshot["models"].items()):
+        state = " ⛔ лимит исчерпан" if usage["exhausted"] else ""
+        lines.append(f"• <code>{html.escape(model)}</code>: {usage['requests']} "
+                     f"(ошибок {usage['failures']}){state}")
+    return "\n".join(lines)
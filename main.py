@@ -50,9 +50,13 @@ async def main():
         # ===== RAILWAY MODE (webhook) =====
         from adapters.telegram_full import FullTelegramBot
         from adapters.whatsapp_webhook import WhatsAppWebhookBot
+        from services import Services
+
+        # One database pool, aggregator and HTTP client for both adapters
+        services = Services()
 
         # Initialize Telegram bot
-        telegram_bot = FullTelegramBot()
+        telegram_bot = FullTelegramBot(services)
         
         if telegram_bot and telegram_bot.enabled:
             # Create webhook handler for Telegram
@@ -69,8 +73,11 @@ async def main():
             app.router.add_post('/webhook-telegram', telegram_webhook_handler)
             logger.info("✅ Telegram webhook handler added: /webhook-telegram")
 
+            # News collection and scheduled digests
+            telegram_bot.start_background()
+
         # Initialize WhatsApp bot
-        whatsapp_bot = WhatsAppWebhookBot()
+        whatsapp_bot = WhatsAppWebhookBot(services)
         if whatsapp_bot and whatsapp_bot.enabled:
             whatsapp_bot.setup_routes(app)
             logger.info("✅ WhatsApp webhook handler added: /webhook-whatsapp")
@@ -108,11 +115,13 @@ async def main():
             logger.info("Shutdown requested")
         finally:
             await runner.cleanup()
-            if telegram_bot:
+            if telegram_bot and telegram_bot.enabled:
+                await telegram_bot.stop_background()
                 try:
                     await telegram_bot.bot.delete_webhook()
                 except:
                     pass
+            await services.close()
 
     else:
         # ===== LOCAL MODE (polling) =====
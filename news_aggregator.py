@@ -3,14 +3,16 @@ AI News Aggregator with Sentiment Analysis
 Parses RSS from 20+ sources, classifies news, analyzes sentiment
 """
 
-import asyncio
 import aiohttp
 import feedparser
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 import logging
 import re
-import json
+import html
+
+from news_sentiment import score_news
+from news_classifier import classifier
 
 # RSS Sources by category
 RSS_SOURCES = {
@@ -51,43 +53,37 @@ RSS_SOURCES = {
     ],
 }
 
-# Category keywords for AI classification
-CATEGORY_KEYWORDS = {
-    "tech": ["технолог", "technology", "software", "hardware", "app", "программ", "ai", "кибер"],
-    "ai": ["искусственный интеллект", "machine learning", "deep learning", "neural", "нейросет", "chatgpt", "llm", "модель"],
-    "science": ["наука", "science", "research", "исследован", "discovery"],
-    "space": ["космос", "space", "spacex", "nasa", "rocket", "ракет", "марс", "mars"],
-    "finance": ["финанс", "finance", "crypto", "bitcoin", "экономик", "market", "биржа"],
-    "kyrgyzstan": ["кыргызстан", "бишкек", "кыргыз", "kg"],
-    "world": ["мир", "world", "политик", "politic", "war", "война"],
-    "sports": ["спорт", "football", "soccer", "nba", "olympic"],
-}
+RSS_HEADERS = {'User-Agent': 'Mozilla/5.0 (compatible; NewsBot/1.0)'}
 
 
 class NewsAggregator:
-    def __init__(self, db):
+    def __init__(self, db, session_factory=None):
         self.db = db
         self.session = None
+        # Shared HTTP client provider (services.Services); owned session otherwise
+        self._session_factory = session_factory
         
     async def init_session(self):
         """Initialize aiohttp session"""
-        if not self.session:
+        if self._session_factory:
+            self.session = self._session_factory()
+        elif not self.session:
             self.session = aiohttp.ClientSession(
                 timeout=aiohttp.ClientTimeout(total=30),
-                headers={'User-Agent': 'Mozilla/5.0 (compatible; NewsBot/1.0)'}
+                headers=RSS_HEADERS
             )
     
     async def close_session(self):
-        """Close aiohttp session"""
-        if self.session:
+        """Close aiohttp session (a shared one is left open for its owner)"""
+        if self.session and not self._session_factory:
             await self.session.close()
-            self.session = None
+        self.session = None
     
     async def fetch_rss(self, url: str) -> Optional[str]:
         """Fetch RSS feed content"""
         try:
             await self.init_session()
-            async with self.session.get(url) as response:
+            async with self.session.get(url, headers=RSS_HEADERS) as response:
                 if response.status == 200:
                     return await response.text()
                 else:
@@ -137,79 +133,13 @@ class NewsAggregator:
     
     def classify_category(self, title: str, summary: str = "") -> str:
         """Classify news into category based on keywords"""
-        text = (title + " " + summary).lower()
-        
-        scores = {}
-        for category, keywords in CATEGORY_KEYWORDS.items():
-            score = sum(1 for keyword in keywords if keyword.lower() in text)
-            if score > 0:
-                scores[category] = score
-        
-        if scores:
-            return max(scores, key=scores.get)
-        return "other"
+        return classifier.classify(title, summary)["category"]
     
     def clean_html(self, text: str) -> str:
         """Remove HTML tags from text"""
         clean = re.compile('<.*?>')
         return re.sub(clean, '', text)
     
-    async def analyze_sentiment_openrouter(self, title: str, summary: str) -> Dict:
-        """Analyze sentiment using OpenRouter AI"""
-        try:
-            import os
-            import requests
-            
-            api_key = os.environ.get("OPENROUTER_API_KEY", "")
-            if not api_key:
-                return {"sentiment": "neutral", "score": 0.0, "explanation": "No API key"}
-            
-            prompt = f"""Analyze the sentiment of this news article.
-Title: {title}
-Summary: {summary}
-
-Respond ONLY in JSON format:
-{{
-    "sentiment": "positive" | "negative" | "neutral",
-    "score": -1.0 to 1.0,
-    "explanation": "brief reason"
-}}"""
-            
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "google/gemini-2.5-flash-lite",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 200
-                },
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                
-                # Extract JSON from response
-                try:
-                    # Try to find JSON in the response
-                    json_match = re.search(r'\{[^}]+\}', content)
-                    if json_match:
-                        return json.loads(json_match.group())
-                except:
-                    pass
-                
-                return {"sentiment": "neutral", "score": 0.0, "explanation": content[:100]}
-            else:
-                return {"sentiment": "neutral", "score": 0.0, "explanation": "API error"}
-                
-        except Exception as e:
-            logging.error(f"Sentiment analysis error: {e}")
-            return {"sentiment": "neutral", "score": 0.0, "explanation": "Error"}
-    
     async def collect_all_news(self) -> List[Dict]:
         """Collect news from all sources"""
         all_news = []
@@ -220,11 +150,6 @@ Respond ONLY in JSON format:
                 if content:
                     items = self.parse_rss_feed(content, category)
                     for item in items:
-                        # Classify category
-                        item['category'] = self.classify_category(
-                            item['title'], 
-                            self.clean_html(item['summary'])
-                        )
                         # Clean summary
                         item['summary'] = self.clean_html(item['summary'])
                         all_news.append(item)
@@ -237,6 +162,12 @@ Respond ONLY in JSON format:
                 seen_links.add(item['link'])
                 unique_news.append(item)
         
+        # Category and default (local) sentiment for the whole collection in one scan
+        for item, result in zip(unique_news, classifier.classify_batch(unique_news)):
+            item['category'] = result['category']
+            item['sentiment'] = result['sentiment']
+            item['sentiment_score'] = result['score']
+        
         logging.info(f"Collected {len(unique_news)} unique news items")
         return unique_news
     
@@ -244,25 +175,12 @@ Respond ONLY in JSON format:
         """Collect, analyze and save news to database"""
         news_items = await self.collect_all_news()
         
-        saved_count = 0
-        for item in news_items:
-            # Analyze sentiment (limited to avoid API overload)
-            if saved_count < 10:  # Only for first 10 to save API calls
-                sentiment = await self.analyze_sentiment_openrouter(
-                    item['title'], item['summary']
-                )
-                item['sentiment'] = sentiment.get('sentiment', 'neutral')
-                item['sentiment_score'] = sentiment.get('score', 0.0)
-            else:
-                item['sentiment'] = 'neutral'
-                item['sentiment_score'] = 0.0
-            
-            # Save to database
-            if self.db.save_news_item(item):
-                saved_count += 1
-            
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.5)
+        # Headlines are scored in batches; articles seen on earlier runs come from the cache
+        await score_news(self.db, news_items)
+        
+        # One transaction for the whole collection
+        new_links = await self.db.aio.save_news_items(news_items)
+        saved_count = len(new_links)
         
         logging.info(f"Saved {saved_count} news items to database")
         return saved_count
@@ -310,19 +228,25 @@ Respond ONLY in JSON format:
         return "\n".join(digest_parts)
 
 
+def format_news_search(query: str, items: List[Dict]) -> str:
+    """Format /find results (HTML)"""
+    if not items:
+        return f"🔍 По запросу «{html.escape(query)}» ничего не найдено."
+    
+    parts = [f"🔍 <b>Результаты поиска:</b> {html.escape(query)}\n"]
+    for item in items:
+        published = item.get('published')
+        published_str = published.strftime('%Y-%m-%d') if hasattr(published, 'strftime') else str(published or '')[:10]
+        parts.append(
+            f"\n<b>{html.escape(item['title'])}</b>\n"
+            f"📂 {(item.get('category') or 'other').upper()} | 📅 {published_str}\n"
+            f"🔗 <a href='{html.escape(item['link'], quote=True)}'>Читать</a>"
+        )
+    return "\n".join(parts)
+
+
 # Simple keyword-based sentiment fallback
 def simple_sentiment_analysis(text: str) -> Dict:
     """Simple sentiment analysis without API"""
-    positive_words = ['отлично', 'хорошо', 'успех', 'рост', 'победа', 'breakthrough', 'success', 'growth', 'win']
-    negative_words = ['плохо', 'кризис', 'падение', 'смерть', 'война', 'crisis', 'crash', 'death', 'war', 'fail']
-    
-    text_lower = text.lower()
-    positive_count = sum(1 for word in positive_words if word in text_lower)
-    negative_count = sum(1 for word in negative_words if word in text_lower)
-    
-    if positive_count > negative_count:
-        return {"sentiment": "positive", "score": 0.5}
-    elif negative_count > positive_count:
-        return {"sentiment": "negative", "score": -0.5}
-    else:
-        return {"sentiment": "neutral", "score": 0.0}
+    result = classifier.classify(text)
+    return {"sentiment": result["sentiment"], "score": result["score"]}
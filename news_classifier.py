@@ -0,0 +1,183 @@
+"""
+Local news classification: category and sentiment without API calls.
+
+All category keywords and sentiment lexicon entries are compiled into one
+regex. Shared prefixes are folded into a trie, so the scan cost does not grow
+with the number of keywords. A keyword matches at the start of a word:
+- Stems such as "технолог" or "исследован" also match their inflected forms.
+- Short ASCII keywords ("ai", "war", "kg") must be the whole word, optionally
+  plural, so "said" or "warm" do not count.
+
+Matches are weighted (title hits count TITLE_WEIGHT times) and summed per
+category / polarity. `classify_batch` scans a whole collection in one pass.
+The result is the default sentiment of every article and the fallback when
+the LLM is unavailable or out of quota.
+"""
+
+import re
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple
+
+
+# Category keywords (stems match their inflected forms)
+CATEGORY_KEYWORDS = {
+    "tech": ["технолог", "technology", "software", "hardware", "app", "программ", "ai", "кибер"],
+    "ai": ["искусственный интеллект", "machine learning", "deep learning", "neural", "нейросет", "chatgpt", "llm", "модель"],
+    "science": ["наука", "science", "research", "исследован", "discovery"],
+    "space": ["космос", "space", "spacex", "nasa", "rocket", "ракет", "марс", "mars"],
+    "finance": ["финанс", "finance", "crypto", "bitcoin", "экономик", "market", "биржа"],
+    "kyrgyzstan": ["кыргызстан", "бишкек", "кыргыз", "kg"],
+    "world": ["мир", "world", "политик", "politic", "war", "война"],
+    "sports": ["спорт", "football", "soccer", "nba", "olympic"],
+}
+
+SENTIMENT_LEXICON = {
+    "positive": ["отличн", "хорош", "успех", "успешн", "рост", "побед", "рекорд", "прорыв", "улучшен",
+                 "breakthrough", "success", "growth", "win", "record", "surge", "gain", "improv", "approv"],
+    "negative": ["плох", "кризис", "падени", "смерт", "войн", "погиб", "авари", "взрыв", "атак", "санкци",
+                 "crisis", "crash", "death", "dead", "war", "fail", "attack", "kill", "layoff", "lawsuit",
+                 "decline", "loss"],
+}
+
+# Unambiguous keywords outweigh generic ones (default weight 1)
+KEYWORD_WEIGHTS = {
+    "искусственный интеллект": 3, "machine learning": 3, "deep learning": 3, "chatgpt": 2, "llm": 2,
+    "нейросет": 2, "spacex": 2, "nasa": 2, "bitcoin": 2, "crypto": 2, "кыргызстан": 3, "бишкек": 3,
+    "кыргыз": 2, "смерт": 2, "погиб": 2, "войн": 2, "war": 2, "прорыв": 2, "breakthrough": 2,
+}
+
+TITLE_WEIGHT = 2.0
+# Shorter ASCII keywords must be whole words (optionally plural)
+WHOLE_WORD_MAX_LEN = 3
+
+
+def _normalize(text: str) -> str:
+    return (text or "").lower().replace("ё", "е")
+
+
+def _trie_regex(words: Iterable[str]) -> str:
+    """Alternation of `words` with shared prefixes factored out"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        end = "" in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if end:
+            return f"(?:{body})?" if len(branches) > 1 or len(branches[0]) > 1 else body + "?"
+        return body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Weighted keyword groups compiled into one pattern"""
+
+    def __init__(self, groups: Dict[str, Iterable[str]], weights: Dict[str, float] = None):
+        weights = weights or {}
+        self._targets: Dict[str, List[Tuple[str, float]]] = {}  # keyword -> [(group, weight)]
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                keyword = _normalize(keyword)
+                self._targets.setdefault(keyword, []).append((group, float(weights.get(keyword, 1))))
+        whole = [k for k in self._targets if len(k) <= WHOLE_WORD_MAX_LEN and k.isascii()]
+        stems = [k for k in self._targets if k not in whole]
+        # The regex reports the longest keyword only; it also counts for every stem it starts with
+        own = {keyword: list(targets) for keyword, targets in self._targets.items()}
+        for keyword in self._targets:
+            for stem in stems:
+                if stem != keyword and keyword.startswith(stem):
+                    self._targets[keyword].extend(own[stem])
+        parts = []
+        if stems:
+            parts.append(f"(?P<stem>{_trie_regex(stems)})")
+        if whole:
+            parts.append(f"(?P<word>{_trie_regex(whole)})s?(?!\\w)")
+        self.pattern = re.compile(r"(?<!\w)(?:" + "|".join(parts) + ")") if parts else None
+
+    def finditer(self, text: str):
+        """(position, [(group, weight)]) for each keyword hit in normalized text"""
+        if self.pattern is None:
+            return
+        for match in self.pattern.finditer(text):
+            keyword = match.group("stem") if match.lastgroup == "stem" else match.group("word")
+            yield match.start(), self._targets[keyword]
+
+    def scores(self, text: str) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        for _, targets in self.finditer(_normalize(text)):
+            for group, weight in targets:
+                totals[group] = totals.get(group, 0.0) + weight
+        return totals
+
+
+def sentiment_from_scores(totals: Dict[str, float]) -> Dict:
+    """{"sentiment", "score"} from summed lexicon weights; score in [-1, 1]"""
+    positive = totals.get("positive", 0.0)
+    negative = totals.get("negative", 0.0)
+    score = round((positive - negative) / (positive + negative + 1.0), 2)
+    if score > 0:
+        return {"sentiment": "positive", "score": score}
+    if score < 0:
+        return {"sentiment": "negative", "score": score}
+    return {"sentiment": "neutral", "score": 0.0}
+
+
+class NewsClassifier:
+    """Category + sentiment for articles from one compiled matcher"""
+
+    def __init__(self, categories: Dict[str, List[str]] = CATEGORY_KEYWORDS,
+                 lexicon: Dict[str, List[str]] = SENTIMENT_LEXICON, weights: Dict[str, float] = KEYWORD_WEIGHTS):
+        self.categories = list(categories)
+        groups: Dict[str, List[str]] = {f"category:{name}": words for name, words in categories.items()}
+        groups.update({f"sentiment:{name}": words for name, words in lexicon.items()})
+        self.matcher = KeywordMatcher(groups, weights)
+
+    def classify(self, title: str, summary: str = "") -> Dict:
+        return self.classify_batch([{"title": title, "summary": summary}])[0]
+
+    def classify_batch(self, items: List[Dict]) -> List[Dict]:
+        """[{"category", "sentiment", "score"}] per item (title/summary), in one scan"""
+        chunks: List[str] = []
+        starts: List[int] = []
+        title_ends: List[int] = []
+        offset = 0
+        for item in items:
+            title = _normalize(item.get("title", ""))
+            chunk = f"{title}\n{_normalize(item.get('summary', ''))}\n\n"
+            starts.append(offset)
+            title_ends.append(offset + len(title))
+            chunks.append(chunk)
+            offset += len(chunk)
+
+        totals: List[Dict[str, float]] = [{} for _ in items]
+        for position, targets in self.matcher.finditer("".join(chunks)):
+            index = bisect_right(starts, position) - 1
+            factor = TITLE_WEIGHT if position < title_ends[index] else 1.0
+            for group, weight in targets:
+                totals[index][group] = totals[index].get(group, 0.0) + weight * factor
+
+        results = []
+        for item_totals in totals:
+            # Ties go to the category listed first, as in CATEGORY_KEYWORDS
+            best, best_score = "other", 0.0
+            for name in self.categories:
+                score = item_totals.get(f"category:{name}", 0.0)
+                if score > best_score:
+                    best, best_score = name, score
+            sentiment = sentiment_from_scores({
+                "positive": item_totals.get("sentiment:positive", 0.0),
+                "negative": item_totals.get("sentiment:negative", 0.0),
+            })
+            results.append({"category": best, **sentiment})
+        return results
+
+
+classifier = NewsClassifier()
@@ -2,29 +2,154 @@
 News Scheduler - Background tasks for news aggregation and digest delivery
 """
 
+import os
+import heapq
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import logging
+from typing import Dict, List, Optional, Tuple
 from news_aggregator import NewsAggregator
 
 
+# A slot missed by more than this (e.g. the bot was down) waits for the next day
+DIGEST_CATCHUP_HOURS = float(os.environ.get("DIGEST_CATCHUP_HOURS", "12"))
+
+# Longest single sleep, so wall-clock jumps (NTP, DST) are noticed
+_MAX_SLEEP = 3600.0
+
+
+def parse_schedule_time(value: str) -> Optional[Tuple[int, int]]:
+    """'9:00' / '09:00' -> (9, 0); None if malformed"""
+    try:
+        hours, minutes = (int(part) for part in str(value).strip().split(':'))
+    except (ValueError, TypeError):
+        return None
+    if 0 <= hours < 24 and 0 <= minutes < 60:
+        return hours, minutes
+    return None
+
+
+def _as_local(value) -> Optional[datetime]:
+    """last_sent (CURRENT_TIMESTAMP, UTC) as a naive local datetime"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone().replace(tzinfo=None)
+
+
+def next_fire_time(schedule_time: str, last_sent: Optional[datetime], now: datetime) -> Optional[datetime]:
+    """Next local datetime a daily digest is due: today's slot unless already sent or long missed"""
+    parsed = parse_schedule_time(schedule_time)
+    if parsed is None:
+        return None
+    slot = now.replace(hour=parsed[0], minute=parsed[1], second=0, microsecond=0)
+    if (last_sent is not None and last_sent.date() >= now.date()) or \
+            now - slot > timedelta(hours=DIGEST_CATCHUP_HOURS):
+        slot += timedelta(days=1)
+    return slot
+
+
+class DigestTimer:
+    """
+    Min-heap of next digest fire times.
+
+    Loaded once from the database and kept current through the
+    set_digest_schedule listener; the task sleeps until the earliest slot (or
+    until a schedule changes) instead of polling every minute. Stale heap
+    entries are skipped lazily by comparing against `_due`.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}        # user_id -> current fire timestamp
+        self._times: Dict[int, str] = {}         # user_id -> 'HH:MM' of enabled schedules
+        self._sent_on: Dict[int, datetime] = {}  # user_id -> last local send time
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self._times)
+
+    def schedule(self, user_id: int, schedule_time: str, last_sent: Optional[datetime] = None):
+        if last_sent is not None:
+            self._sent_on[user_id] = last_sent
+        fire_at = next_fire_time(schedule_time, self._sent_on.get(user_id), datetime.now())
+        if fire_at is None:
+            logging.warning(f"Invalid digest time {schedule_time!r} for user {user_id}")
+            self.cancel(user_id)
+            return
+        self._times[user_id] = schedule_time
+        timestamp = fire_at.timestamp()
+        self._due[user_id] = timestamp
+        heapq.heappush(self._heap, (timestamp, user_id))
+        self._changed.set()
+
+    def cancel(self, user_id: int):
+        self._times.pop(user_id, None)
+        if self._due.pop(user_id, None) is not None:
+            self._changed.set()
+
+    def done(self, user_id: int, when: datetime):
+        """Record a delivery attempt and queue the user's next slot (unless disabled meanwhile)"""
+        self._sent_on[user_id] = when
+        if user_id in self._times:
+            self.schedule(user_id, self._times[user_id])
+
+    def pop_due(self, now: float) -> List[int]:
+        """Users whose slot has come; they are removed until rescheduled"""
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            timestamp, user_id = heapq.heappop(self._heap)
+            if self._due.get(user_id) == timestamp:
+                del self._due[user_id]
+                due.append(user_id)
+        return due
+
+    def seconds_until_next(self, now: float) -> Optional[float]:
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return max(0.0, self._heap[0][0] - now) if self._heap else None
+
+    def wake(self):
+        self._changed.set()
+
+    async def wait(self, now: float):
+        """Sleep until the next slot or a schedule change; forever while empty"""
+        delay = self.seconds_until_next(now)
+        self._changed.clear()
+        if delay == 0:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(),
+                                   timeout=None if delay is None else min(delay, _MAX_SLEEP))
+        except asyncio.TimeoutError:
+            pass
+
+
 class NewsScheduler:
-    def __init__(self, bot, db):
+    def __init__(self, bot, db, aggregator: NewsAggregator = None):
         self.bot = bot
         self.db = db
-        self.aggregator = NewsAggregator(db)
+        self.aggregator = aggregator or NewsAggregator(db)
         self.running = False
+        self.timer = DigestTimer()
+        self._loop = None
         
-    async def start(self):
-        """Start background tasks"""
+    async def start(self, collect: bool = True):
+        """Start background tasks (collect=False: digests only, collection runs elsewhere)"""
         self.running = True
         logging.info("News scheduler started")
         
-        # Run two tasks concurrently
-        await asyncio.gather(
-            self.collect_news_task(),
-            self.send_digests_task()
-        )
+        # Digest delivery, plus hourly collection unless the caller runs its own
+        tasks = [self.send_digests_task()]
+        if collect:
+            tasks.append(self.collect_news_task())
+        await asyncio.gather(*tasks)
     
     async def collect_news_task(self):
         """Collect news every hour"""
@@ -40,30 +165,51 @@ class NewsScheduler:
             await asyncio.sleep(3600)
     
     async def send_digests_task(self):
-        """Check and send digests every minute"""
-        while self.running:
-            try:
-                current_time = datetime.now().strftime("%H:%M")
-                users = self.db.get_users_for_digest(current_time)
-                
-                for user_id in users:
-                    await self.send_digest_to_user(user_id)
-                    
-            except Exception as e:
-                logging.error(f"Error sending digests: {e}")
+        """Send each digest when its slot comes up (in-memory timer, no polling)"""
+        self._loop = asyncio.get_running_loop()
+        self.db.add_digest_listener(self._on_schedule_changed)
+        try:
+            for row in await self.db.aio.get_digest_schedules():
+                self.timer.schedule(row['user_id'], row['schedule_time'], _as_local(row['last_sent']))
+            logging.info(f"Digest timer loaded {len(self.timer)} schedules")
             
-            # Check every minute
-            await asyncio.sleep(60)
+            while self.running:
+                try:
+                    for user_id in self.timer.pop_due(datetime.now().timestamp()):
+                        # Failures are not retried until the next slot, as before
+                        await self.send_digest_to_user(user_id)
+                        self.timer.done(user_id, datetime.now())
+                except Exception as e:
+                    logging.error(f"Error sending digests: {e}")
+
+                # wait() clears the wake-up flag, so a stop() during the sends must be seen first
+                if not self.running:
+                    break
+                await self.timer.wait(datetime.now().timestamp())
+        finally:
+            self.db.remove_digest_listener(self._on_schedule_changed)
+    
+    def _on_schedule_changed(self, user_id: int, enabled: bool, schedule_time: str):
+        """set_digest_schedule listener; may run on a database executor thread"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._apply_schedule, user_id, enabled, schedule_time)
+    
+    def _apply_schedule(self, user_id: int, enabled: bool, schedule_time: str):
+        if enabled:
+            self.timer.schedule(user_id, schedule_time)
+        else:
+            self.timer.cancel(user_id)
     
     async def send_digest_to_user(self, user_id: int):
         """Send personalized digest to user"""
         try:
-            interests = self.db.get_user_interests(user_id)
+            interests = await self.db.aio.get_user_interests(user_id)
             
             if not interests:
                 interests = ['tech', 'world', 'kyrgyzstan']  # Default interests
             
-            digest = self.aggregator.generate_digest(interests, limit=10)
+            digest = await self.db.aio.run(self.aggregator.generate_digest, interests, limit=10)
             
             await self.bot.send_message(
                 user_id,
@@ -72,7 +218,7 @@ class NewsScheduler:
                 disable_web_page_preview=True
             )
             
-            self.db.update_last_sent(user_id)
+            await self.db.aio.update_last_sent(user_id)
             logging.info(f"Digest sent to user {user_id}")
             
         except Exception as e:
@@ -81,12 +227,12 @@ class NewsScheduler:
     async def send_digest_now(self, user_id: int) -> str:
         """Send digest immediately (for /digest command)"""
         try:
-            interests = self.db.get_user_interests(user_id)
+            interests = await self.db.aio.get_user_interests(user_id)
             
             if not interests:
                 return "❌ У вас нет выбранных интересов. Используйте /interests для настройки."
             
-            digest = self.aggregator.generate_digest(interests, limit=10)
+            digest = await self.db.aio.run(self.aggregator.generate_digest, interests, limit=10)
             
             await self.bot.send_message(
                 user_id,
@@ -104,14 +250,17 @@ class NewsScheduler:
     def stop(self):
         """Stop scheduler"""
         self.running = False
+        self.timer.wake()
         logging.info("News scheduler stopped")
 
 
-async def run_scheduler_once(db):
+async def run_scheduler_once(db, aggregator: NewsAggregator = None):
     """Run news collection once (for manual trigger)"""
+    if aggregator is not None:
+        # The caller's aggregator may be collecting concurrently; its session stays open
+        return await aggregator.process_and_save_news()
     aggregator = NewsAggregator(db)
     try:
-        count = await aggregator.process_and_save_news()
-        return count
+        return await aggregator.process_and_save_news()
     finally:
         await aggregator.close_session()
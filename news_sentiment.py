@@ -0,0 +1,173 @@
+"""
+Batched news sentiment.
+
+Headlines go to the model NEWS_SENTIMENT_BATCH at a time (20-50 works well),
+and the model answers with a JSON array. Items whose entry is missing or
+malformed are retried in a smaller follow-up batch; nothing else is re-sent.
+Results are stored in news_sentiment, keyed by a hash of the article link, so
+an article is scored once no matter how many runs see it in a feed. Articles
+the model did not score keep the local lexicon result (news_classifier), which
+is also the only engine when NEWS_SENTIMENT_LLM is off.
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from llm import get_client, OpenRouterError, PRIORITY_BACKGROUND
+from news_classifier import classifier
+
+
+NEWS_SENTIMENT_LLM = os.environ.get("NEWS_SENTIMENT_LLM", "true").lower() == "true"
+NEWS_SENTIMENT_MODEL = os.environ.get("NEWS_SENTIMENT_MODEL", "google/gemini-2.5-flash-lite")
+NEWS_SENTIMENT_BATCH = int(os.environ.get("NEWS_SENTIMENT_BATCH", "30"))
+NEWS_SENTIMENT_RETRIES = int(os.environ.get("NEWS_SENTIMENT_RETRIES", "2"))
+# Upper bound of new articles scored per collection run; the rest wait for the next one
+NEWS_SENTIMENT_MAX_PER_RUN = int(os.environ.get("NEWS_SENTIMENT_MAX_PER_RUN", "300"))
+
+SENTIMENTS = ("positive", "negative", "neutral")
+
+# Output tokens per headline ({"id": 12, "sentiment": "negative", "score": -0.6}) plus slack
+TOKENS_PER_ITEM = 24
+
+BATCH_PROMPT = """Classify the sentiment of each news headline below.
+Respond ONLY with a JSON array containing one object per headline, in any order:
+[{{"id": 1, "sentiment": "positive" | "negative" | "neutral", "score": -1.0 to 1.0}}, ...]
+
+Headlines:
+{headlines}"""
+
+_CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.MULTILINE)
+_OBJECT = re.compile(r"\{[^{}]*\}")
+
+
+def link_hash(link: str) -> str:
+    return hashlib.sha256(link.strip().encode("utf-8")).hexdigest()[:32]
+
+
+def batch_prompt(titles: List[str]) -> str:
+    headlines = "\n".join(f"{number}. {' '.join(title.split())[:300]}" for number, title in enumerate(titles, 1))
+    return BATCH_PROMPT.format(headlines=headlines)
+
+
+def _result(entry) -> Optional[Tuple[int, str, float]]:
+    """(id, sentiment, score) from one parsed object, None if unusable"""
+    if not isinstance(entry, dict):
+        return None
+    try:
+        number = int(entry.get("id"))
+        score = max(-1.0, min(1.0, float(entry.get("score", 0.0))))
+    except (TypeError, ValueError):
+        return None
+    sentiment = str(entry.get("sentiment", "")).strip().lower()
+    if sentiment not in SENTIMENTS:
+        return None
+    return number, sentiment, score
+
+
+def parse_batch(content: str, count: int) -> Dict[int, Tuple[str, float]]:
+    """Results by 1-based headline number; a truncated or chatty answer still yields its valid objects"""
+    text = _CODE_FENCE.sub("", content or "").strip()
+    entries: List = []
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            parsed = json.loads(text[start:end + 1])
+            entries = parsed if isinstance(parsed, list) else []
+        except ValueError:
+            entries = []
+    if not entries:
+        # Salvage the complete objects of an invalid or cut-off array
+        for match in _OBJECT.finditer(text):
+            try:
+                entries.append(json.loads(match.group()))
+            except ValueError:
+                continue
+
+    results: Dict[int, Tuple[str, float]] = {}
+    for entry in entries:
+        result = _result(entry)
+        if result is not None and 1 <= result[0] <= count:
+            results.setdefault(result[0], (result[1], result[2]))
+    return results
+
+
+async def analyze_titles(titles: Dict[str, str], client=None, model: str = NEWS_SENTIMENT_MODEL,
+                         batch_size: int = NEWS_SENTIMENT_BATCH,
+                         retries: int = NEWS_SENTIMENT_RETRIES) -> Dict[str, Tuple[str, float]]:
+    """Sentiment for {key: title}; keys the model never answered for are left out"""
+    client = client or get_client()
+    batch_size = max(1, batch_size)
+    results: Dict[str, Tuple[str, float]] = {}
+    pending = list(titles)
+    calls = 0
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        failed: List[str] = []
+        for offset in range(0, len(pending), batch_size):
+            keys = pending[offset:offset + batch_size]
+            calls += 1
+            try:
+                # Background class: never crowds out chat replies
+                async with client.slot(priority=PRIORITY_BACKGROUND):
+                    content = await client.complete(
+                        [{"role": "user", "content": batch_prompt([titles[key] for key in keys])}],
+                        model,
+                        max_tokens=TOKENS_PER_ITEM * len(keys) + 64,
+                        temperature=0.0,
+                        timeout=30,
+                    )
+            except OpenRouterError as e:
+                # Model down or out of quota: keep what we have, the rest is scored next run
+                logging.warning(f"Batch sentiment stopped after {calls} calls: {e}")
+                return results
+            parsed = parse_batch(content, len(keys))
+            for number, key in enumerate(keys, 1):
+                if number in parsed:
+                    results[key] = parsed[number]
+                else:
+                    failed.append(key)
+        if failed:
+            logging.info(f"Batch sentiment: {len(failed)} of {len(pending)} headlines unparsed, "
+                         f"{'retrying' if attempt < retries else 'giving up'}")
+        pending = failed
+
+    logging.info(f"Batch sentiment: {len(results)}/{len(titles)} headlines scored in {calls} calls")
+    return results
+
+
+async def score_news(db, items: List[Dict], client=None,
+                     max_new: int = NEWS_SENTIMENT_MAX_PER_RUN) -> int:
+    """Set item['sentiment'] / item['sentiment_score'] from the cache or a batch call; returns new scores"""
+    # Local lexicon result first: free, and what stays if the model is unavailable
+    unscored = [item for item in items if "sentiment" not in item]
+    for item, result in zip(unscored, classifier.classify_batch(unscored)):
+        item["sentiment"] = result["sentiment"]
+        item["sentiment_score"] = result["score"]
+    if not NEWS_SENTIMENT_LLM:
+        return 0
+
+    by_hash: Dict[str, List[Dict]] = {}
+    for item in items:
+        by_hash.setdefault(link_hash(item["link"]), []).append(item)
+
+    known = await db.aio.get_news_sentiments(list(by_hash))
+    missing = [key for key in by_hash if key not in known][:max(0, max_new)]
+    fresh: Dict[str, Tuple[str, float]] = {}
+    if missing:
+        fresh = await analyze_titles({key: by_hash[key][0]["title"] for key in missing}, client)
+        if fresh:
+            await db.aio.save_news_sentiments([(key, sentiment, score) for key, (sentiment, score) in fresh.items()])
+
+    for key, group in by_hash.items():
+        scored = known.get(key) or fresh.get(key)
+        if scored is None:
+            continue
+        for item in group:
+            item["sentiment"], item["sentiment_score"] = scored
+    return len(fresh)
@@ -0,0 +1,53 @@
+"""
+Shared service container.
+
+`main.py` creates one `Services` per process and hands it to every adapter,
+so Telegram and WhatsApp share a single pooled `Database`, one
+`NewsAggregator` and one keep-alive HTTP client instead of each building
+their own.
+"""
+
+import os
+import logging
+from typing import Optional
+
+import aiohttp
+
+from database import Database
+from news_aggregator import NewsAggregator
+from llm import get_client
+
+
+HTTP_POOL_LIMIT = int(os.environ.get("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.environ.get("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+
+
+class Services:
+    """Process-wide dependencies shared by all adapters"""
+
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database()
+        self._http: Optional[aiohttp.ClientSession] = None
+        self.news_aggregator = NewsAggregator(self.db, session_factory=self.http_session)
+        self.llm = get_client()
+        # Daily per-model usage survives restarts in llm_usage
+        self.llm.usage.attach(self.db)
+        logging.info("✅ Shared services ready (database, news aggregator, HTTP and LLM clients)")
+
+    def http_session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive client session (created lazily inside the event loop)"""
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_LIMIT,
+                                               limit_per_host=HTTP_POOL_LIMIT_PER_HOST),
+                timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            )
+        return self._http
+
+    async def close(self):
+        """Close the HTTP clients, drain buffered writes and close the DB pool"""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        await self.llm.close()
+        self.db.close()
@@ -0,0 +1,147 @@
+"""
+Progressive rendering of streamed LLM answers in Telegram.
+
+`StreamingReply` edits one message as text deltas arrive, at most once per
+TELEGRAM_EDIT_INTERVAL seconds (Telegram throttles edits per chat and answers
+429 with retry_after), and continues in a new message when the text outgrows
+Telegram's 4096-character limit. If the message being edited disappears
+(deleted, too old to edit), the answer continues in a fresh message. Network
+errors are retried; rendering stops only when the chat cannot be reached.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+)
+from aiogram.types import Message
+
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_EDIT_INTERVAL = float(os.environ.get("TELEGRAM_EDIT_INTERVAL", "1.0"))
+
+CURSOR = " ▌"
+
+# Attempts for an edit/send that fails with a network error (backoff 1s, 2s, ...)
+NETWORK_RETRIES = 3
+
+
+def split_point(text: str, limit: int) -> int:
+    """Where to cut text so the first part fits: last paragraph/line/word break, else hard cut"""
+    if len(text) <= limit:
+        return len(text)
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, limit // 2, limit)
+        if cut > 0:
+            return cut + len(separator)
+    return limit
+
+
+class StreamingReply:
+    """Grows a Telegram message (plain text) from an async stream of deltas"""
+
+    def __init__(self, message: Message, header: str = "", interval: float = TELEGRAM_EDIT_INTERVAL):
+        self._message = message  # the message being edited (e.g. a "thinking..." status)
+        self._header = header    # shown on the first message only
+        self._interval = interval
+        self._text = ""
+        self._offset = 0         # start of the current message's part within _text
+        self._shown: Optional[str] = None
+        self._next_edit = 0.0
+        self._closed = False     # chat unreachable: keep collecting text, stop rendering
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    async def consume(self, deltas: AsyncIterator[str]) -> str:
+        """Render the stream as it arrives; returns the full text"""
+        async for delta in deltas:
+            self._text += delta
+            await self._render(final=False)
+        await self._render(final=True)
+        return self._text
+
+    async def fail(self, error_text: str):
+        """Show an error instead of (or after) the partial answer"""
+        self._text = f"{self._text}\n\n{error_text}" if self._text else error_text
+        await self._render(final=True)
+
+    def _current_prefix(self) -> str:
+        return self._header if self._offset == 0 else ""
+
+    async def _render(self, final: bool):
+        # Full pages go out as finished messages; the rest keeps streaming below
+        while True:
+            prefix = self._current_prefix()
+            budget = TELEGRAM_MESSAGE_LIMIT - len(prefix) - len(CURSOR)
+            remaining = self._text[self._offset:]
+            if len(remaining) <= budget:
+                break
+            cut = split_point(remaining, budget)
+            await self._edit(prefix + remaining[:cut].rstrip(), force=True)
+            self._offset += cut
+            await self._send("…")
+
+        if self._closed or (not final and time.monotonic() < self._next_edit):
+            return
+        body = self._current_prefix() + self._text[self._offset:].lstrip("\n")
+        await self._edit(body if final else body + CURSOR, force=final)
+
+    async def _edit(self, text: str, force: bool):
+        if self._closed or not text.strip() or text == self._shown:
+            return
+        attempt = 0
+        while True:
+            try:
+                await self._message.edit_text(text)
+                self._shown = text
+                self._next_edit = time.monotonic() + self._interval
+                return
+            except TelegramRetryAfter as e:
+                if not force:
+                    # Skip this frame; the next delta after the pause redraws everything
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    self._shown = text
+                    return
+                # Deleted or no longer editable: carry on in a new message
+                logging.warning(f"Streaming edit failed, continuing in a new message: {e}")
+                await self._send(text)
+                return
+            except TelegramForbiddenError as e:
+                logging.warning(f"Streaming stopped, chat unreachable: {e}")
+                self._closed = True
+                return
+            except TelegramNetworkError as e:
+                attempt += 1
+                if not force or attempt >= NETWORK_RETRIES:
+                    # A later frame (or the final render) draws the full text again
+                    logging.warning(f"Streaming edit skipped after network error: {e}")
+                    self._next_edit = time.monotonic() + self._interval
+                    return
+                await asyncio.sleep(attempt)
+
+    async def _send(self, text: str):
+        """Continue in a new message below; stop rendering if that is impossible"""
+        for attempt in range(1, NETWORK_RETRIES + 1):
+            try:
+                self._message = await self._message.answer(text)
+                self._shown = text
+                self._next_edit = time.monotonic() + self._interval
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramNetworkError as e:
+                logging.warning(f"Streaming send failed (attempt {attempt}): {e}")
+                await asyncio.sleep(attempt)
+            except (TelegramBadRequest, TelegramForbiddenError) as e:
+                logging.warning(f"Streaming stopped, cannot send to chat: {e}")
+                break
+        self._closed = True
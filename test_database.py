@@ -0,0 +1,84 @@
+"""
+Database behaviour on SQLite (see conftest.py for the temporary database).
+
+Run: python -m pytest -q test_database.py
+"""
+import asyncio
+import threading
+
+
+def test_aio_runs_queries_off_the_event_loop_thread(db):
+    seen = []
+
+    def where():
+        seen.append(threading.current_thread().name)
+        return 42
+
+    async def main():
+        await db.aio.add_or_update_user(1, "alice", "Alice")
+        count = await db.aio.get_user_count()
+        result = await db.aio.run(where)
+        return count, result
+
+    count, result = asyncio.run(main())
+    assert count == 1
+    assert result == 42
+    assert seen and seen[0].startswith("db") and seen[0] != threading.main_thread().name
+
+
+def test_aio_wrappers_are_cached_and_plain_attributes_pass_through(db):
+    assert db.aio.get_user_count is db.aio.get_user_count
+    assert db.aio.use_postgres is False
+
+
+def test_compile_query_translates_placeholders_outside_literals():
+    from database import _compile_query
+
+    compiled = _compile_query("SELECT * FROM news WHERE title LIKE '%?%' AND id > ? AND link = ?")
+    assert compiled.sql == "SELECT * FROM news WHERE title LIKE '%%?%%' AND id > %s AND link = %s"
+    assert compiled.prepare_sql == "SELECT * FROM news WHERE title LIKE '%?%' AND id > $1 AND link = $2"
+    assert compiled.param_count == 2
+    assert compiled.preparable
+
+
+def test_compile_query_escapes_percent_and_is_memoized():
+    from database import _compile_query
+
+    query = "UPDATE stats SET value = value % 7 WHERE name = ?"
+    first = _compile_query(query)
+    assert first.sql == "UPDATE stats SET value = value %% 7 WHERE name = %s"
+    assert _compile_query(query) is first
+    assert not _compile_query("CREATE INDEX idx ON t (a)").preparable
+    assert _compile_query("SELECT 1").name != first.name
+
+
+def test_admin_stats_follow_inserts_and_deletes_via_triggers(db):
+    db.add_or_update_user(1, "alice", "Alice")
+    db.add_or_update_user(2, "bob", "Bob")
+    db.add_or_update_user(1, "alice", "Alice")  # update, not a new row
+    db.add_contact("Мама", "+100", 1)
+    db.add_contact("Папа", "+200", 1)
+    db.add_message(1, "user", "привет")  # still queued: counted from the buffer
+
+    stats = db.get_admin_stats()
+    assert stats["total_users"] == 2
+    assert stats["total_contacts"] == 2
+    assert stats["total_messages"] == 1
+    assert stats["active_today"] == 2
+
+    db.flush_chat_history()
+    contact_id = db.get_contacts(1)[0]["id"]
+    assert db.delete_contact(contact_id, 1)
+    assert db.get_contact_count() == 1
+    assert db.get_admin_stats()["total_messages"] == 1
+
+
+def test_reconcile_stats_repairs_drift(db):
+    db.add_or_update_user(1, "alice", "Alice")
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE stats_counters SET value = 99 WHERE name = 'users'")
+        conn.commit()
+    assert db.get_user_count() == 99
+    assert db.reconcile_stats()["users"] == 1
+    assert db.get_user_count() == 1
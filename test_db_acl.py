@@ -0,0 +1,59 @@
+"""
+Ban/admin checks served from the in-memory ACL cache.
+
+Run: python -m pytest -q test_db_acl.py
+"""
+from db_acl import AclCache
+
+
+def test_cache_loads_once_until_invalidated():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return [{"telegram_id": 5, "reason": "spam", "banned_at": None}], [(7, "moderator")]
+
+    cache = AclCache()
+    cache.ensure_loaded(loader)
+    cache.ensure_loaded(loader)
+    assert len(calls) == 1
+    assert cache.is_banned(5)["reason"] == "spam"
+    assert cache.admin_role(7) == "moderator"
+    assert not cache.is_admin(5)
+
+    cache.invalidate()
+    cache.ensure_loaded(loader)
+    assert len(calls) == 2
+
+
+def test_lookups_return_copies():
+    cache = AclCache()
+    cache.ensure_loaded(lambda: ([], []))
+    cache.set_banned(1, {"telegram_id": 1, "reason": "spam"})
+    cache.is_banned(1)["reason"] = "edited"
+    assert cache.is_banned(1)["reason"] == "spam"
+
+
+def test_database_mutations_update_the_shared_cache(db, monkeypatch):
+    monkeypatch.delenv("ADMIN_ID", raising=False)
+    from database import Database
+
+    assert db.ban_user(42, "spammer", "реклама", banned_by=1)
+    ban = db.is_banned(42)
+    assert ban["reason"] == "реклама"
+    assert isinstance(ban["banned_at"], str)
+    assert db.add_admin(43, "helper", added_by=1, role="moderator")
+
+    # A second instance on the same file shares the cache, so it sees the change without reloading
+    other = Database()
+    try:
+        monkeypatch.setattr(other, "_load_acl", lambda: (_ for _ in ()).throw(AssertionError("reloaded")))
+        assert other.is_banned(42)["reason"] == "реклама"
+        assert other.is_admin(43)
+
+        assert other.unban_user(42)
+        assert other.remove_admin(43)
+        assert db.is_banned(42) is None
+        assert not db.is_admin(43)
+    finally:
+        other.close()
@@ -0,0 +1,130 @@
+"""
+Write-behind chat history buffer (no database needed: rows go to a list).
+
+Run: python -m pytest -q test_db_chat_buffer.py
+"""
+import threading
+
+import pytest
+
+from db_chat_buffer import ChatHistoryBuffer
+
+
+def make_buffer(**kwargs):
+    written = []
+    kwargs.setdefault("interval_ms", 60000)  # flush only when the test asks
+    buffer = ChatHistoryBuffer(lambda rows: written.extend(rows), **kwargs)
+    return buffer, written
+
+
+def test_rows_are_written_in_order_with_one_call_per_batch():
+    buffer, written = make_buffer(max_rows=2)
+    for i in range(5):
+        buffer.append(1, "user", f"m{i}")
+    buffer.flush()
+    assert [row.content for row in written] == ["m0", "m1", "m2", "m3", "m4"]
+    assert buffer.stats()["flushes"] == 3
+    assert buffer.pending_count() == 0
+    buffer.close()
+
+
+def test_background_flusher_commits_a_full_batch():
+    done = threading.Event()
+    written = []
+
+    def write(rows):
+        written.extend(rows)
+        done.set()
+
+    buffer = ChatHistoryBuffer(write, interval_ms=60000, max_rows=3)
+    for i in range(3):
+        buffer.append(1, "user", f"m{i}")
+    assert done.wait(2)
+    assert len(written) == 3
+    buffer.close()
+
+
+def test_load_merges_unflushed_rows_and_then_serves_from_memory():
+    buffer, _ = make_buffer()
+    buffer.append(1, "user", "queued")
+    assert buffer.recent(1, 10) is None
+
+    reads = []
+
+    def read_rows(limit):
+        reads.append(limit)
+        return [{"role": "assistant", "content": "stored", "tokens": 2}]
+
+    history = buffer.load(1, 10, read_rows)
+    assert [m["content"] for m in history] == ["stored", "queued"]
+
+    buffer.append(1, "assistant", "later")
+    assert [m["content"] for m in buffer.recent(1, 2)] == ["queued", "later"]
+    assert len(reads) == 1
+    buffer.close()
+
+
+def test_rejected_row_is_dropped_without_blocking_the_rest():
+    written = []
+    down = [True]
+
+    def write(rows):
+        if down[0] or any(row.content == "poison" for row in rows):
+            raise ValueError("rejected")
+        written.extend(rows)
+
+    buffer = ChatHistoryBuffer(write, interval_ms=60000, max_rows=10)
+    for content in ["m0", "poison", "m1"]:
+        buffer.append(1, "user", content)
+    # Nothing gets in while the database is down: every row stays queued
+    with pytest.raises(ValueError):
+        buffer.flush()
+    assert buffer.pending_count() == 3
+
+    down[0] = False
+    buffer.flush()
+    assert [row.content for row in written] == ["m0", "m1"]
+    stats = buffer.stats()
+    assert (stats["pending"], stats["flushed_rows"], stats["dropped_rows"]) == (0, 2, 1)
+    buffer.close()
+
+
+def test_clear_user_drops_only_that_users_queued_rows():
+    buffer, written = make_buffer()
+    buffer.append(1, "user", "gone")
+    buffer.append(2, "user", "kept")
+    deleted = []
+    buffer.clear_user(1, lambda: deleted.append(buffer.pending_count(1)))
+    assert deleted == [0]
+    assert buffer.recent(1, 5) == []
+
+    buffer.flush()
+    assert [row.user_id for row in written] == [2]
+    buffer.close()
+
+
+def test_read_with_pending_reports_unflushed_rows():
+    buffer, _ = make_buffer()
+    buffer.append(1, "user", "a")
+    buffer.append(1, "user", "b")
+    buffer.append(2, "user", "c")
+    assert buffer.read_with_pending(1, lambda: "result") == ("result", 2)
+    buffer.close()
+
+
+def test_close_drains_the_queue():
+    buffer, written = make_buffer()
+    buffer.append(1, "user", "last words")
+    buffer.close()
+    assert [row.content for row in written] == ["last words"]
+
+
+def test_database_history_includes_unflushed_messages(db):
+    db.add_or_update_user(1, "alice", "Alice")
+    db.add_message(1, "user", "привет")
+    db.add_message(1, "assistant", "здравствуйте")
+    assert [m["content"] for m in db.get_chat_history(1)] == ["привет", "здравствуйте"]
+
+    db.flush_chat_history()
+    db.clear_chat_history(1)
+    assert db.get_chat_history(1) == []
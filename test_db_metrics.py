@@ -0,0 +1,49 @@
+"""
+Query instrumentation: per-method aggregates and the slow-query log.
+
+Run: python -m pytest -q test_db_metrics.py
+"""
+import logging
+import sqlite3
+
+from db_metrics import InstrumentedConnection, QueryMetrics, UNATTRIBUTED, param_shape
+
+
+def test_param_shape_never_includes_values():
+    assert param_shape((7, "секрет", None)) == "(int, str[6], NoneType)"
+    assert param_shape({"phone": "+996555"}) == "{phone: str[7]}"
+    assert param_shape(list(range(20))) == "[20 params: int×20]"
+
+
+def test_slow_statements_are_logged_with_parameter_shapes(caplog):
+    metrics = QueryMetrics(slow_ms=0)
+    conn = InstrumentedConnection(sqlite3.connect(":memory:"), metrics)
+    cursor = conn.cursor()
+    cursor.execute("CREATE TABLE t (name TEXT)")
+    with caplog.at_level(logging.WARNING):
+        cursor.executemany("INSERT INTO t VALUES (?)", [("секрет",), ("пароль",)])
+    cursor.execute("SELECT name FROM t")
+    assert len(cursor.fetchall()) == 2
+
+    assert "Slow query" in caplog.text
+    assert "params=(str[6])" in caplog.text
+    assert "секрет" not in caplog.text
+    stats = metrics.snapshot()[UNATTRIBUTED]
+    assert stats["statements"] == 3
+    assert stats["rows"] == 4  # two inserted, two fetched
+    assert stats["slow_statements"] == 3
+
+
+def test_statements_are_attributed_to_the_outer_database_method(db):
+    db.reset_query_stats()
+    db.add_or_update_user(1, "alice", "Alice")
+    db.add_or_update_user(2, "bob", "Bob")
+    db.get_admin_stats()  # calls _read_counters internally
+
+    stats = db.query_stats()
+    assert stats["add_or_update_user"]["calls"] == 2
+    assert stats["add_or_update_user"]["statements"] >= 2
+    assert stats["get_admin_stats"]["calls"] == 1
+    assert stats["get_admin_stats"]["statements"] == 2
+    assert "_read_counters" not in stats
+    assert sum(stats["get_admin_stats"]["histogram"].values()) == 1
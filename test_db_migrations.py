@@ -0,0 +1,57 @@
+"""
+Schema migrations on SQLite (see conftest.py for the temporary database).
+
+Run: python -m pytest -q test_db_migrations.py
+"""
+import db_migrations
+from db_migrations import LATEST_VERSION, current_version, migrate
+
+
+def sqlite_names(db, kind):
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))
+        return {row[0] for row in cursor.fetchall()}
+
+
+def test_fresh_database_is_migrated_to_latest_version(db):
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        assert current_version(db, cursor) == LATEST_VERSION
+        cursor.execute("SELECT COUNT(*) FROM schema_version")
+        assert cursor.fetchone()[0] == len(db_migrations.MIGRATIONS)
+
+    indexes = sqlite_names(db, "index")
+    assert {"idx_chat_history_user_ts", "idx_news_category_published",
+            "idx_contacts_name_id", "idx_contacts_added_by_name_id"} <= indexes
+    # Superseded by the (name, id) keyset indexes in migration 4
+    assert "idx_contacts_name" not in indexes
+    assert {"stats_counters", "chat_summaries", "llm_usage", "news_sentiment"} <= sqlite_names(db, "table")
+
+
+def test_rerun_applies_nothing_twice(db):
+    db_migrations._current_targets.discard(db.target)
+    assert db_migrations._migrate(db) == LATEST_VERSION
+    assert migrate(db) == LATEST_VERSION
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM schema_version ORDER BY version")
+        assert [row[0] for row in cursor.fetchall()] == [m.version for m in db_migrations.MIGRATIONS]
+
+
+def test_pending_migrations_backfill_token_counts(db):
+    db.add_or_update_user(1, "alice", "Alice")
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO chat_history (user_id, role, content) VALUES (1, 'user', 'привет, как дела?')")
+        # Pretend the token_count backfill never ran
+        cursor.execute("UPDATE chat_history SET token_count = NULL")
+        cursor.execute("DELETE FROM schema_version WHERE version >= 6")
+        cursor.execute("ALTER TABLE chat_history DROP COLUMN token_count")
+
+    db_migrations._current_targets.discard(db.target)
+    assert migrate(db) == LATEST_VERSION
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT token_count FROM chat_history")
+        assert cursor.fetchone()[0] > 0
@@ -0,0 +1,45 @@
+"""
+Stored news on SQLite (see conftest.py for the temporary database).
+
+Run: python -m pytest -q test_db_news.py
+"""
+from datetime import datetime, timedelta
+
+
+def article(link, category="tech", days_ago=0, title=None):
+    published = datetime.utcnow() - timedelta(days=days_ago)
+    return {
+        "title": title or f"Новость {link}",
+        "link": link,
+        "summary": "краткое описание",
+        "category": category,
+        "source_name": "test",
+        "published": published.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def test_save_news_items_returns_only_new_links(db):
+    assert db.save_news_items([article("a"), article("b"), article("a")]) == ["a", "b"]
+    assert db.save_news_items([article("b"), article("c")]) == ["c"]
+    assert db.save_news_items([]) == []
+    assert db.save_news_item(article("c")) is False
+    assert len(db.get_latest_news(limit=10)) == 3
+
+
+def test_news_queries_keep_the_three_day_window(db):
+    db.save_news_items([
+        article("tech-new", "tech"),
+        article("tech-old", "tech", days_ago=5),
+        article("ai-new", "ai", days_ago=1),
+        article("world-new", "world"),
+    ])
+    assert {n["link"] for n in db.get_latest_news()} == {"tech-new", "ai-new", "world-new"}
+    assert [n["link"] for n in db.get_news_by_categories(["tech"])] == ["tech-new"]
+
+
+def test_news_by_categories_merges_per_category_newest_first(db):
+    db.save_news_items([article(f"tech-{i}", "tech", days_ago=i * 0.1) for i in range(5)] +
+                       [article(f"ai-{i}", "ai", days_ago=0.05 + i * 0.1) for i in range(5)])
+    news = db.get_news_by_categories(["tech", "ai", "tech"], limit=4)
+    assert [n["link"] for n in news] == ["tech-0", "ai-0", "tech-1", "ai-1"]
+    assert db.get_news_by_categories([]) == []
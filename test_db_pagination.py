@@ -0,0 +1,69 @@
+"""
+Keyset pagination of contacts and users on SQLite (see conftest.py).
+
+Run: python -m pytest -q test_db_pagination.py
+"""
+import asyncio
+
+
+def add_contacts(db, names, added_by=1):
+    for i, name in enumerate(names):
+        db.add_contact(name, f"+{i}", added_by)
+
+
+def names(page):
+    return [c["name"] for c in page["contacts"]]
+
+
+def test_pages_walk_forward_and_back_in_name_order(db):
+    # Duplicate names are ordered by id, so no row is skipped or repeated
+    add_contacts(db, ["Вера", "Анна", "Борис", "Анна", "Глеб"])
+
+    first = db.get_contacts_page(limit=2)
+    assert names(first) == ["Анна", "Анна"]
+    assert (first["has_prev"], first["has_next"]) == (False, True)
+
+    second = db.get_contacts_page(after_id=first["contacts"][-1]["id"], limit=2)
+    assert names(second) == ["Борис", "Вера"]
+    third = db.get_contacts_page(after_id=second["contacts"][-1]["id"], limit=2)
+    assert names(third) == ["Глеб"]
+    assert (third["has_prev"], third["has_next"]) == (True, False)
+
+    back = db.get_contacts_page(before_id=third["contacts"][0]["id"], limit=2)
+    assert back["contacts"] == second["contacts"]
+    assert back["has_prev"]
+
+
+def test_deleted_cursor_contact_falls_back_to_first_page(db):
+    add_contacts(db, ["Анна", "Борис", "Вера"])
+    cursor_id = db.get_contacts_page(limit=2)["contacts"][-1]["id"]
+    assert db.delete_contact(cursor_id, 1)
+
+    page = db.get_contacts_page(after_id=cursor_id, limit=2)
+    assert names(page) == ["Анна", "Вера"]
+    assert not page["has_prev"]
+
+
+def test_page_is_scoped_to_owner(db):
+    add_contacts(db, ["Анна", "Вера"], added_by=1)
+    add_contacts(db, ["Борис"], added_by=2)
+    assert names(db.get_contacts_page(added_by=2)) == ["Борис"]
+
+
+def test_iterators_cover_every_row_across_page_boundaries(db):
+    add_contacts(db, [f"Контакт {i:02d}" for i in range(7)] + ["Контакт 03"])
+    for telegram_id in range(1, 6):
+        db.add_or_update_user(telegram_id, f"user{telegram_id}", "Имя")
+
+    contacts = list(db.iter_contacts(batch_size=3))
+    assert len(contacts) == 8
+    assert len({c["id"] for c in contacts}) == 8
+    assert [u["telegram_id"] for u in db.iter_users(batch_size=2)] == [1, 2, 3, 4, 5]
+
+    async def collect():
+        return ([c["id"] async for c in db.aio.iter_contacts(batch_size=3)],
+                [u["telegram_id"] async for u in db.aio.iter_users(batch_size=2)])
+
+    contact_ids, user_ids = asyncio.run(collect())
+    assert contact_ids == [c["id"] for c in contacts]
+    assert user_ids == [1, 2, 3, 4, 5]
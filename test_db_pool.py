@@ -0,0 +1,123 @@
+"""
+Connection pool behaviour (no database server needed: psycopg2 connections are faked).
+
+Run: python -m pytest -q test_db_pool.py
+"""
+import threading
+
+import pytest
+
+from db_pool import PostgresConnectionPool, SQLiteConnectionManager, PoolTimeout
+
+
+class FakeConnection:
+    """The parts of a psycopg2 connection the pool touches"""
+
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def get_transaction_status(self):
+        return 2 if self.in_transaction else 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    def connect():
+        conn = FakeConnection(len(opened))
+        opened.append(conn)
+        return conn
+
+    kwargs.setdefault("min_size", 0)
+    kwargs.setdefault("health_check_after", 3600)
+    return PostgresConnectionPool(connect, **kwargs), opened
+
+
+def test_released_connection_is_reused():
+    pool, opened = make_pool(max_size=2)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert len(opened) == 1
+
+
+def test_checkout_waits_then_times_out_at_max_size():
+    pool, opened = make_pool(max_size=2, timeout=0.05)
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert len(opened) == 2
+    assert pool.stats()["in_use"] == 2
+
+    # A release hands the connection to a waiting thread
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    pool.timeout = 5
+    waiter.start()
+    pool.release(held[0])
+    waiter.join(2)
+    assert got == [held[0]]
+
+
+def test_expired_connection_is_recycled_on_release():
+    pool, opened = make_pool(max_size=1, max_lifetime=0)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert conn.closed
+    assert pool.stats()["recycled"] == 1
+    assert pool.acquire() is not conn
+    assert len(opened) == 2
+
+
+def test_open_transaction_is_rolled_back_before_reuse():
+    pool, _ = make_pool(max_size=1)
+    conn = pool.acquire()
+    conn.in_transaction = True
+    pool.release(conn)
+    assert conn.rollbacks == 1
+    assert not conn.closed
+
+
+def test_connection_error_discards_connection():
+    psycopg2 = pytest.importorskip("psycopg2")
+    pool, opened = make_pool(max_size=1)
+    with pytest.raises(psycopg2.OperationalError):
+        with pool.connection():
+            raise psycopg2.OperationalError("server closed the connection")
+    assert opened[0].closed
+    assert pool.stats()["size"] == 0
+    with pool.connection() as conn:
+        assert conn is opened[1]
+
+
+def test_closed_pool_refuses_checkouts():
+    pool, opened = make_pool(max_size=1)
+    pool.release(pool.acquire())
+    pool.close()
+    assert opened[0].closed
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_sqlite_manager_keeps_one_connection_per_thread(tmp_path):
+    manager = SQLiteConnectionManager(str(tmp_path / "pool.db"))
+    main = manager.acquire()
+    assert manager.acquire() is main
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(manager.acquire()))
+    thread.start()
+    thread.join()
+    assert other[0] is not main
+    assert manager.stats()["size"] == 2
+    manager.close()
@@ -0,0 +1,56 @@
+"""
+Full-text search over contacts and news (see conftest.py for the temporary database).
+
+Run: python -m pytest -q test_db_search.py
+"""
+from datetime import datetime
+
+from db_search import fts5_prefix_query, phone_digits, search_terms, tsquery_prefix_query
+
+
+def test_user_input_cannot_inject_query_operators():
+    terms = search_terms('Али* OR "996" NEAR(-x)')
+    assert terms == ["али", "or", "996", "near", "x"]
+    assert fts5_prefix_query(["али", "996"]) == '"али"* "996"*'
+    assert tsquery_prefix_query(["али", "996"]) == "али:* & 996:*"
+    assert search_terms("  *** ") == []
+
+
+def test_contacts_match_word_prefixes_and_follow_deletes(db):
+    db.add_contact("Алишер Усманов", "+996555123456", 1)
+    db.add_contact("Алина", "+996700000000", 2)
+    db.add_contact("Борис", "+7900", 1)
+
+    assert {c["name"] for c in db.search_contacts("али")} == {"Алишер Усманов", "Алина"}
+    assert [c["name"] for c in db.search_contacts("али усм")] == ["Алишер Усманов"]
+    assert [c["name"] for c in db.search_contacts("али", added_by=2)] == ["Алина"]
+    assert db.search_contacts("***") == []
+
+    alina = db.search_contacts("алина")[0]
+    assert db.delete_contact(alina["id"], 2)
+    assert db.search_contacts("алина") == []
+
+
+def test_digit_queries_match_anywhere_in_the_phone(db):
+    assert (phone_digits("555"), phone_digits("+996 (555) 12-34"), phone_digits("али 555")) == ("555", "9965551234", "")
+    db.add_contact("Алишер Усманов", "+996555123456", 1)
+    db.add_contact("Борис", "+7 900 555-11-22", 2)
+    db.add_contact("Алина", "+996700000000", 2)
+
+    assert {c["name"] for c in db.search_contacts("555")} == {"Алишер Усманов", "Борис"}
+    assert [c["name"] for c in db.search_contacts("555 1234")] == ["Алишер Усманов"]
+    assert [c["name"] for c in db.search_contacts("555", added_by=2)] == ["Борис"]
+    assert [c["name"] for c in db.search_contacts("+996")] == ["Алина", "Алишер Усманов"]
+
+
+def test_news_search_finds_title_and_summary_words(db):
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    db.save_news_items([
+        {"title": "Запуск ракеты", "link": "a", "summary": "Космодром Байконур",
+         "category": "space", "published": now},
+        {"title": "Курс сома", "link": "b", "summary": "Нацбанк Кыргызстана",
+         "category": "finance", "published": now},
+    ])
+    assert [n["link"] for n in db.search_news("байкон")] == ["a"]
+    assert [n["link"] for n in db.search_news("курс нацбанк")] == ["b"]
+    assert db.search_news("погода") == []
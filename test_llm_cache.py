@@ -0,0 +1,111 @@
+"""
+LLM response cache: keys, TTL/LRU and SQLite persistence.
+
+Run: python -m pytest -q test_llm_cache.py
+"""
+import asyncio
+
+from llm import OpenRouterClient
+from llm.cache import ResponseCache, cache_key, normalize_prompt
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def ask(text, history=(), system="Ты помощник"):
+    return [{"role": "system", "content": system}, *history, {"role": "user", "content": text}]
+
+
+def test_equivalent_prompts_share_a_key():
+    assert normalize_prompt("  Что   такое Ёж?! ") == "что такое еж"
+    assert cache_key(ask("Что такое ёж?"), ["m"]) == cache_key(ask("что такое ЕЖ"), ["m"])
+
+
+def test_context_changes_the_key():
+    base = cache_key(ask("а дальше?"), ["m"])
+    assert cache_key(ask("а дальше?"), ["other"]) != base
+    assert cache_key(ask("а дальше?", system="Ты пират"), ["m"]) != base
+    assert cache_key(ask("а дальше?", history=[{"role": "user", "content": "про котов"}]), ["m"]) != base
+    assert cache_key([{"role": "assistant", "content": "привет"}], ["m"]) is None
+
+
+def test_earlier_history_keeps_users_apart():
+    recent = [{"role": "user", "content": f"реплика {i}"} for i in range(6)]
+    alice = [{"role": "user", "content": "Меня зовут Алиса"}, *recent]
+    bob = [{"role": "user", "content": "Меня зовут Боб"}, *recent]
+    assert cache_key(ask("Как меня зовут?", alice), ["m"]) != cache_key(ask("Как меня зовут?", bob), ["m"])
+    assert cache_key(ask("Как меня зовут?", alice), ["m"]) == cache_key(ask("как меня зовут", alice), ["m"])
+
+
+def test_entries_expire_and_least_recently_used_are_evicted():
+    clock = Clock()
+    cache = ResponseCache(max_entries=2, ttl=60, path="", clock=clock)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    clock.now += 61
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["evictions"], stats["expired"]) == (1, 1, 1)
+
+
+def test_persistent_cache_restores_unexpired_entries(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(ttl=60, path=path, clock=clock)
+    cache.put("old", "старый")
+    clock.now += 30
+    cache.put("new", "новый")
+    cache.close()
+
+    clock.now += 45  # "old" has expired, "new" has not
+    restored = ResponseCache(ttl=60, path=path, clock=clock)
+    assert restored.get("new") == "новый"
+    assert restored.get("old") is None
+    assert restored.stats()["persistent"]
+    restored.close()
+
+
+def test_repeated_question_is_answered_without_a_request(openrouter):
+    async def main():
+        client = OpenRouterClient("test-key", cache=ResponseCache(path=""))
+        try:
+            first = await client.chat(ask("Сколько времени?"), ["m"])
+            second = await client.chat(ask("сколько времени"), ["m"])
+            streamed = [d async for d in client.chat_stream(ask("Сколько времени"), ["m"])]
+        finally:
+            await client.close()
+        return first, second, streamed
+
+    first, second, streamed = asyncio.run(main())
+    assert first == second == "ответ m"
+    assert streamed == ["ответ m"]
+    assert openrouter.requests == ["m"]
+
+
+def test_failed_and_abandoned_answers_are_not_cached(openrouter):
+    openrouter.modes["broken"] = "error"
+
+    async def main():
+        cache = ResponseCache(path="")
+        client = OpenRouterClient("test-key", cache=cache)
+        try:
+            try:
+                await client.chat(ask("?"), ["broken"])
+            except Exception:
+                pass
+            stream = client.chat_stream(ask("расскажи"), ["m"])
+            await stream.__anext__()
+            await stream.aclose()
+        finally:
+            await client.close()
+        return cache.stats()["stores"]
+
+    assert asyncio.run(main()) == 0
@@ -0,0 +1,72 @@
+"""
+Token-budgeted chat context.
+
+Run: python -m pytest -q test_llm_context.py
+"""
+from llm.context import (MESSAGE_OVERHEAD, SUMMARY_PREFIX, build_context, estimate_tokens,
+                         truncate_to_tokens)
+
+
+def row(role, content):
+    return {"role": role, "content": content, "tokens": estimate_tokens(content)}
+
+
+def test_estimate_counts_cyrillic_as_denser_than_ascii():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 10) == 10
+    assert estimate_tokens("привет") == 3
+
+
+def test_truncation_cuts_at_a_word_boundary():
+    text = "один два три четыре пять шесть семь"
+    cut = truncate_to_tokens(text, 6)
+    assert cut.endswith(" …")
+    assert text.startswith(cut[:-2])
+    assert cut[:-2].split()[-1] in text.split()
+    assert truncate_to_tokens("коротко", 100) == "коротко"
+
+
+def test_newest_messages_fill_the_budget():
+    rows = [row("user", "старое " * 50), row("assistant", "ответ " * 5), row("user", "вопрос")]
+    budget = rows[1]["tokens"] + rows[2]["tokens"] + 2 * MESSAGE_OVERHEAD
+    context = build_context(rows, token_budget=budget)
+    assert [m["content"] for m in context] == [rows[1]["content"], "вопрос"]
+    assert set(context[0]) == {"role", "content"}
+
+
+def test_newest_message_is_kept_even_over_budget():
+    huge = "слово " * 1000
+    assert build_context([row("user", "раньше"), row("user", huge)], token_budget=10) == [
+        {"role": "user", "content": huge}]
+
+
+def test_first_turn_that_does_not_fit_is_truncated():
+    rows = [row("user", "очень " * 200), row("user", "вопрос")]
+    context = build_context(rows, token_budget=120)
+    assert len(context) == 2
+    assert context[0]["content"].endswith(" …")
+    assert estimate_tokens(context[0]["content"]) < rows[0]["tokens"]
+
+
+def test_summary_goes_first_and_is_paid_for():
+    rows = [row("user", "a " * 40), row("user", "вопрос")]
+    summary = "пользователь спрашивал про погоду"
+    context = build_context(rows, token_budget=30, summary=summary)
+    assert context[0] == {"role": "system", "content": SUMMARY_PREFIX + summary}
+    assert [m["content"] for m in context[1:]] == ["вопрос"]
+
+
+def test_database_context_uses_stored_token_counts(db):
+    db.add_or_update_user(1, "alice", "Alice")
+    for i in range(30):
+        db.add_message(1, "user", f"сообщение номер {i} " + "текст " * 20)
+    db.flush_chat_history()
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM chat_history WHERE token_count IS NULL")
+        assert cursor.fetchone()[0] == 0
+
+    context = db.get_chat_context(1, token_budget=200)
+    assert 1 < len(context) < 30
+    assert context[-1]["content"].startswith("сообщение номер 29 ")
+    assert sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD for m in context) <= 200
@@ -0,0 +1,158 @@
+"""
+Model health: circuit breaker, half-open trials and ranking.
+
+Run: python -m pytest -q test_llm_health.py
+"""
+import asyncio
+
+from llm import OpenRouterClient
+from llm.health import (BAD_REQUEST, ERROR, LLM_CIRCUIT_COOLDOWN, LLM_CIRCUIT_FAILURES,
+                        LLM_RATE_LIMIT_COOLDOWN, RATE_LIMITED, ModelHealth, format_model_health)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def open_circuit(health, name):
+    for _ in range(LLM_CIRCUIT_FAILURES):
+        health.record_failure(name, ERROR, "boom")
+
+
+def test_consecutive_errors_open_the_circuit_with_doubling_cooldown():
+    clock = Clock()
+    health = ModelHealth(clock=clock)
+    for _ in range(LLM_CIRCUIT_FAILURES - 1):
+        health.record_failure("m", ERROR)
+    assert health.is_available("m")
+    health.record_failure("m", ERROR)
+    assert not health.is_available("m")
+    assert health.snapshot()["m"]["retry_in_s"] == LLM_CIRCUIT_COOLDOWN
+
+    # A failed half-open trial re-opens at once with twice the cooldown
+    clock.now += LLM_CIRCUIT_COOLDOWN
+    assert health.admit("m") is True
+    health.record_failure("m", ERROR)
+    assert health.snapshot()["m"]["retry_in_s"] == 2 * LLM_CIRCUIT_COOLDOWN
+
+
+def test_rate_limit_and_bad_request_bench_immediately():
+    clock = Clock()
+    health = ModelHealth(clock=clock)
+    health.record_failure("limited", RATE_LIMITED)
+    health.record_failure("bad", BAD_REQUEST)
+    assert not health.is_available("limited")
+    assert not health.is_available("bad")
+    assert health.snapshot()["limited"]["retry_in_s"] == LLM_RATE_LIMIT_COOLDOWN
+
+
+def test_half_open_admits_a_single_trial():
+    clock = Clock()
+    health = ModelHealth(clock=clock)
+    open_circuit(health, "m")
+    assert not health.is_available("m")
+
+    clock.now += LLM_CIRCUIT_COOLDOWN
+    assert health.snapshot()["m"]["circuit"] == "half_open"
+    assert health.admit("m") is True
+    assert health.admit("m") is None
+    assert health.rank(["m", "other"]) == ["other"]
+    assert health.benched(["m", "other"]) == ["m"]
+    assert "проверка" in format_model_health(health.snapshot())
+
+    health.record_success("m", 0.5)
+    assert health.admit("m") is False
+    assert health.snapshot()["m"]["circuit"] == "closed"
+
+
+def test_released_trial_lets_the_next_caller_probe():
+    clock = Clock()
+    health = ModelHealth(clock=clock)
+    open_circuit(health, "m")
+    clock.now += LLM_CIRCUIT_COOLDOWN
+    assert health.admit("m") is True
+    health.release("m")
+    assert health.admit("m") is True
+
+
+def test_rank_prefers_working_then_faster_models():
+    health = ModelHealth()
+    for _ in range(5):
+        health.record_success("slow", 9.0)
+        health.record_success("fast", 1.0)
+    health.record_failure("flaky", ERROR)
+    health.record_success("flaky", 0.1)
+    open_circuit(health, "down")
+    assert health.rank(["down", "flaky", "slow", "fast", "new"]) == ["fast", "slow", "flaky", "new"]
+
+
+def test_benched_models_are_ordered_by_recovery():
+    clock = Clock()
+    health = ModelHealth(clock=clock)
+    open_circuit(health, "late")
+    open_circuit(health, "late")  # failed again while open: cooldown doubled
+    clock.now += 1
+    open_circuit(health, "soon")
+    assert health.rank(["late", "soon"]) == []
+    assert health.benched(["late", "soon"]) == ["soon", "late"]
+
+
+def test_client_sends_nothing_to_an_open_circuit_while_another_model_works(openrouter):
+    async def main():
+        client = OpenRouterClient("test-key")
+        client.cache = None
+        open_circuit(client.health, "down")
+        try:
+            answer = await client.chat([{"role": "user", "content": "?"}], ["down", "ok"])
+        finally:
+            await client.close()
+        return answer
+
+    assert asyncio.run(main()) == "ответ ok"
+    assert openrouter.requests == ["ok"]
+
+
+def test_client_tries_the_soonest_benched_model_once_when_all_are_down(openrouter):
+    async def main():
+        client = OpenRouterClient("test-key")
+        client.cache = None
+        open_circuit(client.health, "late")
+        client.health._models["late"].open_until += 60
+        open_circuit(client.health, "soon")
+        try:
+            answer = await client.chat([{"role": "user", "content": "?"}], ["late", "soon"])
+        finally:
+            await client.close()
+        return answer
+
+    assert asyncio.run(main()) == "ответ soon"
+    assert openrouter.requests == ["soon"]
+
+
+def test_client_sends_one_probe_to_a_recovering_model(openrouter):
+    openrouter.modes["recovering"] = "slow"
+    openrouter.delay = 0.3
+
+    async def main():
+        client = OpenRouterClient("test-key")
+        client.cache = None
+        open_circuit(client.health, "recovering")
+        client.health._models["recovering"].open_until = 0.0  # cooldown over: half-open
+        openrouter.modes["backup"] = "html"  # keeps the recovering model in the chain
+        try:
+            answers = await asyncio.gather(*(
+                client.chat([{"role": "user", "content": f"вопрос {i}"}], ["recovering", "backup"])
+                for i in range(4)
+            ), return_exceptions=True)
+        finally:
+            await client.close()
+        return answers, client.health.snapshot()["recovering"]["circuit"]
+
+    answers, circuit = asyncio.run(main())
+    assert openrouter.requests.count("recovering") == 1
+    assert answers.count("ответ recovering") == 1
+    assert circuit == "closed"
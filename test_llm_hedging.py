@@ -0,0 +1,72 @@
+"""
+Hedged chat requests: the first answer wins and the losers are cancelled.
+
+Run: python -m pytest -q test_llm_hedging.py
+"""
+import asyncio
+import time
+
+from llm import OpenRouterClient
+
+
+def make_client():
+    client = OpenRouterClient("test-key", hedge=True)
+    client.cache = None
+    return client
+
+
+def test_slow_model_is_hedged_and_the_loser_cancelled(openrouter, monkeypatch):
+    monkeypatch.setattr("llm.openrouter.OPENROUTER_HEDGE_DELAY", "0.2")
+    openrouter.modes["slow"] = "slow"
+    openrouter.delay = 1.5
+
+    async def main():
+        client = make_client()
+        started = time.monotonic()
+        try:
+            answer = await client.chat([{"role": "user", "content": "?"}], ["slow", "fast"])
+        finally:
+            await client.close()
+        return answer, time.monotonic() - started, client
+
+    answer, elapsed, client = asyncio.run(main())
+    assert answer == "ответ fast"
+    assert elapsed < 1
+    assert openrouter.requests == ["slow", "fast"]
+    # The cancelled request used quota but says nothing about the model's health
+    assert client.usage.snapshot()["models"]["slow"]["requests"] == 1
+    assert client.health.snapshot().get("slow", {}).get("failures", {}) == {}
+
+
+def test_errors_fall_through_without_waiting_for_the_hedge_delay(openrouter, monkeypatch):
+    monkeypatch.setattr("llm.openrouter.OPENROUTER_HEDGE_DELAY", "30")
+    openrouter.modes["broken"] = "error"
+
+    async def main():
+        client = make_client()
+        try:
+            return await asyncio.wait_for(
+                client.chat([{"role": "user", "content": "?"}], ["broken", "ok"]), 5)
+        finally:
+            await client.close()
+
+    assert asyncio.run(main()) == "ответ ok"
+    assert openrouter.requests == ["broken", "ok"]
+
+
+def test_parallel_requests_are_capped(openrouter, monkeypatch):
+    monkeypatch.setattr("llm.openrouter.OPENROUTER_HEDGE_DELAY", "0.1")
+    monkeypatch.setattr("llm.openrouter.OPENROUTER_HEDGE_MAX_PARALLEL", 2)
+    openrouter.delay = 0.6
+    openrouter.modes.update({"a": "slow", "b": "slow", "c": "ok"})
+
+    async def main():
+        client = make_client()
+        try:
+            return await client.chat([{"role": "user", "content": "?"}], ["a", "b", "c"])
+        finally:
+            await client.close()
+
+    # "c" is only asked once one of the two in-flight requests has finished
+    assert asyncio.run(main()) == "ответ a"
+    assert openrouter.requests == ["a", "b"]
@@ -0,0 +1,74 @@
+"""
+One LLM generation in flight per chat: cancel and merge modes.
+
+Run: python -m pytest -q test_llm_inflight.py
+"""
+import asyncio
+
+import pytest
+
+from llm.inflight import InflightRequests
+
+
+def generation(log, name, delay=0.05):
+    async def generate():
+        log.append(f"start {name}")
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            log.append(f"cancelled {name}")
+            raise
+        return name
+    return generate
+
+
+def test_cancel_mode_replaces_the_stale_generation():
+    log = []
+
+    async def main():
+        inflight = InflightRequests("cancel")
+        first = asyncio.create_task(inflight.run(1, generation(log, "a")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(inflight.run(1, generation(log, "b")))
+        other_chat = asyncio.create_task(inflight.run(2, generation(log, "c")))
+        results = await asyncio.gather(first, second, other_chat)
+        return results, inflight
+
+    results, inflight = asyncio.run(main())
+    assert results == [None, "b", "c"]
+    assert "cancelled a" in log
+    assert inflight.stats == {"started": 3, "cancelled": 1, "merged": 0}
+    assert not inflight.busy(1)
+
+
+def test_merge_mode_collapses_waiting_messages_into_one_follow_up():
+    log = []
+
+    async def main():
+        inflight = InflightRequests("merge")
+        first = asyncio.create_task(inflight.run(1, generation(log, "a")))
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(inflight.run(1, generation(log, name))) for name in "bcd"]
+        return await asyncio.gather(first, *waiting), inflight
+
+    results, inflight = asyncio.run(main())
+    assert results == ["a", None, None, "d"]
+    assert log == ["start a", "start d"]
+    assert inflight.stats["merged"] == 2
+
+
+def test_caller_cancellation_is_not_swallowed():
+    async def main():
+        inflight = InflightRequests("cancel")
+        task = asyncio.create_task(inflight.run(1, generation([], "a", delay=5)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return inflight.busy(1)
+
+    assert asyncio.run(main()) is False
+
+
+def test_unknown_mode_falls_back_to_cancel():
+    assert InflightRequests("drop").mode == "cancel"
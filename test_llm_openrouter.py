@@ -0,0 +1,73 @@
+"""
+OpenRouter client against a local fake endpoint (see conftest.py).
+
+Run: python -m pytest -q test_llm_openrouter.py
+"""
+import asyncio
+
+import pytest
+
+from llm import OpenRouterClient
+from llm.errors import OpenRouterError
+
+
+def make_client(**kwargs):
+    client = OpenRouterClient("test-key", **kwargs)
+    client.cache = None
+    return client
+
+
+def test_requests_share_one_keep_alive_session(openrouter):
+    async def main():
+        client = make_client()
+        first = await client.complete([{"role": "user", "content": "привет"}], "a")
+        session = client._session
+        second = await client.complete([{"role": "user", "content": "ещё"}], "a")
+        assert client._session is session
+        await client.close()
+        return first, second, session.closed
+
+    assert asyncio.run(main()) == ("ответ a", "ответ a", True)
+
+
+def test_malformed_200_bodies_fall_through_the_chain(openrouter):
+    openrouter.modes.update({"html": "html", "list": "list"})
+
+    async def main():
+        client = make_client()
+        try:
+            with pytest.raises(OpenRouterError) as error:
+                await client.complete([{"role": "user", "content": "?"}], "html")
+            assert error.value.status == 200
+            answer = await client.chat([{"role": "user", "content": "?"}], ["list", "ok"])
+            return answer, client.usage.snapshot()["models"]
+        finally:
+            await client.close()
+
+    answer, usage = asyncio.run(main())
+    assert answer == "ответ ok"
+    assert usage["html"]["failures"] == 1
+    assert usage["list"]["failures"] == 1
+    assert usage["ok"] == {"requests": 1, "failures": 0, "exhausted": False}
+
+
+def test_missing_key_fails_without_a_request(openrouter):
+    async def main():
+        client = OpenRouterClient("")
+        with pytest.raises(OpenRouterError) as error:
+            await client.chat([{"role": "user", "content": "?"}], ["a", "b"])
+        await client.close()
+        return error.value
+
+    assert asyncio.run(main()).is_auth_error
+    assert openrouter.requests == []
+
+
+def test_a_new_event_loop_gets_a_new_session(openrouter):
+    client = make_client()
+    asyncio.run(client.complete([{"role": "user", "content": "1"}], "a"))
+    stale = client._session
+    assert asyncio.run(client.complete([{"role": "user", "content": "2"}], "a")) == "ответ a"
+    assert client._session is not stale
+    assert stale.closed
+    asyncio.run(client.close())
@@ -0,0 +1,181 @@
+"""
+LLM admission control and the daily usage ledger.
+
+Run: python -m pytest -q test_llm_scheduler.py
+"""
+import asyncio
+
+import pytest
+
+from llm import OpenRouterClient
+from llm.errors import QuotaExhausted, UserRateLimited
+from llm.scheduler import PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_COMMAND, LLMScheduler
+from llm.usage import UsageLedger
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def admitted_order(scheduler, requests):
+    """Fill every slot, queue `requests` (user, priority), then release; returns grant order"""
+    order = []
+    release = asyncio.Event()
+
+    async def hold():
+        async with scheduler.slot(None, PRIORITY_CHAT):
+            await release.wait()
+
+    async def request(user_id, priority):
+        async with scheduler.slot(user_id, priority):
+            order.append((user_id, priority))
+            await asyncio.sleep(0)
+
+    holders = [asyncio.create_task(hold()) for _ in range(scheduler.max_concurrency)]
+    await asyncio.sleep(0)
+    waiters = []
+    for user_id, priority in requests:
+        waiters.append(asyncio.create_task(request(user_id, priority)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*holders, *waiters)
+    return order
+
+
+def test_waiting_requests_go_by_priority_then_round_robin_between_users():
+    scheduler = LLMScheduler(max_concurrency=1, user_burst=0)
+    requests = [("bg", PRIORITY_BACKGROUND), ("cmd", PRIORITY_COMMAND),
+                ("alice", PRIORITY_CHAT), ("alice", PRIORITY_CHAT), ("alice", PRIORITY_CHAT),
+                ("bob", PRIORITY_CHAT)]
+    order = asyncio.run(admitted_order(scheduler, requests))
+    assert [user for user, _ in order] == ["alice", "bob", "alice", "alice", "cmd", "bg"]
+    assert scheduler.snapshot()["active"] == 0
+
+
+def test_background_work_never_takes_every_slot():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=2, background_concurrency=1, user_burst=0)
+        running = []
+        gate = asyncio.Event()
+
+        async def background():
+            async with scheduler.slot(priority=PRIORITY_BACKGROUND):
+                running.append("bg")
+                await gate.wait()
+
+        tasks = [asyncio.create_task(background()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert running == ["bg"]
+        async with scheduler.slot("alice"):
+            running.append("chat")  # the second slot is still free for chat
+        gate.set()
+        await asyncio.gather(*tasks)
+        return running
+
+    assert asyncio.run(main()) == ["bg", "chat", "bg"]
+
+
+def test_user_bucket_refills_over_time():
+    clock = Clock()
+    scheduler = LLMScheduler(user_rate_per_min=6, user_burst=2, clock=clock)
+
+    async def request(user_id="alice", priority=PRIORITY_CHAT):
+        async with scheduler.slot(user_id, priority):
+            pass
+
+    asyncio.run(request())
+    asyncio.run(request())
+    with pytest.raises(UserRateLimited) as error:
+        asyncio.run(request())
+    assert error.value.retry_after == pytest.approx(10)
+    # Other users and background work are not affected
+    asyncio.run(request("bob"))
+    asyncio.run(request(priority=PRIORITY_BACKGROUND))
+
+    clock.now += 10
+    asyncio.run(request())
+    assert scheduler.stats["rate_limited"] == 1
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        scheduler = LLMScheduler(max_concurrency=1, user_burst=0)
+        async with scheduler.slot("alice"):
+            waiter = asyncio.create_task(scheduler.slot("bob").__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+        return scheduler.snapshot()
+
+    snapshot = asyncio.run(main())
+    assert (snapshot["active"], snapshot["waiting"]) == (0, 0)
+
+
+def test_ledger_marks_daily_limit_and_free_tier_exhaustion():
+    days = ["2026-05-10"]
+    ledger = UsageLedger(free_daily_limit=3, today=lambda: days[0])
+
+    async def main():
+        await ledger.record("paid/model", ok=False, exhausted=True)
+        for _ in range(3):
+            await ledger.record("a:free", ok=True)
+
+    asyncio.run(main())
+    assert ledger.is_exhausted("paid/model")
+    assert ledger.available(["a:free", "b:free", "other/model"]) == ["other/model"]
+
+    days[0] = "2026-05-11"  # quotas reset at UTC midnight
+    assert ledger.available(["a:free", "paid/model"]) == ["a:free", "paid/model"]
+
+
+def test_ledger_survives_a_restart(db):
+    async def main():
+        ledger = UsageLedger()
+        ledger.attach(db)
+        await ledger.record("m:free", ok=True)
+        await ledger.record("m:free", ok=False, exhausted=True)
+
+    asyncio.run(main())
+    restored = UsageLedger()
+    restored.attach(db)
+    assert restored.snapshot()["models"]["m:free"] == {"requests": 2, "failures": 1, "exhausted": True}
+
+
+def test_client_skips_exhausted_models_and_counts_daily_limits(openrouter):
+    openrouter.modes["limited:free"] = "daily_limit"
+
+    async def main():
+        client = OpenRouterClient("test-key")
+        client.cache = None
+        try:
+            assert await client.chat([{"role": "user", "content": "1"}], ["limited:free", "ok"]) == "ответ ok"
+            assert await client.chat([{"role": "user", "content": "2"}], ["limited:free", "ok"]) == "ответ ok"
+            with pytest.raises(QuotaExhausted):
+                await client.chat([{"role": "user", "content": "3"}], ["limited:free"])
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    assert openrouter.requests == ["limited:free", "ok", "ok"]
+
+
+def test_cancelled_streams_are_counted(openrouter):
+    openrouter.modes["m"] = "slow_stream"
+    openrouter.delay = 0.2
+
+    async def main():
+        client = OpenRouterClient("test-key")
+        client.cache = None
+        try:
+            stream = client.stream([{"role": "user", "content": "?"}], "m")
+            await stream.__anext__()
+            await stream.aclose()
+        finally:
+            await client.close()
+        return client.usage.snapshot()["models"]["m"]
+
+    assert asyncio.run(main()) == {"requests": 1, "failures": 1, "exhausted": False}
@@ -0,0 +1,93 @@
+"""
+Rolling chat summaries (the summarizing model is faked).
+
+Run: python -m pytest -q test_llm_summarizer.py
+"""
+import asyncio
+import contextlib
+
+from llm.context import SUMMARY_PREFIX
+from llm.summarizer import ChatSummarizer
+
+
+class FakeClient:
+    def __init__(self, answer="конспект"):
+        self.answer = answer
+        self.prompts = []
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id=None, priority=None):
+        yield
+
+    async def complete(self, messages, model, **kwargs):
+        self.prompts.append(messages)
+        return self.answer
+
+
+def chat(db, user_id, count):
+    db.add_or_update_user(user_id, "u", "U")
+    for i in range(count):
+        db.add_message(user_id, "user" if i % 2 == 0 else "assistant", f"реплика {i}")
+
+
+def test_older_turns_are_folded_and_recent_ones_kept(db):
+    chat(db, 1, 6)
+    client = FakeClient()
+    summarizer = ChatSummarizer(db, client, trigger=4, keep_recent=2, enabled=True)
+
+    assert asyncio.run(summarizer.refresh(1))
+    prompt = client.prompts[0][1]["content"]
+    assert "реплика 3" in prompt and "реплика 4" not in prompt
+
+    state = db.get_chat_summary(1)
+    assert state["summary"] == "конспект"
+    assert state["fresh_messages"] == 2
+    context = db.get_chat_context(1)
+    assert context[0] == {"role": "system", "content": SUMMARY_PREFIX + "конспект"}
+    assert [m["content"] for m in context[1:]] == ["реплика 4", "реплика 5"]
+
+    # Not enough new turns for another call
+    assert not asyncio.run(summarizer.refresh(1))
+    assert len(client.prompts) == 1
+
+
+def test_next_refresh_builds_on_the_previous_summary(db):
+    chat(db, 1, 6)
+    client = FakeClient()
+    summarizer = ChatSummarizer(db, client, trigger=4, keep_recent=2, enabled=True)
+    asyncio.run(summarizer.refresh(1))
+    db.add_message(1, "user", "реплика 6")
+    db.add_message(1, "assistant", "реплика 7")
+
+    client.answer = "конспект 2"
+    assert asyncio.run(summarizer.refresh(1))
+    assert "Текущий конспект:\nконспект" in client.prompts[1][1]["content"]
+    assert db.get_chat_summary(1)["fresh_messages"] == 2
+
+
+def test_stale_summary_is_not_saved(db):
+    chat(db, 1, 4)
+    db.flush_chat_history()
+    turns = db.get_chat_turns_after(1, 0, 10)
+    assert db.save_chat_summary(1, "новый", turns[-1]["id"])
+    assert not db.save_chat_summary(1, "старый", turns[0]["id"])
+    assert db.get_chat_summary(1)["summary"] == "новый"
+
+    # Cleared history drops the summary, and a late write for it is refused
+    db.clear_chat_history(1)
+    assert db.get_chat_summary(1) is None
+    assert not db.save_chat_summary(1, "поздний", turns[-1]["id"])
+
+
+def test_schedule_runs_one_refresh_per_user_at_a_time(db):
+    chat(db, 1, 6)
+    client = FakeClient()
+    summarizer = ChatSummarizer(db, client, trigger=4, keep_recent=2, enabled=True)
+
+    async def main():
+        summarizer.schedule(1)
+        summarizer.schedule(1)
+        await summarizer.close()
+
+    asyncio.run(main())
+    assert len(client.prompts) == 1
@@ -0,0 +1,56 @@
+"""
+Local news classification with the compiled keyword matcher.
+
+Run: python -m pytest -q test_news_classifier.py
+"""
+import re
+
+from news_classifier import KeywordMatcher, NewsClassifier, _trie_regex, classifier
+
+
+def test_trie_regex_matches_the_same_words_as_a_plain_alternation():
+    words = ["рост", "ростов", "рок", "war", "win", "w"]
+    pattern = re.compile(f"^(?:{_trie_regex(words)})$")
+    for word in words:
+        assert pattern.match(word)
+    for word in ["ро", "роста", "wa", "wi", ""]:
+        assert not pattern.match(word)
+
+
+def test_short_ascii_keywords_must_be_whole_words():
+    matcher = KeywordMatcher({"ai": ["ai"], "war": ["war"]})
+    assert matcher.scores("AI beats humans") == {"ai": 1.0}
+    assert matcher.scores("He said it was warm and rainy") == {}
+    assert matcher.scores("trade wars") == {"war": 1.0}
+
+
+def test_stems_match_inflected_forms_at_word_starts_only():
+    matcher = KeywordMatcher({"tech": ["технолог"]})
+    assert matcher.scores("Новые технологии и технологический рост") == {"tech": 2.0}
+    assert matcher.scores("биотехнологии") == {}
+
+
+def test_longer_keyword_also_counts_for_the_stem_it_starts_with():
+    matcher = KeywordMatcher({"world": ["война"], "negative": ["войн"]}, {"войн": 2})
+    assert matcher.scores("Война") == {"world": 1.0, "negative": 2.0}
+    assert matcher.scores("войны") == {"negative": 2.0}
+
+
+def test_titles_weigh_more_than_summaries():
+    result = NewsClassifier().classify("Рекорд SpaceX", "Ракета упала, кризис")
+    assert result["category"] == "space"
+    assert result["sentiment"] == "positive"
+
+
+def test_batch_scan_matches_item_by_item_classification():
+    items = [
+        {"title": "Бишкек: рост экономики", "summary": "Кыргызстан показал успех"},
+        {"title": "Nvidia releases new neural chip", "summary": "Deep learning breakthrough"},
+        {"title": "Погода", "summary": ""},
+        {"title": "Market crash", "summary": "Bitcoin loss and layoffs"},
+    ]
+    batch = classifier.classify_batch(items)
+    assert batch == [classifier.classify(item["title"], item["summary"]) for item in items]
+    assert [r["category"] for r in batch] == ["kyrgyzstan", "ai", "other", "finance"]
+    assert [r["sentiment"] for r in batch] == ["positive", "positive", "neutral", "negative"]
+    assert classifier.classify_batch([]) == []
@@ -0,0 +1,80 @@
+"""
+Digest timing: next_fire_time, the DigestTimer heap and schedule changes.
+
+Run: python -m pytest -q test_news_scheduler.py
+"""
+import asyncio
+from datetime import datetime
+
+from news_scheduler import DigestTimer, NewsScheduler, next_fire_time, parse_schedule_time
+
+
+NOW = datetime(2026, 5, 10, 12, 30)
+
+
+def test_parse_schedule_time_rejects_malformed_values():
+    assert parse_schedule_time("9:05") == (9, 5)
+    assert parse_schedule_time("24:00") is None
+    assert parse_schedule_time("nine") is None
+
+
+def test_next_fire_time_catches_up_recent_slots_only():
+    # Later today
+    assert next_fire_time("18:00", None, NOW) == datetime(2026, 5, 10, 18, 0)
+    # Missed this morning, within the catch-up window: due now
+    assert next_fire_time("09:00", None, NOW) == datetime(2026, 5, 10, 9, 0)
+    # Already sent today: tomorrow
+    assert next_fire_time("09:00", datetime(2026, 5, 10, 9, 1), NOW) == datetime(2026, 5, 11, 9, 0)
+    # Missed by more than DIGEST_CATCHUP_HOURS: tomorrow
+    assert next_fire_time("00:10", None, datetime(2026, 5, 10, 23, 0)) == datetime(2026, 5, 11, 0, 10)
+    assert next_fire_time("bad", None, NOW) is None
+
+
+def test_timer_pops_due_users_and_skips_stale_entries():
+    timer = DigestTimer()
+    now = datetime.now().timestamp()
+    timer.schedule(1, "00:00", last_sent=datetime.now())  # tomorrow
+    timer.schedule(2, datetime.now().strftime("%H:%M"))    # due now
+    timer.schedule(3, datetime.now().strftime("%H:%M"))
+    timer.cancel(3)
+
+    assert timer.pop_due(now + 1) == [2]
+    assert timer.pop_due(now + 1) == []
+    assert 0 < timer.seconds_until_next(now) <= 24 * 3600
+    assert len(timer) == 2  # user 2 stays enabled until cancelled
+
+    timer.done(2, datetime.now())
+    assert timer.pop_due(now + 1) == []
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = asyncio.Queue()
+
+    async def send_message(self, user_id, text, **kwargs):
+        await self.sent.put((user_id, text))
+
+
+class FakeAggregator:
+    def generate_digest(self, interests, limit=10):
+        return "дайджест: " + ", ".join(interests)
+
+
+def test_schedule_change_wakes_the_running_scheduler(db):
+    async def main():
+        bot = FakeBot()
+        scheduler = NewsScheduler(bot, db, FakeAggregator())
+        task = asyncio.create_task(scheduler.start(collect=False))
+        await asyncio.sleep(0.1)
+
+        db.add_or_update_user(7, "u", "U")
+        db.add_user_interest(7, "ai")
+        await db.aio.set_digest_schedule(7, True, datetime.now().strftime("%H:%M"))
+        user_id, text = await asyncio.wait_for(bot.sent.get(), 5)
+
+        scheduler.stop()
+        await asyncio.wait_for(task, 5)
+        return user_id, text
+
+    assert asyncio.run(main()) == (7, "дайджест: ai")
+    assert db.get_digest_schedules()[0]["last_sent"] is not None
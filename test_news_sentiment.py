@@ -0,0 +1,82 @@
+"""
+Batched news sentiment (the model is faked).
+
+Run: python -m pytest -q test_news_sentiment.py
+"""
+import asyncio
+import contextlib
+import json
+import re
+
+from llm import OpenRouterError
+from news_sentiment import analyze_titles, link_hash, parse_batch, score_news
+
+
+class FakeClient:
+    """Answers each batch prompt; each `skip` headline is left out of one answer"""
+
+    def __init__(self, skip=(), fail_after=None):
+        self.skip = set(skip)
+        self.fail_after = fail_after
+        self.batches = []
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id=None, priority=None):
+        yield
+
+    async def complete(self, messages, model, **kwargs):
+        if self.fail_after is not None and len(self.batches) >= self.fail_after:
+            raise OpenRouterError("HTTP 429: rate limited", status=429, model=model)
+        headlines = re.findall(r"^(\d+)\. (.*)$", messages[0]["content"], re.MULTILINE)
+        self.batches.append([title for _, title in headlines])
+        answer = [{"id": int(number), "sentiment": "negative" if "кризис" in title else "positive",
+                   "score": -0.5 if "кризис" in title else 0.5}
+                  for number, title in headlines if title not in self.skip]
+        self.skip.difference_update(title for _, title in headlines)
+        return "```json\n" + json.dumps(answer, ensure_ascii=False) + "\n```"
+
+
+def test_parse_batch_salvages_valid_objects_from_a_broken_answer():
+    content = ('Вот результат: [{"id": 1, "sentiment": "positive", "score": 0.7}, '
+               '{"id": 2, "sentiment": "angry", "score": 0}, {"id": 3, "sentiment": "negative", "score": -9}, '
+               '{"id": 9, "sentiment": "neutral", "score": 0}, {"id": 4, "sentim')
+    assert parse_batch(content, 4) == {1: ("positive", 0.7), 3: ("negative", -1.0)}
+    assert parse_batch("", 3) == {}
+
+
+def test_only_unparsed_headlines_are_retried():
+    titles = {f"k{i}": f"Новость {i}" for i in range(5)}
+    client = FakeClient(skip={"Новость 1", "Новость 3"})
+    results = asyncio.run(analyze_titles(titles, client, batch_size=3))
+    assert set(results) == set(titles)
+    assert client.batches == [["Новость 0", "Новость 1", "Новость 2"], ["Новость 3", "Новость 4"],
+                              ["Новость 1", "Новость 3"]]
+
+
+def test_model_errors_keep_partial_results():
+    titles = {f"k{i}": f"Новость {i}" for i in range(4)}
+    results = asyncio.run(analyze_titles(titles, FakeClient(fail_after=1), batch_size=2))
+    assert set(results) == {"k0", "k1"}
+
+
+def test_scores_are_cached_by_link(db):
+    items = [{"title": "Экономический кризис", "link": "https://a"},
+             {"title": "Запуск спутника", "link": "https://b"},
+             {"title": "Экономический кризис", "link": "https://a"}]
+    client = FakeClient()
+    assert asyncio.run(score_news(db, items, client)) == 2
+    assert [item["sentiment"] for item in items] == ["negative", "positive", "negative"]
+    assert len(client.batches) == 1 and len(client.batches[0]) == 2
+
+    again = [{"title": "Экономический кризис", "link": "https://a"}]
+    assert asyncio.run(score_news(db, again, client)) == 0
+    assert again[0]["sentiment_score"] == -0.5
+    assert len(client.batches) == 1
+    assert db.get_news_sentiments([link_hash("https://a")])[link_hash("https://a")][0] == "negative"
+
+
+def test_lexicon_result_stays_when_the_model_is_down(db):
+    items = [{"title": "Запуск спутника", "link": "https://c"}]
+    assert asyncio.run(score_news(db, items, FakeClient(fail_after=0))) == 0
+    assert items[0]["sentiment"] in ("positive", "negative", "neutral")
+    assert "sentiment_score" in items[0]
@@ -0,0 +1,63 @@
+"""
+Shared service container and the manual news trigger.
+
+Run: python -m pytest -q test_services.py
+"""
+import asyncio
+
+import services
+from llm import OpenRouterClient
+from news_scheduler import run_scheduler_once
+
+
+def test_adapters_share_one_http_session_until_close(db, monkeypatch):
+    monkeypatch.setattr(services, "get_client", lambda: OpenRouterClient("test-key"))
+
+    async def main():
+        shared = services.Services(db)
+        aggregator = shared.news_aggregator
+        await aggregator.init_session()
+        session = aggregator.session
+        assert session is shared.http_session()
+
+        # The aggregator hands the shared session back instead of closing it
+        await aggregator.close_session()
+        assert not session.closed
+        await aggregator.init_session()
+        assert aggregator.session is session
+
+        await shared.close()
+        assert session.closed
+
+    asyncio.run(main())
+
+
+class FakeAggregator:
+    def __init__(self):
+        self.closed = False
+
+    async def process_and_save_news(self):
+        return 3
+
+    async def close_session(self):
+        self.closed = True
+
+
+def test_manual_trigger_leaves_a_passed_aggregator_open():
+    aggregator = FakeAggregator()
+    assert asyncio.run(run_scheduler_once(None, aggregator)) == 3
+    assert not aggregator.closed
+
+
+def test_manual_trigger_closes_the_aggregator_it_created(monkeypatch):
+    import news_scheduler
+
+    created = []
+
+    def make(db):
+        created.append(FakeAggregator())
+        return created[-1]
+
+    monkeypatch.setattr(news_scheduler, "NewsAggregator", make)
+    assert asyncio.run(run_scheduler_once(None)) == 3
+    assert created[0].closed
@@ -0,0 +1,104 @@
+"""
+Streamed answers rendered into edited Telegram messages (messages are faked).
+
+Run: python -m pytest -q test_telegram_streaming.py
+"""
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
+
+import telegram_streaming
+from telegram_streaming import CURSOR, TELEGRAM_MESSAGE_LIMIT, StreamingReply, split_point
+
+
+class FakeMessage:
+    """Records edits; `errors` are raised by the next edit_text calls"""
+
+    def __init__(self, chat, text=""):
+        self.chat = chat
+        self.text = text
+        self.errors = []
+        chat.append(self)
+
+    async def edit_text(self, text):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.text = text
+
+    async def answer(self, text):
+        return FakeMessage(self.chat, text)
+
+
+async def deltas(*parts):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    async def sleep(_):
+        pass
+    monkeypatch.setattr(telegram_streaming.asyncio, "sleep", sleep)
+
+
+def test_split_point_prefers_paragraph_then_line_then_word_breaks():
+    assert split_point("short", 10) == 5
+    assert split_point("aaaaaaa\n\nbb\ncc", 12) == 9
+    assert split_point("aaaa bbbb\ncccc", 12) == 10
+    assert split_point("aaaaaa bbbbbbbbb", 12) == 7
+    assert split_point("x" * 30, 12) == 12
+
+
+def test_answer_replaces_the_status_message():
+    chat = []
+    status = FakeMessage(chat, "⏳ думаю…")
+    text = asyncio.run(StreamingReply(status, header="🤖 ", interval=0).consume(deltas("При", "вет", "!")))
+    assert text == "Привет!"
+    assert [m.text for m in chat] == ["🤖 Привет!"]
+
+
+def test_long_answer_continues_in_new_messages():
+    chat = []
+    words = [f"слово{i} " for i in range(1200)]
+    text = asyncio.run(StreamingReply(FakeMessage(chat), interval=0).consume(deltas(*words)))
+    assert len(chat) >= 2
+    assert all(len(m.text) <= TELEGRAM_MESSAGE_LIMIT for m in chat)
+    assert not any(m.text.endswith(CURSOR) for m in chat)
+    assert " ".join(m.text for m in chat).split() == text.split()
+
+
+def test_lost_message_continues_in_a_new_one():
+    chat = []
+    status = FakeMessage(chat)
+    status.errors = [TelegramBadRequest(None, "Bad Request: message to edit not found")] * 5
+    text = asyncio.run(StreamingReply(status, interval=0).consume(deltas("один ", "два ", "три")))
+    assert text == "один два три"
+    assert len(chat) == 2
+    assert chat[1].text == "один два три"
+
+
+def test_not_modified_is_not_treated_as_lost():
+    chat = []
+    status = FakeMessage(chat)
+    status.errors = [TelegramBadRequest(None, "Bad Request: message is not modified")]
+    asyncio.run(StreamingReply(status, interval=0).consume(deltas("a", "b")))
+    assert len(chat) == 1
+    assert chat[0].text == "ab"
+
+
+def test_network_errors_skip_frames_but_not_the_final_text():
+    chat = []
+    status = FakeMessage(chat)
+    status.errors = [TelegramNetworkError(None, "timeout")] * 3
+    asyncio.run(StreamingReply(status, interval=0).consume(deltas("a", "b", "c")))
+    assert [m.text for m in chat] == ["abc"]
+
+
+def test_unreachable_chat_stops_rendering_but_keeps_the_text():
+    chat = []
+    status = FakeMessage(chat)
+    status.errors = [TelegramForbiddenError(None, "Forbidden: bot was blocked by the user")]
+    reply = StreamingReply(status, interval=0)
+    assert asyncio.run(reply.consume(deltas("a", "b"))) == "ab"
+    assert chat[0].text == ""